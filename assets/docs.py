@@ -79,6 +79,12 @@ Running mode (optional):
 
   /c  : Display webGobbler configuration GUI and exit.
 
+  --replay filename
+      Generate again the images recorded in a replay log (see --replaylog)
+      with the images of the image pool directory (--pooldirectory), then exit.
+      Images are saved next to the log (render.log gives render-1.bmp,
+      render-2.bmp...) and compared with the recorded images.
+
   --guiconfig
       Display webGobbler configuration GUI and exit.
       Other parameters specified in the command-line will be ignored.
@@ -150,6 +156,16 @@ Options (optionnal):
           0 = standard superpose (Add+Equalize) [RECOMMENDED - better results]
           1 = old method (Darken+Add+AutoContrast)
 
+  --seed N
+      Seed of the random choices (images taken from the pool, rotations,
+      positions...) so that the same images are generated from the same pool.
+      (Default: 0 = random seed)
+
+  --replaylog filename
+      Record the images used for each generated image and the random
+      decisions made for each of them in this file, so that the images can
+      be generated again with --replay (from a copy of the image pool).
+
   --keepimage
       Do not delete images from the image pool after use.
       Images will be reused and when the pool is full, no new image will
@@ -17,9 +17,11 @@ except ImportError:
 try:
     from collectors.local import collector_local
     from collectors.meta import commandToken
+    from collectors.engine import asyncCollectorEngine
 except ImportError:
     from local import collector_local
     from meta import commandToken
+    from engine import asyncCollectorEngine
 
 # The known collectors:
 ALL_COLLECTORS = [
@@ -8,9 +8,9 @@ import hashlib
 import random
 
 try:
-    from collectors.meta import collector, internetImage
+    from collectors.meta import collector
 except ImportError:
-    from meta import collector, internetImage
+    from meta import collector
 
 class collector_deviantart(collector):
     ''' This collector gets random images from http://deviantART.com, an excellent
@@ -148,13 +148,7 @@ class collector_deviantart(collector):
             else: # Page contains a link to an image
                 self.imageurltoget = results[0][0]
         else: # Download an image.
-            self._logDebug(self.imageurltoget)
-            self._setCurrentStatus('Downloading',self.imageurltoget)
-            i = internetImage(self.imageurltoget,self.CONFIG)  # Download the image
-            if i.isNotAnImage:
-                self._logDebug("Image discarded because %s." % i.discardReason)
-            else:  # We do not make other checks on the image. We always consider the image is OK.
-                i.saveToDisk(self.CONFIG["pool.imagepooldirectory"])
-                self.numberOfImagesToGet -= 1   # One less !
-            self.imageurltoget = ""
+            if self._downloadSlots() > 0:
+                self._downloadImage(self.imageurltoget)  # Download the image (or queue it for the download workers)
+                self.imageurltoget = ""
             return
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+
+try:
+    from collectors.meta import internetImage
+except ImportError:
+    from meta import internetImage
+from utils import asynchttp
+from utils.httppool import getProxy
+
+class asyncCollectorEngine(threading.Thread):
+    ''' Runs several collectors in a single thread with an asyncio event loop,
+        instead of running each collector (and its download workers) in its own threads.
+        Image downloads are coroutines using non-blocking HTTP (utils.asynchttp),
+        so hundreds of downloads can be in flight with a single thread.
+        The collectors code (_getRandomImage(), which queries the websites) is
+        synchronous: it runs in a small thread pool shared by all collectors
+        and the image URLs it finds are downloaded by the event loop.
+        Collectors are controlled as usual (collectNonStop(), stopcollecting(),
+        shutdown()...) and still report their status with getCurrentStatus().
+        Used by: imagePool (when collector.engine is "asyncio").
+
+        Example:
+            engine = asyncCollectorEngine(collectors,config)
+            engine.start()
+            for c in collectors: c.collectNonStop()
+            ...
+            for c in collectors: c.shutdown()
+            engine.join()
+    '''
+    def __init__(self,collectors,config):
+        ''' collectors (list of collector objects): the collectors to run.
+              (They must not be started as threads.)
+            config (applicationConfig object) : the program configuration
+        '''
+        threading.Thread.__init__(self)
+        self.name = "collector_engine"
+        self.collectors = collectors
+        self.CONFIG = config
+        self.maxInFlight = max(1,self.CONFIG["collector.asyncio.maxinflight"])  # Maximum number of simultaneous downloads
+        self.loop = None              # The asyncio event loop (created when the thread starts)
+        self._wakeUpEvents = {}       # One asyncio.Event per collector, set when a command is posted to the collector.
+        self._inFlight = None         # asyncio.Semaphore limiting the number of simultaneous downloads
+        self._pendingLock = threading.Lock()  # Lock for self._pending
+        self._pending = {}            # Number of downloads scheduled for each collector (key=collector)
+        self._harvesters = None       # Thread pool running the collectors _getRandomImage() method
+        self._sslContext = asynchttp.defaultSslContext()  # (Created here: loading the CA certificates would block the event loop.)
+        self._connections = None      # Keep-alive connections of the downloads (asynchttp.asyncConnectionPool), None if network.http.keepalive is disabled.
+        for collector in self.collectors:
+            collector.engine = self
+            self._pending[collector] = 0
+
+    def _logDebug    (self,message): logging.getLogger(self.name).debug    (message)
+    def _logException(self,message): logging.getLogger(self.name).exception(message)
+
+    def run(self):
+        ''' Main thread loop: runs the event loop until all collectors are shut down. '''
+        self._harvesters = concurrent.futures.ThreadPoolExecutor(max_workers=max(1,len(self.collectors)),
+                                                                 thread_name_prefix=self.name)
+        try:
+            asyncio.run(self._main())
+        except Exception as exc:
+            self._logException(exc)
+        finally:
+            self._harvesters.shutdown(wait=True)
+            self._logDebug("Stopped.")
+
+    async def _main(self):
+        self._inFlight = asyncio.Semaphore(self.maxInFlight)
+        for collector in self.collectors:
+            self._wakeUpEvents[collector] = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        if self.CONFIG["network.http.keepalive"]:
+            self._connections = asynchttp.asyncConnectionPool(self.CONFIG["network.http.keepalive.maxidle"],
+                                                              self.CONFIG["network.http.keepalive.idletimeout"],self._sslContext)
+        # (Downloads still running when all collectors are shut down are cancelled by asyncio.run())
+        try:
+            await asyncio.gather(*[self._runCollector(collector) for collector in self.collectors])
+        finally:
+            if self._connections is not None:
+                self._connections.closeAll()
+
+    def wakeUp(self,collector):
+        ''' Tells the event loop a command was posted to this collector (can be called from any thread). '''
+        loop = self.loop
+        if loop is None:
+            return  # The collectors will read their command queue when the loop starts.
+        try:
+            loop.call_soon_threadsafe(self._wakeUpEvents[collector].set)
+        except RuntimeError:
+            pass  # The event loop is already closed.
+
+    async def _runCollector(self,collector):
+        ''' Collector loop (the equivalent of collector.run() when it runs in its own thread.) '''
+        wakeUp = self._wakeUpEvents[collector]
+        while True:
+            wakeUp.clear()
+            try:
+                commandToken = collector.inputCommandQueue.get_nowait()  # Get orders
+                if not collector._handleCommand(commandToken):
+                    return  # Shutdown
+                continue
+            except queue.Empty:
+                pass
+            if collector.continuousCollect or collector.numberOfImagesToGet > 0:
+                if collector.continuousCollect:
+                    collector._setImagesToGet(1,True)
+                try:
+                    await self.loop.run_in_executor(self._harvesters,collector._getRandomImage)
+                except Exception as exc:
+                    collector._logException(exc)  # Log any unexpected exception
+                try:  # Wait a little before next query (a command wakes us up immediately.)
+                    await asyncio.wait_for(wakeUp.wait(),0.25)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await wakeUp.wait()  # Nothing to do until we receive a command.
+
+    def downloadSlots(self,collector):
+        ''' Returns the number of image URLs this collector can pass to download() right now. '''
+        with self._pendingLock:
+            pending = self._pending[collector]
+        if collector.continuousCollect:
+            wanted = self.maxInFlight
+        else:
+            wanted = min(self.maxInFlight,collector.numberOfImagesToGet)
+        return max(0,wanted-pending)
+
+    def download(self,collector,imageurl):
+        ''' Schedules the download of an image on the event loop (can be called from any thread). '''
+        with self._pendingLock:
+            self._pending[collector] += 1
+        try:
+            asyncio.run_coroutine_threadsafe(self._download(collector,imageurl),self.loop)
+        except RuntimeError:  # The event loop is already closed.
+            with self._pendingLock:
+                self._pending[collector] -= 1
+
+    async def _download(self,collector,imageurl):
+        ''' Downloads an image and saves it in the image pool directory. '''
+        try:
+            async with self._inFlight:
+                if not (collector.continuousCollect or collector.numberOfImagesToGet > 0):
+                    return  # We got enough images while this URL was waiting.
+                collector._logDebug(imageurl)
+                collector._setCurrentStatus('Downloading',imageurl)
+                i = internetImage(imageurl,self.CONFIG,download=False)
+                if not i.discardReason:  # (URL is not blacklisted)
+                    await self._transfer(i)
+                if i.isNotAnImage:
+                    collector._logDebug("Image discarded because %s." % i.discardReason)
+                else:
+                    # (Writing the file and updating the pool index block: do not stall the other downloads.)
+                    await self.loop.run_in_executor(None,i.saveToDisk,self.CONFIG["pool.imagepooldirectory"])
+                    collector._imageKept()
+        except Exception as exc:
+            collector._logException(exc)  # Log any unexpected exception
+        finally:
+            with self._pendingLock:
+                self._pending[collector] -= 1
+
+    async def _transfer(self,image):
+        ''' Downloads the data of an internetImage (created with download=False). '''
+        request_headers = { 'User-Agent': self.CONFIG["network.http.useragent"] }
+        try:
+            response = await asynchttp.urlopen(image.imageurl,request_headers,getProxy(self.CONFIG,image.imageurl),
+                                               pool=self._connections,sslcontext=self._sslContext)
+        except Exception as exc:
+            image._requestFailed(exc)
+            return  # Discard this image.
+        try:
+            if not image._acceptResponse(response.info().get_content_type(),response):
+                return
+            while True:
+                data = await response.read(65536)
+                if not data or not image._feed(data):
+                    break
+        except Exception:
+            image.discardReason = "error while downloading image"
+            return  # Discard image if there was a problem downloading it.
+        finally:
+            response.close()
+        image._complete()
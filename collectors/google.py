@@ -7,9 +7,9 @@ import hashlib
 import random
 
 try:
-    from collectors.meta import collector, internetImage
+    from collectors.meta import collector
 except ImportError:
-    from meta import collector, internetImage
+    from meta import collector
 
 class collector_googleimages(collector):
     ''' Get images from random queries on Google Image search.
@@ -67,14 +67,7 @@ class collector_googleimages(collector):
                             if not imageurl.startswith("http://"): imageurl = "http://"+imageurl
                             self.imageurls[imageurl] = 0  # Put in the dictionnary to remove duplicates
         else:  # Download images:
-            if len(self.imageurls)>0:
+            for n in range(min(self._downloadSlots(),len(self.imageurls))):
                 imageurl = random.choice(list(self.imageurls.keys()))  # Choose a random image URL.
                 del self.imageurls[imageurl]  # Remove it from list
-                self._logDebug(imageurl)
-                self._setCurrentStatus('Downloading',imageurl)
-                i = internetImage(imageurl,self.CONFIG)   # Download the image
-                if i.isNotAnImage:
-                    self._logDebug("Image discarded because %s." % i.discardReason)
-                else:  # We do not make other checks on the image. We always consider the image is OK.
-                    i.saveToDisk(self.CONFIG["pool.imagepooldirectory"])
-                    self.numberOfImagesToGet -= 1   # One less !
+                self._downloadImage(imageurl)   # Download the image (or queue it for the download workers)
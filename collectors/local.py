@@ -6,9 +6,9 @@ import hashlib
 import random
 
 try:
-    from collectors.meta import collector
+    from collectors.meta import collector, savePoolFile
 except ImportError:
-    from meta import collector
+    from meta import collector, savePoolFile
 
 class collector_local(collector):
     ''' This collector does not use the internet and only searches local harddisks
@@ -71,7 +71,7 @@ class collector_local(collector):
                 imagedata = file.read(2000000) # Max 2 Mb for local images
                 file.close()
             except:
-                imagedata = ''  # Discard image if there was a problem reading the file.
+                imagedata = b''  # Discard image if there was a problem reading the file.
 
             if (len(imagedata)>0) and (len(imagedata) < 2000000):
                 # Compute filename from file SHA1
@@ -79,11 +79,8 @@ class collector_local(collector):
                 if imagesha1 not in self.CONFIG["blacklist.imagesha1"]:
                     extension = filepath[filepath.rfind("."):].lower()  # Get file extension
                     outputfilename = 'WG'+imagesha1+extension   # SHA1 in hex + original image extension
-                    imagedata += self.CONFIG["pool.sourcemark"] + filepath   # Add original URL in image file
+                    sourcemark = (self.CONFIG["pool.sourcemark"] + filepath).encode()   # Add original URL in image file
                     # and save the image to disk.
-                    # FIXME: try/except file creation:
-                    file = open(os.path.join(self.CONFIG["pool.imagepooldirectory"],outputfilename),"w+b")
-                    file.write(imagedata)
-                    file.close()
+                    savePoolFile(self.CONFIG["pool.imagepooldirectory"],outputfilename,[imagedata,sourcemark])
                     time.sleep(0.25) #Be gentle with other threads
 
@@ -8,25 +8,86 @@ import urllib.request, urllib.parse, urllib.error
 import re
 import time
 import hashlib
+import io
 import random
 import glob
 import logging
 
-from PIL import ImageFile
+from PIL import Image, ImageFile
+
+import settings
+from utils.httppool import openUrl
+from utils.poolindex import getPoolIndex
 
 class commandToken:
     ''' Command tokens used to send commands to threads. '''
-    def __init__(self, shutdown=None, stopcollecting=None, collect=None, collectnonstop=None,superpose=None):
+    def __init__(self, shutdown=None, stopcollecting=None, collect=None, collectnonstop=None,superpose=None,refill=None,imageavailable=None):
         self.shutdown = shutdown                # Collector and pool: Order to shutdown. The thread should stop working and quit (exit the run() method.)
         self.collect = collect                  # Collector: Collect n images and stop. (value = the number of images to collect)
         self.collectnonstop = collectnonstop    # Collector: Collect images continuously
         self.stopcollecting = stopcollecting    # Collector: The treads should stop collecting images, but not shutdown.
         self.superpose = superpose              # Assembler_superpose: Superpose images now.
+        self.refill = refill                    # Pool: An image was taken from the output queue (put another one.)
+        self.imageavailable = imageavailable    # Assembler_superpose: The pool has an image available.
+
+# Maximum number of buffers written by a single os.writev() call.
+IOV_MAX = 1024
+if hasattr(os,'sysconf'):
+    try:
+        IOV_MAX = os.sysconf('SC_IOV_MAX')
+    except (ValueError,OSError):
+        pass
+
+def writeBuffers(file,buffers):
+    ''' Writes several buffers in a file without concatenating them.
+        Uses os.writev() when available (a single system call, and no copy of the data).
+        Input: file: a file object opened in binary mode without buffering (buffering=0)
+               buffers (list of bytes-like objects): the data to write.
+    '''
+    if not hasattr(os,'writev'):  # (eg. Windows)
+        for buffer in buffers:
+            file.write(buffer)
+        return
+    views = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    fd = file.fileno()
+    while views:
+        written = os.writev(fd,views[:IOV_MAX])
+        while views and written >= len(views[0]):  # Skip the buffers completely written...
+            written -= len(views[0])
+            del views[0]
+        if written:                                 # ...and the written part of the next one.
+            views[0] = views[0][written:]
+
+def savePoolFile(destinationDirectory,filename,buffers):
+    ''' Saves an image file in the image pool directory and registers it in the pool index.
+        The file is written under a temporary name, then renamed, so that the pool
+        never sees incomplete files.
+        Input: destinationDirectory (string): the image pool directory.
+               filename (string): name of the file (without path).
+               buffers (list of bytes-like objects): the file content.
+        Output: True if the file was saved.
+    '''
+    filepath = os.path.join(destinationDirectory,filename)
+    try:
+        with open(filepath+'.part','wb',buffering=0) as file:
+            writeBuffers(file,buffers)
+        os.replace(filepath+'.part',filepath)
+    except OSError:
+        try:
+            os.remove(filepath+'.part')  # Do not leave an incomplete file in the pool directory.
+        except OSError:
+            pass
+        return False  # Ignore this image... nevermind.
+    getPoolIndex(destinationDirectory).add(filename)
+    return True
 
 class internetImage:
     ''' An image from the internet.
         Will download the image from the internet and assign a unique name to the image.
         Maximum image size: 2 Mb.  (Download will abort if file is bigger than 2 Mb.)
+        The image is downloaded in chunks and its header is examined as soon as it is
+        received: the download aborts if the image format is not recognized or if the
+        image is smaller than settings.MINIMUM_IMAGE_SIZE.
         Used by: collectors.
      Example:  i = internetImage("http://www.foo.bar/images/foo.jpg",applicationConfig())
                if i.isNotAnImage:
@@ -35,16 +96,25 @@ class internetImage:
                    i.saveToDisk("c:\\my pictures")  # Save the image to disk.
                    i.getImage()    # Get the PIL Image object.
     '''
-    def __init__(self,imageurl,config):
+    def __init__(self,imageurl,config,download=True):
         ''' imageurl (string): url of the image to download.
             config (applicationConfig object) : the program configuration
+            download (boolean): If False, the image is not downloaded by the constructor.
+                      The caller has to transfer the image itself with _acceptResponse(),
+                      _feed() and _complete() (This is used by the asyncio collection engine.)
         '''
         self.imageurl = imageurl  # URL of this image on the internet
-        self.imagedata = None     # Raw binary image data (as downloaded from the internet)
-        self.filename = None      # Image filename (computed from self.imagedata)
+        self.filename = None      # Image filename (computed from the image data)
         self.isNotAnImage = True  # True if this URL is not an image.
         self.discardReason = ""   # Reason why
         self.CONFIG=config
+        self.fileExtension = None # File extension corresponding to the MIME type of the image.
+        self._chunks = []         # Image data received so far (list of bytes objects, as received.)
+        self._receivedSize = 0    # Number of bytes received so far.
+        self._sha1 = hashlib.sha1()  # SHA1 of the image data, computed while the data is received.
+        self._imagedata = None    # Image data in a single buffer (see self.imagedata)
+        self._parser = ImageFile.Parser()  # Parses the image header while downloading (None once the header is checked).
+        self._headerPending = False  # True if the header was not found in the first bytes (it is checked when the download is complete.)
 
         # If the URL of the image matches any of the blacklisted URLs, we discard the image.
         for regexp in self.CONFIG["blacklist.url_re"]:
@@ -52,96 +122,186 @@ class internetImage:
                 self.discardReason = "URL is blacklisted"
                 return  # Discard the image.
 
+        if download:
+            self._download()
+
+    def _download(self):
+        ''' Downloads the image (blocking). '''
         #FIXME: Handle passwords required on some pages (Have to use fancy_url opener or urllib2 ?)
         #       (Those URLs have to be skipped)
 
-        # Build and send the HTTP request:
-        request_headers = { 'User-Agent': self.CONFIG["network.http.useragent"] }
-        request = urllib.request.Request(imageurl, None, request_headers)  # Build the HTTP request
+        # Send the HTTP request (through the shared keep-alive connection pool):
+        try:
+            urlfile = openUrl(self.imageurl, self.CONFIG)
+        except Exception as exc:
+            self._requestFailed(exc)
+            return    # Discard this image.
+        #FIXME: catch HTTPError to catch Authentication requests ? (see urllib2 manual)
+        # (URLs requesting authentication should be discarded.)
+
         try:
-            urlfile = urllib.request.urlopen(request)
-        except urllib.error.HTTPError as exc:
+            if not self._acceptResponse(urlfile.info().get_content_type(), urlfile):
+                return
+            # Then download the image, chunk by chunk:
+            try:
+                while True:
+                    data = urlfile.read(65536)
+                    if not data or not self._feed(data):
+                        break
+            except:
+                self.discardReason = "error while downloading image"
+                return  # Discard image if there was a problem downloading it.
+        finally:
+            urlfile.close()
+        self._complete()
+
+    def _requestFailed(self,exc):
+        ''' Sets the discard reason corresponding to an exception raised by the HTTP request. '''
+        if isinstance(exc,urllib.error.HTTPError):
             if exc.code == 404:
                 self.discardReason = "not found"  # Display a simplified message for HTTP Error 404.
             else:
                 self.discardReason = "HTTP request failed with error %d (%s)" % (exc.code, exc.msg)
-            return    # Discard this image.
             # FIXME: display simplified error message for some other HTTP error codes ?
-        except urllib.error.URLError as exc:
+        elif isinstance(exc,urllib.error.URLError):
             self.discardReason = exc.reason
-            return    # Discard this image.
-        except Exception as exc:
+        else:
             self.discardReason = exc
-            return    # Discard this image.
-        #FIXME: catch HTTPError to catch Authentication requests ? (see urllib2 manual)
-        # (URLs requesting authentication should be discarded.)
 
+    def _acceptResponse(self,MIME_Type,response):
+        ''' Checks the HTTP response headers before the image data is downloaded.
+            Input: MIME_Type (string): the Content-Type of the response (eg."image/jpeg")
+                   response: the response object (its length attribute is the announced
+                             Content-Length, or None).
+            Output: True if the image data should be downloaded.
+        '''
         # If the returned Content-Type is not recognized, ignore the file.
         # ("image/jpeg", "image/gif", etc.)
-        MIME_Type = urlfile.info().get_content_type()
         if MIME_Type not in self.CONFIG["collector.acceptedmimetypes"]:
-            urlfile.close()
             self.discardReason = "not an image (%s)" % MIME_Type
-            return
+            return False
 
         # Get the file extension corresponding to this MIME type
         # (eg. "imag/jpeg" --> ".jpg")
-        file_extension = self.CONFIG["collector.acceptedmimetypes"][MIME_Type]
+        self.fileExtension = self.CONFIG["collector.acceptedmimetypes"][MIME_Type]
 
         # Check image size announced in HTTP response header.
         # (so that we can abort the download right now if the file is too big.)
         file_size = 0
         try:
-            file_size = urlfile.length
+            file_size = response.length
         except AttributeError: # Content-Length does not contains an integer
-            urlfile.close()
             self.discardReason = "bogus data in Content-Length HTTP headers"
-            return  # Discard this image.
+            return False  # Discard this image.
         # Note that Content-Length header can be missing. That's not a problem.
         if file_size is None:
-            urlfile.close()
             self.discardReason = "no size"
-            return  # no size defined !  Discard it.
+            return False  # no size defined !  Discard it.
         elif file_size > self.CONFIG["collector.maximumimagesize"]:
-            urlfile.close()
             self.discardReason = "too big"
-            return  # Image too big !  Discard it.
+            return False  # Image too big !  Discard it.
+        return True
 
-        # Then download the image:
-        try:
-            self.imagedata = urlfile.read(self.CONFIG["collector.maximumimagesize"]) # Max image size: 2 Mb
-        except:
-            self.discardReason = "error while downloading image"
-            urlfile.close()
-            pass  # Discard image if there was a problem downloading it.
-        urlfile.close()
+    def _feed(self,data):
+        ''' Adds downloaded image data.
+            Output: False if the download should be aborted.
+        '''
+        self._chunks.append(data)
+        self._receivedSize += len(data)
+        self._sha1.update(data)
+        if self._receivedSize >= self.CONFIG["collector.maximumimagesize"]:  # Too big, probably not an image.
+            self.discardReason = "too big"
+            return False
+        if self._parser is not None:  # We are still waiting for the image header.
+            return self._checkHeader(data)
+        return True
 
-        # Check image size (can be necessary if Content-Length was not returned in HTTP headers.)
+    def _checkHeader(self,data):
+        ''' Feeds the image parser until it recognizes the image header, then checks image dimensions.
+            Output: False if the download should be aborted.
+        '''
         try:
-            if len(self.imagedata) >= self.CONFIG["collector.maximumimagesize"]:  # Too big, probably not an image.
-                self.discardReason = "too big"
-                return    # Discard the image.
-        except TypeError:  # Happens sometimes on len(self.imagedata):  "TypeError: len() of unsized object"
-            self.imagedata = "no data"
-            return    # Discard the image.
+            self._parser.feed(data)
+        except Exception:  # PIL cannot understand file content.
+            self._parser = None
+            self.discardReason = "not a valid image"
+            return False
+        image = self._parser.image
+        if image is None:  # Header not complete (or not recognized) yet.
+            if self._receivedSize >= settings.IMAGE_HEADER_SNIFF_LIMIT:
+                self._parser = None
+                if not b''.join(self._chunks)[:4].startswith(settings.IMAGE_LATE_HEADER_SIGNATURES):
+                    self.discardReason = "image format not recognized"
+                    return False
+                # Some formats have their header after the pixels (TIFF): stop sniffing,
+                # and check the image when the whole file is received (see _complete()).
+                self._headerPending = True
+            return True
+        self._parser = None  # Header is known: no need to decode the image while downloading.
+        return self._checkSize(image)
 
-        # Make sure image is not blacklisted.
-        datahash = hashlib.sha1(self.imagedata).hexdigest()
-        if datahash in self.CONFIG["blacklist.imagesha1"]:
-            self.imagedata = "blacklisted"
-            return   # Discard the image.
+    def _checkSize(self,image):
+        ''' Checks the image dimensions (image is a PIL Image object, only the header has to be read.)
+            Output: False if the image is too small.
+        '''
+        (imagex,imagey) = image.size
+        if (imagex < settings.MINIMUM_IMAGE_SIZE) or (imagey < settings.MINIMUM_IMAGE_SIZE):
+            self.discardReason = "too small (%dx%d)" % (imagex,imagey)
+            return False
+        return True
 
-        # Compute filename from file SHA1
-        imagesha1 = hashlib.sha1(self.imagedata).hexdigest()
+    def _complete(self):
+        ''' Checks the downloaded data and computes the image filename.
+            Must be called once all image data has been passed to _feed().
+        '''
+        if self.discardReason:
+            self._chunks = []
+            return    # The image was already discarded during download.
+        if not self._receivedSize:
+            self.discardReason = "no data"
+            return    # Discard the image.
+        if self._parser is not None:  # The whole file was received, and PIL still does not recognize it.
+            self._parser = None
+            self.discardReason = "image format not recognized"
+            return    # Discard the image.
+        if self._headerPending:  # The header was not found in the first bytes: look for it in the whole file.
+            self._headerPending = False
+            self._imagedata = b''.join(self._chunks)
+            self._chunks = [self._imagedata]
+            try:
+                image = Image.open(io.BytesIO(self._imagedata))  # (Only reads the header.)
+            except Exception:  # PIL cannot understand file content.
+                image = None
+                self.discardReason = "image format not recognized"
+            if image is not None:
+                self._checkSize(image)
+            if self.discardReason:
+                (self._chunks,self._imagedata) = ([],None)
+                return    # Discard the image.
+
+        # Compute filename from file SHA1 (already computed during download)
+        imagesha1 = self._sha1.hexdigest()
         if imagesha1 in self.CONFIG["blacklist.imagesha1"]:  # discard blacklisted images
             self.discardReason = "blacklisted"
+            self._chunks = []
             return
-        self.filename = 'WG'+imagesha1+file_extension  # SHA1 in hex + image extension
-        self.imagedata += self.CONFIG["pool.sourcemark"].encode() + self.imageurl.encode()   # Add original URL in image file
+        self.filename = 'WG'+imagesha1+self.fileExtension  # SHA1 in hex + image extension
 
         self.discardReason = ""
         self.isNotAnImage = False  # The image is ok.
 
+    @property
+    def imagedata(self):
+        ''' Raw binary image data (as downloaded from the internet), in a single bytes object.
+            (The data is only joined in a single buffer if someone asks for it.)
+        '''
+        if self._imagedata is None:
+            if self.isNotAnImage:
+                return None
+            self._imagedata = b''.join(self._chunks)
+            self._chunks = [self._imagedata]
+        return self._imagedata
+
     def getImage(self):
         ''' Returns the image as a PIL Image object.
             Usefull for collectors to read image properties (size, etc.)
@@ -169,13 +329,9 @@ class internetImage:
         if self.isNotAnImage:
             raise RuntimeError("This is not an image. Cannot save.")
             # Shame shame, the caller should have discarded this image already !
-        # FIXME: Should I implement try/except on the following file write operation ?
-        try:
-            file = open(os.path.join(destinationDirectory,self.filename),'w+b')
-            file.write(self.imagedata)
-            file.close()
-        except IOError:
-            pass  # Ignore this image... nevermind.
+        # The chunks are written as received, followed by the original URL of the image.
+        sourcemark = (self.CONFIG["pool.sourcemark"] + self.imageurl).encode()   # Add original URL in image file
+        savePoolFile(destinationDirectory,self.filename,self._chunks+[sourcemark])
 
 class collector(threading.Thread):
     ''' Generic collector class. Implements methods common to all collectors.
@@ -186,6 +342,9 @@ class collector(threading.Thread):
            method self._getRandomImage(self)  (downloads a random image.)
             _getRandomImage() will be called continuously. _getRandomImage() should terminate fast
             (ideally get only one picture)
+        Image URLs found by derived classes should be passed to self._downloadImage().
+        If collector.download.concurrency is more than 1, the URLs are put in a bounded
+        queue and downloaded by several download worker threads in parallel.
         Used by: imagePool
     '''
     name="collector"
@@ -202,6 +361,13 @@ class collector(threading.Thread):
         self.CONFIG=config
         self.statusLock = threading.RLock()  # A lock to access collector status.
         self.status = ('Stopped','')    # Status of this collector
+        self.statusListeners = []       # Functions called when the status changes (see addStatusListener())
+        self.imageCountLock = threading.Lock()  # A lock to change self.numberOfImagesToGet (also decremented by download workers, see _imageKept()).
+        self.downloadConcurrency = max(1,self.CONFIG["collector.download.concurrency"])  # Number of download workers
+        self.downloadQueue = queue.Queue(2*self.downloadConcurrency)  # URLs of images waiting to be downloaded by the workers.
+        self.downloadAllowed = threading.Event()  # Set when the download workers are allowed to download images.
+        self.downloadWorkers = []        # Download worker threads (none if downloadConcurrency is 1)
+        self.engine = None               # The asyncCollectorEngine running this collector (None if the collector runs in its own thread)
 
     def _logDebug    (self,message): logging.getLogger(self.name).debug    (message)
     def _logInfo     (self,message): logging.getLogger(self.name).info     (message)
@@ -213,70 +379,191 @@ class collector(threading.Thread):
     # Thread activity methods:
     def collectAndStop(self,n):
         ''' Ask this collector to collect n images and stop. '''
-        self.inputCommandQueue.put(commandToken(collect=n),True)
+        self._postCommand(commandToken(collect=n))
 
     def collectNonStop(self):
         ''' Ask this collector to collect images and never stop. '''
-        self.inputCommandQueue.put(commandToken(collectnonstop=1),True)
+        self._postCommand(commandToken(collectnonstop=1))
 
     def stopcollecting(self):
         ''' Ask the thread to stop collecting images ASAP (this may not be right now). '''
-        self.inputCommandQueue.put(commandToken(stopcollecting=1),True)
+        self._postCommand(commandToken(stopcollecting=1))
 
     # Thread life methods:
     def shutdown(self):
         ''' Ask this thread to die. '''
-        self.inputCommandQueue.put(commandToken(shutdown=1),True)
+        self._postCommand(commandToken(shutdown=1))
+
+    def _postCommand(self,commandToken):
+        ''' Puts a command in the command queue (and wakes up the engine running this collector, if any). '''
+        self.inputCommandQueue.put(commandToken,True)
+        if self.engine is not None:
+            self.engine.wakeUp(self)
 
     def run(self):
         ''' Main thread loop. '''
+        self._startDownloadWorkers()
+        delay = 0   # Pause before the next call to self._getRandomImage()
         while True:
+            collecting = self.continuousCollect or (self.numberOfImagesToGet > 0)
             try:
-                commandToken = self.inputCommandQueue.get_nowait()  # Get orders
-                # Handle commands put in the command queue:
-                if commandToken.shutdown:
-                    self._logDebug("Shutting down.")
-                    self._setCurrentStatus('Shutting down','')
+                # Wait for orders. (When we are not collecting, we sleep until we receive a command.)
+                commandToken = self.inputCommandQueue.get(True,delay if collecting else None)
+                if not self._handleCommand(commandToken):
+                    self._stopDownloadWorkers()
                     return # Exit the tread.
-                elif commandToken.collect:  # Order to collect n images
-                    if self.numberOfImagesToGet==0:
-                        self._logDebug("Starting to collect %d images..."%commandToken.collect)
-                    self.numberOfImagesToGet = commandToken.collect
-                    self.continuousCollect = False
-                elif commandToken.collectnonstop:  # Order to collect continuously
-                    if not self.continuousCollect:
-                        self._logDebug("Starting to collect images non-stop...")
-                    self.continuousCollect = True
-                    self.numberOfImagesToGet = 0
-                elif commandToken.stopcollecting:  # Stop collecting images
-                    if (self.numberOfImagesToGet>1) or self.continuousCollect:
-                        self._logDebug("Stopped")
-                        self._setCurrentStatus('Stopped','')
-                    self.numberOfImagesToGet = 0
-                    self.continuousCollect = False
-                else:
-                    self._logError("Unknown command token")
-                    pass  # Unknown command, ignore.
+                delay = 0
             except queue.Empty: # Else (if no command is available), do some stuff.
                 try:
                     if self.continuousCollect: # collect continuously
-                        self.numberOfImagesToGet = 1
-                        self._getRandomImage()  # This call must decrement self.numberOfImagesToGet
-                        time.sleep(0.25)
-                    elif self.numberOfImagesToGet > 0:
-                        self._getRandomImage()  # This call must decrement self.numberOfImagesToGet
-                        time.sleep(0.25)
-                    else:
-                        time.sleep(0.25)
+                        self._setImagesToGet(1,True)
+                    self._getRandomImage()  # This call must decrement self.numberOfImagesToGet
                 except Exception as exc:
                     self._logException(exc)  # Log any unexpected exception
+                delay = 0.25
+
+    def _handleCommand(self,commandToken):
+        ''' Handles a command put in the command queue.
+            Output: False if the collector must shutdown.
+        '''
+        if commandToken.shutdown:
+            self._logDebug("Shutting down.")
+            self._setCurrentStatus('Shutting down','')
+            return False
+        elif commandToken.collect:  # Order to collect n images
+            if self.numberOfImagesToGet==0:
+                self._logDebug("Starting to collect %d images..."%commandToken.collect)
+            self._setImagesToGet(commandToken.collect,False)
+        elif commandToken.collectnonstop:  # Order to collect continuously
+            if not self.continuousCollect:
+                self._logDebug("Starting to collect images non-stop...")
+            self._setImagesToGet(0,True)
+        elif commandToken.stopcollecting:  # Stop collecting images
+            if (self.numberOfImagesToGet>1) or self.continuousCollect:
+                self._logDebug("Stopped")
+                self._setCurrentStatus('Stopped','')
+            self._setImagesToGet(0,False)
+        else:
+            self._logError("Unknown command token")
+            pass  # Unknown command, ignore.
+        return True
+
+    def _setImagesToGet(self,numberOfImagesToGet,continuousCollect):
+        ''' Sets the number of images to get and the non-stop collect flag.
+            (Download workers decrement the number of images at the same time: see _imageKept())
+        '''
+        with self.imageCountLock:
+            self.numberOfImagesToGet = numberOfImagesToGet
+            self.continuousCollect = continuousCollect
+            self._updateDownloadAllowed()
+
+    def _startDownloadWorkers(self):
+        ''' Starts the download worker threads (if download concurrency is enabled). '''
+        if self.downloadConcurrency < 2:
+            return  # Images will be downloaded by the collector thread itself.
+        for i in range(self.downloadConcurrency):
+            worker = threading.Thread(target=self._downloadWorker,name="%s-download-%d" % (self.name,i))
+            worker.start()
+            self.downloadWorkers.append(worker)
+
+    def _stopDownloadWorkers(self):
+        ''' Asks the download workers to stop and wait for them. '''
+        if not self.downloadWorkers:
+            return
+        try:  # Forget pending URLs
+            while True:
+                self.downloadQueue.get_nowait()
+        except queue.Empty:
+            pass
+        for worker in self.downloadWorkers:
+            self.downloadQueue.put(None)   # None tells a worker to exit.
+        self.downloadAllowed.set()  # Wake up idle workers.
+        for worker in self.downloadWorkers:
+            worker.join()
+        self.downloadWorkers = []
+
+    def _updateDownloadAllowed(self):
+        ''' Lets download workers run only when we are collecting images. '''
+        if self.continuousCollect or self.numberOfImagesToGet > 0:
+            self.downloadAllowed.set()
+        else:
+            self.downloadAllowed.clear()
+
+    def _downloadWorker(self):
+        ''' Download worker thread: downloads the image URLs put in self.downloadQueue. '''
+        while True:
+            self.downloadAllowed.wait()  # Do not download while the pool has enough images.
+            imageurl = self.downloadQueue.get()
+            if imageurl is None:
+                return  # Exit the worker.
+            if not self.downloadAllowed.is_set():  # We got enough images while waiting: keep this URL for later.
+                try:
+                    self.downloadQueue.put_nowait(imageurl)
+                except queue.Full:
+                    pass
+                continue
+            try:
+                self._fetchImage(imageurl)
+            except Exception as exc:
+                self._logException(exc)  # Log any unexpected exception
+
+    def _downloadSlots(self):
+        ''' Returns the number of image URLs which can be passed to self._downloadImage() right now. '''
+        if self.engine is not None:
+            return self.engine.downloadSlots(self)
+        if not self.downloadWorkers:
+            return 1
+        return max(0,self.downloadQueue.maxsize-self.downloadQueue.qsize())
+
+    def _downloadImage(self,imageurl):
+        ''' Downloads an image and saves it in the image pool directory.
+            If download workers are running, the URL is queued and downloaded
+            by the workers (this call does not block).
+            Derived classes should check self._downloadSlots() before calling this method.
+            When the collector is run by the asyncio engine, the download is scheduled
+            on the engine event loop.
+        '''
+        if self.engine is not None:
+            self.engine.download(self,imageurl)
+            return
+        if not self.downloadWorkers:
+            self._fetchImage(imageurl)
+            return
+        try:
+            self.downloadQueue.put_nowait(imageurl)
+        except queue.Full:
+            self._logDebug("Download queue full. Skipping %s" % imageurl)
+
+    def _fetchImage(self,imageurl):
+        ''' Downloads an image and saves it in the image pool directory. '''
+        self._logDebug(imageurl)
+        self._setCurrentStatus('Downloading',imageurl)
+        i = internetImage(imageurl,self.CONFIG)   # Download the image
+        if i.isNotAnImage:
+            self._logDebug("Image discarded because %s." % i.discardReason)
+        else:  # We do not make other checks on the image. We always consider the image is OK.
+            i.saveToDisk(self.CONFIG["pool.imagepooldirectory"])
+            self._imageKept()
+
+    def _imageKept(self):
+        ''' Decrements the number of images to get.
+            Must be called each time an image is saved in the pool.
+        '''
+        with self.imageCountLock:
+            self.numberOfImagesToGet -= 1   # One less !
+            if not self.continuousCollect and self.numberOfImagesToGet <= 0:
+                self.downloadAllowed.clear()  # We have enough images: workers can rest.
 
     def _setCurrentStatus(self,status,information):
         ''' Sets the current status so that it can be read by others. '''
         #
         self.statusLock.acquire()
+        changed = (self.status != (status,information))
         self.status = (status,information)
         self.statusLock.release()
+        if changed:
+            for listener in self.statusListeners:
+                listener(self)
 
     def getCurrentStatus(self):
         ''' Returns the current status of the collector.
@@ -291,6 +578,13 @@ class collector(threading.Thread):
         self.statusLock.release()
         return (status,information)
 
+    def addStatusListener(self,listener):
+        ''' Registers a function which will be called (with this collector as parameter, from the
+            collector threads) each time the status of the collector changes (see getCurrentStatus()).
+            The function must return quickly (eg. put a message in a queue).
+        '''
+        self.statusListeners.append(listener)
+
     def _getRandomImage(self):
         ''' Each derived class must implement this method.
             The method:
@@ -299,7 +593,8 @@ class collector(threading.Thread):
               - should return as soon as possible (short execution time, ideally 1 second
                 but can be much more )
               - must decrement self.numberOfImagesToGet by 1 if successfully downloaded an image
-                (and considers the image is to be kept.)
+                (and considers the image is to be kept.) by calling self._imageKept()
+                (self._downloadImage() does this for you.)
             This method will be automatically called again 0.25 seconds after completion,
             continuously (except when the pool decides there are enough images.)
         '''
@@ -356,9 +651,11 @@ class collector(threading.Thread):
       htmlpage = ''
       results = []
       try:
-          request_headers = { 'User-Agent': self.CONFIG["network.http.useragent"] }
-          request = urllib.request.Request(url, None, request_headers)  # Build the HTTP request
-          htmlpage = urllib.request.urlopen(request).read(2000000)  # Read at most 2 Mb.
+          urlfile = openUrl(url, self.CONFIG)
+          try:
+              htmlpage = urlfile.read(2000000)  # Read at most 2 Mb.
+          finally:
+              urlfile.close()  # (Gives the connection back to the pool.)
           htmlpage = htmlpage.decode('latin-1')
           # FIXME: catch specific HTTP errors ?
           # FIXME: return HTTP errors ?
@@ -586,7 +883,7 @@ class collector_deviantart(collector):
                 self._logDebug("Image discarded because %s." % i.discardReason)
             else:  # We do not make other checks on the image. We always consider the image is OK.
                 i.saveToDisk(self.CONFIG["pool.imagepooldirectory"])
-                self.numberOfImagesToGet -= 1   # One less !
+                self._imageKept()
             self.imageurltoget = ""
             return
 
@@ -675,7 +972,7 @@ class collector_yahooimagesearch(collector):
                     self._logDebug("Image discarded because %s." % i.discardReason)
                 else:  # We do not make other checks on the image. We always consider the image is OK.
                     i.saveToDisk(self.CONFIG["pool.imagepooldirectory"])
-                    self.numberOfImagesToGet -= 1   # One less !
+                    self._imageKept()
             return
 
 class collector_googleimages(collector):
@@ -742,7 +1039,7 @@ class collector_googleimages(collector):
                     self._logDebug("Image discarded because %s." % i.discardReason)
                 else:  # We do not make other checks on the image. We always consider the image is OK.
                     i.saveToDisk(self.CONFIG["pool.imagepooldirectory"])
-                    self.numberOfImagesToGet -= 1   # One less !
+                    self._imageKept()
 
 
 class collector_flickr(collector):
@@ -823,7 +1120,7 @@ class collector_flickr(collector):
                     self._logDebug("Image discarded because %s." % i.discardReason)
                 else:  # We do not make other checks on the image. We always consider the image is OK.
                     i.saveToDisk(self.CONFIG["pool.imagepooldirectory"])
-                    self.numberOfImagesToGet -= 1   # One less !
+                    self._imageKept()
 
 class imagePool(threading.Thread):
     ''' This object is in charge of maintaining a pool of images downloaded from the internet.
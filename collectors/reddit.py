@@ -8,9 +8,9 @@ import random
 import json
 
 try:
-    from collectors.meta import collector, internetImage
+    from collectors.meta import collector
 except ImportError:
-    from meta import collector, internetImage
+    from meta import collector
 
 subreddits = [
     "r/pics/",
@@ -66,14 +66,9 @@ class collector_reddit(collector):
         random.shuffle(self.imageurls)
 
     def download_image(self):
-        imageurl = self.imageurls.pop()  # Choose a random image URL.
-        self._logDebug(imageurl)
-        self._setCurrentStatus('Downloading',imageurl)
-        i = internetImage(imageurl,self.CONFIG)   # Download the image
-        if i.isNotAnImage:
-            self._logDebug("Image discarded because %s." % i.discardReason)
-        else:  # We do not make other checks on the image. We always consider the image is OK.
-            i.saveToDisk(self.CONFIG["pool.imagepooldirectory"])
+        for n in range(min(self._downloadSlots(),len(self.imageurls))):
+            imageurl = self.imageurls.pop()  # Choose a random image URL.
+            self._downloadImage(imageurl)   # Download the image (or queue it for the download workers)
 
 """
 from collectors import reddit
@@ -7,9 +7,9 @@ import hashlib
 import random
 
 try:
-    from collectors.meta import collector, internetImage
+    from collectors.meta import collector
 except ImportError:
-    from meta import collector, internetImage
+    from meta import collector
 
 class collector_yahooimagesearch(collector):
     ''' Get images from random queries on Yahoo Image search engine.
@@ -84,15 +84,8 @@ class collector_yahooimagesearch(collector):
         # Then choose a random image to download.
         if not self.collectURL:
             self.collectURL = not self.collectURL
-            if len(self.imageurls)>0:
+            for n in range(min(self._downloadSlots(),len(self.imageurls))):
                 imageurl = random.choice(list(self.imageurls.keys()))  # Choose a random image URL.
                 del self.imageurls[imageurl]  # Remove it from list
-                self._setCurrentStatus('Downloading',imageurl)
-                self._logDebug(imageurl)
-                i = internetImage(imageurl,self.CONFIG)   # Download the image
-                if i.isNotAnImage:
-                    self._logDebug("Image discarded because %s." % i.discardReason)
-                else:  # We do not make other checks on the image. We always consider the image is OK.
-                    i.saveToDisk(self.CONFIG["pool.imagepooldirectory"])
-                    self.numberOfImagesToGet -= 1   # One less !
+                self._downloadImage(imageurl)   # Download the image (or queue it for the download workers)
             return
@@ -61,6 +61,18 @@ ACCEPTED_MIME_TYPES = { 'image/jpeg': '.jpg',
                         'image/tiff': '.tiff'
                       }
 
+# Images smaller than this (width or height, in pixels) are not used by the assemblers.
+# Collectors abort the download of such images as soon as the image header is received.
+MINIMUM_IMAGE_SIZE = 32
+
+# Collectors abort a download if the image format could not be recognized
+# in the first IMAGE_HEADER_SNIFF_LIMIT bytes.
+IMAGE_HEADER_SNIFF_LIMIT = 262144
+
+# Signatures of the image files whose header can be after the pixels (TIFF): their download
+# goes on after IMAGE_HEADER_SNIFF_LIMIT bytes, and the image is checked once it is complete.
+IMAGE_LATE_HEADER_SIGNATURES = (b'II*\x00', b'MM\x00*')
+
 # ---------------------------------------------------------------------------------------
 
 DEFAULTCONFIG = {
@@ -71,8 +83,15 @@ DEFAULTCONFIG = {
         "network.http.proxy.auth.login"   : "",         # (string)  Login for proxy.
         "network.http.proxy.auth.password": "",         # (string)  Password for proxy.
         "network.http.useragent"     : "webGobbler/"+".".join(map(str, __version__)),# (string) User-agent passed in HTTP requests.
+        "network.http.keepalive"     : True,            # (boolean) Keep HTTP connections open and reuse them for next requests to the same host.
+        "network.http.keepalive.maxidle" : 4,           # (integer) Maximum number of idle connections kept open per host.
+        "network.http.keepalive.idletimeout" : 30,      # (integer) Idle connections are closed after this number of seconds.
         "collector.maximumimagesize" : 4000000,         # (integer) Maximum image file size in bytes. If a picture is bigger than this, it will not be downloaded.
         "collector.acceptedmimetypes": ACCEPTED_MIME_TYPES, # (dictionary)  List of image types which will be downloaded.
+        "collector.download.concurrency" : 4,           # (integer) Number of images each collector downloads in parallel (1 = one at a time).
+        "collector.engine"           : "threads",       # (string) How collectors are run: "threads" (one thread per collector, plus download workers)
+                                                        # or "asyncio" (all collectors and downloads in a single event loop.)
+        "collector.asyncio.maxinflight" : 100,          # (integer) With the asyncio engine, maximum number of simultaneous image downloads.
         "collector.localonly"        : False,           # (boolean) If true, will collect images from local disk instead of internet (--localonly)
         "collector.localonly.startdir" : "/",           # (string) When using local disk only, the directory to scan for images (default="/"=Whole disk.)
         "collector.keywords.enabled" : False,           # (boolean) Use keywords for image search. If False, random generated words will be used.
@@ -82,8 +101,16 @@ DEFAULTCONFIG = {
         "pool.sourcemark"            : "--- Picture taken from ", # (string) String used to store image source in image files.
                                                # If you change this string, you will have to delete all images from your pool.
         "pool.keepimages"            : False,           # (boolean) Do not delete images from the pool after use (--keepimage)
+        "pool.prefetch"              : 4,               # (integer) Number of images read and decoded in advance, ready for the assemblers.
+        "pool.decodeworkers"         : 2,               # (integer) Number of threads reading and decoding images for the prefetch queue.
+        "pool.rescaninterval"        : 300,             # (integer) Re-read the content of the pool directory every n seconds (0 = only at startup).
+                                                        # (Collectors register the images they save: this is only needed for files added or deleted by other programs.)
+        "pool.watchdirectory"        : True,            # (boolean) Watch the pool directory (Linux inotify) so that images added by other programs are used immediately.
+                                                        # (If the directory cannot be watched, it is rescanned every pool.rescaninterval seconds.)
         "assembler.sizex"            : 1024,            # (integer) Width of image to generate (--resolution). Ignored for wallpaper changer and screensaver.
         "assembler.sizey"            :  768,            # (integer) Height of image to generate (--resolution). Ignored for wallpaper changer and screensaver.
+        "assembler.outputsizes"      : "",              # (string) Other sizes of the generated image, resized from it (eg. "320x240,160x120").
+                                                        # (--tofile and --singleimage save them as image-320x240.png..., --tohtml as webgobbler-320x240.jpg...)
         "assembler.mirror"           : False,           # (boolean) Horizontal mirror of image (to render text unreadable) (--mirror)
         "assembler.invert"           : False,           # (boolean) Invert (negative) final picture before saving (--invert)
         "assembler.emboss"           : False,           # (boolean) Emboss the final picture before saving (--emboss)
@@ -92,10 +119,28 @@ DEFAULTCONFIG = {
         "assembler.superpose.randomrotation": True,     # (boolean) Rotate images randomly (--norotation to disable)
         "assembler.superpose.variante": 0,              # (integer) Variantes of the superpose assembler (this give different results) (--variante).
                                                         # 0=Equalize (default, recommended), 1=Darkening+autoConstrast.
+        "assembler.superpose.equalizeevery": 1,         # (integer) Equalize (or autocontrast in variante 1) the image every n superposed images.
+                                                        # 0 = only once, when all images are superposed (faster, gives different results.)
+        "assembler.superpose.batchsize": 1,             # (integer) Number of images pasted together. The image is equalized at most once per batch.
+        "assembler.superpose.accumulator": False,       # (boolean) Superpose images in a high-precision canvas (requires numpy), equalized only
+                                                        # when all images are superposed (faster, gives different results.)
+        "assembler.superpose.previewevery": 0,          # (integer) Publish a preview of the image being generated every n superposed images (0 = disabled.)
+        "assembler.superpose.previewreduce": 2,         # (integer) Previews are n times smaller than the generated image (faster to post-process.)
         "assembler.superpose.bordersmooth": 30,         # (integer) Size of border smooth (0 to disable border smooth.)
+        "assembler.superpose.visibleonly": True,        # (boolean) Only prepare (contrast, border darkening, rotation...) the part of the images which is
+                                                        # pasted inside the final picture (faster for images partially outside the picture.)
+        "assembler.superpose.bordersampling": 20,       # (integer) Test one border pixel every n pixels to detect "white" images (which are inverted.)
         "assembler.superpose.scale": float(1.0),        # (float) Scale images before superposing them (--scale)
+        "assembler.superpose.replaylog": "",            # (string) Record the images used for each generated image (file name and SHA1) and the random decisions made
+                                                        # (rotations, positions...) in this file, so that images can be generated again with --replay. "" = disabled. (--replaylog)
+        "assembler.superpose.workers": 0,               # (integer) Number of processes preparing images (resize, contrast, rotation...) in parallel.
+                                                        # 0 = images are prepared by the assembler thread itself.
+        "screensaver.transition.duration": float(2.0),  # (float) Duration of the crossfade between images in the X11 screensaver, in seconds (0 to disable.)
+        "screensaver.transition.fps": 25,               # (integer) Frame rate of the crossfade (frames are dropped if the computer is too slow.)
         "persistencedirectory"       : ".",             # (string) Directory where classes save their data between program runs
         "program.every"              : 60,              # (integer) Generate a new image every n seconds (--every)
+        "program.seed"               : 0,               # (integer) Seed of the random choices (images taken from the pool, rotations, positions...) (--seed)
+                                                        # 0 = random seed. (With a seed, the decoded images are given to the assembler in the order they were picked.)
         "debug"                      : False,           # (boolean) debug mode (True will display various activity on screen and log into the file webGobbler.log) (--debug)
         "blacklist.imagesha1"        : BLACKLIST_IMAGESHA1, # (dictionnary: key=hex SHA1 (string), value=0) List of images to blacklist (based on their content)
         "blacklist.url"              : BLACKLIST_URL,   # (list of strings) List of blacklisted URLs.
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+# A local HTTP server (http.server) for the tests of the HTTP clients.
+# It also acts as a proxy for CONNECT requests.
+# localserver.pem is a self-signed certificate (and its key) for 127.0.0.1, used by the HTTPS servers.
+
+import http.server
+import os
+import select
+import socket
+import ssl
+import threading
+import urllib.parse
+
+CERTIFICATE = os.path.join(os.path.dirname(os.path.abspath(__file__)),'localserver.pem')
+
+def clientSslContext():
+    ''' Returns a SSL context which trusts the certificate of the local HTTPS servers. '''
+    return ssl.create_default_context(cafile=CERTIFICATE)
+
+class localServer:
+    ''' Serves the pages registered with addPage() on 127.0.0.1 (HTTP/1.1, with keep-alive) in a background thread.
+        If tls is True, the server speaks HTTPS (see clientSslContext()).
+        self.requests lists the requests received: (client port, method, path, headers).
+
+        Example:
+            server = localServer()
+            server.addPage('/foo.jpg',data,'image/jpeg')
+            ... (request server.url('/foo.jpg'))
+            server.stop()
+    '''
+    def __init__(self,tls=False):
+        self.pages = {}        # key=path, value=function(handler) which sends the response.
+        self.requests = []     # (client port, method, path, headers) of each request received
+        self.connections = 0   # Number of connections accepted
+        server = self
+        class handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def setup(self):
+                http.server.BaseHTTPRequestHandler.setup(self)
+                server.connections += 1
+            def do_GET(self):
+                server.requests.append((self.client_address[1],'GET',self.path,self.headers))
+                page = server.pages.get(urllib.parse.urlsplit(self.path).path)  # (Proxies receive the full URL.)
+                if page is None:
+                    self.send(404,b'not found','text/plain')
+                else:
+                    page(self)
+            def do_CONNECT(self):
+                server.requests.append((self.client_address[1],'CONNECT',self.path,self.headers))
+                (host,port) = self.path.rsplit(':',1)
+                self.send_response(200,'Connection established')
+                self.end_headers()
+                self.wfile.flush()
+                server._relay(self.connection,socket.create_connection((host,int(port))))
+                self.close_connection = True
+            def send(self,status,body,contentType,headers=()):
+                ''' Sends a response with a Content-Length. '''
+                self.send_response(status)
+                self.send_header('Content-Type',contentType)
+                self.send_header('Content-Length',str(len(body)))
+                for (name,value) in headers:
+                    self.send_header(name,value)
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self,*args):
+                pass
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1',0),handler)
+        self.httpd.daemon_threads = True
+        if tls:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(CERTIFICATE)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket,server_side=True)
+        self.scheme = 'https' if tls else 'http'
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever,name='localserver')
+        self.thread.start()
+
+    def url(self,path):
+        return '%s://127.0.0.1:%d%s' % (self.scheme,self.port,path)
+
+    def addPage(self,path,body,contentType='image/png',headers=()):
+        ''' Serves body at path (with a Content-Length header). '''
+        self.pages[path] = lambda handler: handler.send(200,body,contentType,headers)
+
+    def addFunction(self,path,function):
+        ''' Calls function(handler) to answer the requests for path (handler.send() sends a simple response.) '''
+        self.pages[path] = function
+
+    def _relay(self,client,remote):
+        ''' Copies the data between the two sockets until one of them is closed (CONNECT tunnel). '''
+        try:
+            while True:
+                (readable,writable,exceptional) = select.select([client,remote],[],[],5)
+                if not readable:
+                    return
+                for source in readable:
+                    data = source.recv(65536)
+                    if not data:
+                        return
+                    (remote if source is client else client).sendall(data)
+        finally:
+            remote.close()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+# Checks the high-precision canvas of assembler_superpose (utils.accumulator, assembler.superpose.accumulator).
+# Run with: python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.freeze_imports import Image
+
+try:
+    import numpy
+    from utils.accumulator import floatCanvas
+except ImportError:
+    numpy = None
+
+def sampleImages():
+    ''' Returns an RGB image and a transparency mask (gradients, 120x80). '''
+    gradient = Image.linear_gradient('L').resize((120,80))
+    image = Image.merge('RGB',(gradient,gradient.rotate(90),Image.radial_gradient('L').resize((120,80))))
+    mask = Image.radial_gradient('L').resize((120,80)).point(lambda value: 255-value)
+    return (image,mask)
+
+def maximumDifference(image1,image2):
+    return int(numpy.abs(numpy.asarray(image1,dtype=numpy.int16)-numpy.asarray(image2,dtype=numpy.int16)).max())
+
+@unittest.skipIf(numpy is None,"numpy is not installed")
+class floatCanvasTest(unittest.TestCase):
+
+    def setUp(self):
+        self.background = Image.linear_gradient('L').resize((200,150)).convert('RGB')
+        self.canvas = floatCanvas(self.background)
+
+    def testToImage(self):
+        self.assertEqual(self.canvas.toImage().tobytes(),self.background.tobytes())
+
+    def testPaste(self):
+        # Same as Image.paste() (except for rounding), including images partially outside the canvas.
+        (image,mask) = sampleImages()
+        expected = self.background.copy()
+        for coords in ((10,20),(-50,-30),(150,100)):
+            self.canvas.paste(image,coords,mask)
+            expected.paste(image,coords,mask)
+        self.assertLessEqual(maximumDifference(self.canvas.toImage(),expected),2)
+        self.canvas.paste(image,(500,500),mask)   # (Outside the canvas.)
+        self.canvas.paste(image,(-120,0),mask)
+        self.assertLessEqual(maximumDifference(self.canvas.toImage(),expected),2)
+
+    def testNoRounding(self):
+        # Pixels are not rounded to 8 bits after each operation.
+        canvas = floatCanvas(Image.new('RGB',(10,10),(3,3,3)))
+        for i in range(10):
+            canvas.darken(0.5)
+        for i in range(10):
+            canvas.darken(2.0)
+        self.assertEqual(canvas.toImage().getpixel((0,0)),(3,3,3))
+
+    def testDarken(self):
+        pixels = self.canvas.pixels.copy()
+        self.canvas.darken(0.5)
+        self.assertTrue((self.canvas.pixels == pixels).all())   # (Only the gain changes.)
+        value = self.background.getpixel((0,149))[0]
+        self.assertEqual(self.canvas.toImage().getpixel((0,149)),((value+1)//2,)*3)
+        for i in range(20):
+            self.canvas.darken(0.5)
+        self.assertGreaterEqual(self.canvas.gain,0.001)         # (The gain is applied to the pixels from time to time.)
+
+    def testFactor(self):
+        (image,mask) = sampleImages()
+        self.canvas.darken(0.5)
+        self.canvas.paste(image,(0,0),Image.new('L',image.size,255),0.5)
+        self.assertLessEqual(maximumDifference(self.canvas.toImage().crop((0,0,120,80)),image.point(lambda value: value*0.5)),1)
+
+    def testClear(self):
+        self.canvas.darken(0.5)
+        self.canvas.clear()
+        self.assertEqual(self.canvas.gain,1.0)
+        self.assertEqual(self.canvas.toImage().getextrema(),((0,0),(0,0),(0,0)))
+
+    def testSaveLoad(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory,'canvas.npy')
+            (image,mask) = sampleImages()
+            self.canvas.paste(image,(30,40),mask)
+            self.canvas.darken(0.7)
+            digest = self.canvas.digest()
+            self.canvas.save(filename)
+            loaded = floatCanvas.load(filename,Image.new('RGB',(200,150)))
+            self.assertEqual(loaded.toImage().tobytes(),self.canvas.toImage().tobytes())
+            self.assertEqual(loaded.digest(),self.canvas.digest())
+            self.assertNotEqual(digest,self.canvas.digest())   # (save() applies the gain to the pixels.)
+            # A canvas of another size (or no file) is ignored:
+            other = Image.new('RGB',(100,100),(1,2,3))
+            self.assertEqual(floatCanvas.load(filename,other).toImage().tobytes(),other.tobytes())
+            self.assertEqual(floatCanvas.load(os.path.join(directory,'missing.npy'),other).toImage().tobytes(),other.tobytes())
+        finally:
+            shutil.rmtree(directory)
+
+    def testDigest(self):
+        digest = self.canvas.digest()
+        self.assertEqual(floatCanvas(self.background).digest(),digest)
+        self.canvas.darken(0.9)
+        self.assertNotEqual(self.canvas.digest(),digest)
+
+if __name__ == '__main__':
+    unittest.main()
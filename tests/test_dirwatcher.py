@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+# Checks that the pool directory watcher (utils.dirwatcher, Linux inotify) keeps the pool index up to date.
+# Run with: python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.poolindex import poolIndex
+from utils.dirwatcher import directoryWatcher, IN_CLOSE_WRITE, IN_DELETE, IN_Q_OVERFLOW, IN_ISDIR, _EVENT_HEADER
+from collectors.meta import savePoolFile
+
+def event(mask,name=''):
+    ''' Returns an inotify event (as read from the inotify file descriptor.) '''
+    data = name.encode()+b'\0'*(16-len(name) % 16)
+    return _EVENT_HEADER.pack(1,mask,0,len(data))+data
+
+class directoryWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = poolIndex(self.directory)
+        try:
+            self.watcher = directoryWatcher(self.index)
+        except OSError as exc:
+            shutil.rmtree(self.directory)
+            self.skipTest(str(exc))
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.directory,ignore_errors=True)
+
+    def waitFor(self,condition):
+        ''' Waits until condition() is True (the events are handled by the watcher thread.) '''
+        limit = time.time()+5
+        while not condition() and time.time() < limit:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def testEvents(self):
+        self.watcher.start()
+        savePoolFile(self.directory,'WG1.jpg',[b'image'])   # (Written under a temporary name, then renamed.)
+        with open(os.path.join(self.directory,'notes.txt'),'w') as file:
+            file.write('not an image')
+        self.waitFor(lambda: 'WG1.jpg' in self.index)
+        os.rename(os.path.join(self.directory,'WG1.jpg'),os.path.join(self.directory,'WG2.jpg'))
+        self.waitFor(lambda: 'WG2.jpg' in self.index and 'WG1.jpg' not in self.index)
+        os.remove(os.path.join(self.directory,'WG2.jpg'))
+        self.waitFor(lambda: len(self.index) == 0)
+        self.assertEqual(self.index._files,[])
+
+    def testDirectoryDeleted(self):
+        self.watcher.start()
+        shutil.rmtree(self.directory)
+        self.watcher.join(5)
+        self.assertFalse(self.watcher.is_alive())
+
+    def testHandleEvents(self):
+        self.assertTrue(self.watcher._handleEvents(event(IN_CLOSE_WRITE,'a.jpg')+event(IN_CLOSE_WRITE,'b.txt')
+                                                   +event(IN_CLOSE_WRITE|IN_ISDIR,'c.jpg')+event(IN_CLOSE_WRITE,'d.png')))
+        self.assertEqual(sorted(self.index._files),['a.jpg','d.png'])
+        self.assertTrue(self.watcher._handleEvents(event(IN_DELETE,'a.jpg')))
+        self.assertEqual(self.index._files,['d.png'])
+
+    def testOverflow(self):
+        # Events were lost: the directory is scanned.
+        with open(os.path.join(self.directory,'e.jpg'),'wb') as file:
+            file.write(b'image')
+        self.index.add('deleted.jpg')
+        self.assertTrue(self.watcher._handleEvents(event(IN_Q_OVERFLOW)))
+        self.assertEqual(self.index._files,['e.jpg'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+# Checks the lookup tables computed from histograms (utils.histogram) against PIL.
+# Run with: python -m unittest discover tests
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.freeze_imports import Image, ImageOps
+from utils.histogram import equalizeLut, autocontrastLut, composeLut, mapHistogram
+
+def randomImage(seed):
+    ''' Returns a small RGB image with a few random values per band (most of the values are not used.) '''
+    generator = random.Random(seed)
+    bands = []
+    for band in range(3):
+        values = generator.sample(range(256),generator.randint(2,20))
+        bands.append(Image.frombytes('L',(64,48),bytes(generator.choice(values) for i in range(64*48))))
+    return Image.merge('RGB',bands)
+
+class lookupTableTest(unittest.TestCase):
+
+    def testEqualize(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                image = randomImage(seed)
+                lut = equalizeLut(image.histogram())
+                self.assertEqual(image.point(lut).tobytes(),ImageOps.equalize(image).tobytes())
+
+    def testAutocontrast(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                image = randomImage(seed)
+                lut = autocontrastLut(image.histogram())
+                self.assertEqual(image.point(lut).tobytes(),ImageOps.autocontrast(image).tobytes())
+
+    def testMapAndCompose(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                image = randomImage(seed)
+                first = equalizeLut(image.histogram())
+                second = autocontrastLut(mapHistogram(image.histogram(),first))
+                self.assertEqual(mapHistogram(image.histogram(),first),image.point(first).histogram())
+                self.assertEqual(image.point(composeLut(first,second)).tobytes(),image.point(first).point(second).tobytes())
+
+if __name__ == '__main__':
+    unittest.main()
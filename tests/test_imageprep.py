@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+# Checks that preparing only the visible part of an image (assembler.superpose.visibleonly)
+# gives the same pixels as preparing the whole image.
+# Run with: python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.freeze_imports import Image
+from utils.imageprep import prepareImage
+
+def gradientImage(bright):
+    ''' Returns a 300x200 RGB test image (gradients). If bright is False, the image has no white pixels
+        (its prepared mask does not contain 255, so its contrast depends on the whole image.) '''
+    red = Image.linear_gradient('L').resize((300,200))
+    green = Image.linear_gradient('L').rotate(90).resize((300,200))
+    blue = Image.radial_gradient('L').resize((300,200))
+    image = Image.merge('RGB',(red,green,blue))
+    if not bright:
+        image = image.point(lambda value: value*3//4)
+    return image
+
+def parameters(rotation,position,visibleonly):
+    return { 'sizex': 400, 'sizey': 300, 'scale': 1.0, 'bordersmooth': 30, 'bordersampling': 20,
+             'visibleonly': visibleonly, 'rotation': rotation, 'position': position, 'invertmask': False }
+
+class visibleOnlyTest(unittest.TestCase):
+
+    def assertSamePreparation(self,image,rotation,position):
+        (whole,wholeMask,wholeCoords) = prepareImage(image.copy(),parameters(rotation,position,False))
+        (part,partMask,partCoords) = prepareImage(image.copy(),parameters(rotation,position,True))
+        self.assertLess(part.size,whole.size)  # (The image is partly outside the picture.)
+        box = (partCoords[0]-wholeCoords[0],partCoords[1]-wholeCoords[1])
+        box += (box[0]+part.size[0],box[1]+part.size[1])
+        self.assertEqual(whole.crop(box).tobytes(),part.tobytes())
+        self.assertEqual(wholeMask.crop(box).tobytes(),partMask.tobytes())
+
+    def testPartlyOutside(self):
+        for bright in (True,False):
+            for rotation in (None,0,90,37,200):
+                for position in ((0.1,0.5),(0.9,0.5),(0.5,0.05),(0.95,0.95)):
+                    with self.subTest(bright=bright,rotation=rotation,position=position):
+                        self.assertSamePreparation(gradientImage(bright),rotation,position)
+
+    def testCornerOfRotatedImage(self):
+        # Only a corner of the rotated image (outside the image itself) is in the picture.
+        self.assertSamePreparation(gradientImage(True),45,(0.01,0.01))
+
+if __name__ == '__main__':
+    unittest.main()
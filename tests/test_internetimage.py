@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+# Checks that internetImage aborts the download as soon as the image header shows that the image
+# will be discarded (format not recognized, image too small, absurd dimensions), using a local HTTP server.
+# Run with: python -m unittest discover tests
+
+import io
+import os
+import re
+import struct
+import sys
+import unittest
+import zlib
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings
+from utils.freeze_imports import Image
+from utils.httppool import closeConnectionPool
+from collectors.meta import internetImage
+from localserver import localServer
+
+PADDING = 2000000  # Bytes after the header: should not be downloaded when the header is bad.
+
+def pngData(width,height):
+    ''' Returns a PNG file. '''
+    output = io.BytesIO()
+    Image.linear_gradient('L').resize((width,height)).save(output,'PNG')
+    return output.getvalue()
+
+def pngWithSize(width,height):
+    ''' Returns a PNG file whose header announces width x height pixels (the pixel data does not match.) '''
+    data = pngData(64,64)
+    ihdr = data[12:16]+struct.pack('>II',width,height)+data[24:29]   # (IHDR chunk type and data)
+    return data[:12]+ihdr+struct.pack('>I',zlib.crc32(ihdr))+data[33:]
+
+class internetImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = localServer()
+        self.config = dict(settings.DEFAULTCONFIG)
+
+    def tearDown(self):
+        closeConnectionPool()
+        self.server.stop()
+
+    def download(self,body,contentType='image/png'):
+        self.server.addPage('/image',body,contentType)
+        return internetImage(self.server.url('/image'),self.config)
+
+    def testValidImage(self):
+        data = pngData(64,64)
+        image = self.download(data)
+        self.assertFalse(image.isNotAnImage,image.discardReason)
+        self.assertEqual(image.imagedata,data)
+        self.assertEqual(image.getImage().size,(64,64))
+
+    def testTooSmall(self):
+        for keepalive in (True,False):
+            self.config["network.http.keepalive"] = keepalive
+            image = self.download(pngData(16,16)+b'\x00'*PADDING)
+            self.assertTrue(image.isNotAnImage)
+            self.assertEqual(image.discardReason,"too small (16x16)")
+            self.assertLess(image._receivedSize,100000)   # (Aborted after the first chunk.)
+
+    def testAbsurdDimensions(self):
+        image = self.download(pngWithSize(100000,100000)+b'\x00'*PADDING)
+        self.assertTrue(image.isNotAnImage)
+        self.assertEqual(image.discardReason,"not a valid image")
+        self.assertLess(image._receivedSize,100000)
+
+    def testNotRecognized(self):
+        image = self.download(b'garbage'*(PADDING//7))
+        self.assertTrue(image.isNotAnImage)
+        self.assertEqual(image.discardReason,"image format not recognized")
+        self.assertLess(image._receivedSize,settings.IMAGE_HEADER_SNIFF_LIMIT+100000)   # (Aborted at the sniff limit.)
+
+    def testLateHeader(self):
+        # Data starting like a TIFF file is downloaded completely (TIFF files can have their header at the end.)
+        body = b'II*\x00'+b'\x00'*PADDING
+        image = self.download(body)
+        self.assertTrue(image.isNotAnImage)
+        self.assertEqual(image.discardReason,"image format not recognized")
+        self.assertEqual(image._receivedSize,len(body))
+
+    def testNotAnImage(self):
+        image = self.download(pngData(64,64),'text/html')
+        self.assertTrue(image.isNotAnImage)
+        self.assertEqual(image.discardReason,"not an image (text/html)")
+        self.assertEqual(image._receivedSize,0)
+
+    def testBlacklistedUrl(self):
+        self.config["blacklist.url_re"] = [re.compile('http://127\\.0\\.0\\.1')]
+        image = self.download(pngData(64,64))
+        self.assertEqual(image.discardReason,"URL is blacklisted")
+        self.assertEqual(self.server.requests,[])
+
+if __name__ == '__main__':
+    unittest.main()
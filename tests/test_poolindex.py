@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+# Checks the in-memory index of the image pool directory (utils.poolindex).
+# Run with: python -m unittest discover tests
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.poolindex import poolIndex, getPoolIndex
+
+class poolIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = poolIndex(self.directory)
+        self.notified = []
+        self.index.addListener(lambda: self.notified.append(len(self.index)))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def createFiles(self,*filenames):
+        for filename in filenames:
+            with open(os.path.join(self.directory,filename),'wb') as file:
+                file.write(b'image')
+
+    def files(self):
+        ''' Returns the filenames of the index, checking its internal consistency. '''
+        self.assertEqual(len(self.index._files),len(self.index._positions))
+        for (position,filename) in enumerate(self.index._files):
+            self.assertEqual(self.index._positions[filename],position)
+        return sorted(self.index._files)
+
+    def testAddRemove(self):
+        for filename in ('a.jpg','b.png','c.gif','d.bmp'):
+            self.index.add(filename)
+        self.index.add('b.png')   # (Already known.)
+        self.assertEqual(len(self.index),4)
+        self.assertEqual(self.notified,[1,2,3,4])
+        self.index.remove('a.jpg')     # (The last filename takes its place.)
+        self.index.remove('d.bmp')
+        self.index.remove('missing.jpg')
+        self.assertEqual(self.files(),['b.png','c.gif'])
+        self.assertIn('c.gif',self.index)
+        self.assertNotIn('a.jpg',self.index)
+        self.assertEqual(self.notified,[1,2,3,4])   # (Removals are not notified.)
+
+    def testRandomFile(self):
+        self.assertIsNone(self.index.randomFile())
+        for filename in ('a.jpg','b.jpg','c.jpg'):
+            self.index.add(filename)
+        picked = set(self.index.randomFile(random.Random(seed)) for seed in range(50))
+        self.assertEqual(picked,{'a.jpg','b.jpg','c.jpg'})
+        self.assertEqual(self.index.randomFile(random.Random(5)),self.index.randomFile(random.Random(5)))
+
+    def testReconcile(self):
+        self.createFiles('a.jpg','b.PNG','notes.txt','c.jpg.part')
+        os.mkdir(os.path.join(self.directory,'directory.jpg'))
+        self.index.add('deleted.jpg')
+        self.assertEqual(self.index.reconcile(),2)
+        self.assertEqual(self.files(),['a.jpg','b.PNG'])
+        self.assertEqual(self.notified,[1,2])
+        self.assertEqual(self.index.reconcile(),2)   # (Nothing changed: nothing notified.)
+        self.assertEqual(self.notified,[1,2])
+        os.remove(os.path.join(self.directory,'a.jpg'))
+        self.createFiles('d.jpg','e.jpg')
+        self.assertEqual(self.index.reconcile(),3)
+        self.assertEqual(self.files(),['b.PNG','d.jpg','e.jpg'])
+
+    def testReconcileOrder(self):
+        # New files are indexed in sorted order (so that seeded runs pick the same files.)
+        self.createFiles('c.jpg','a.jpg','b.jpg')
+        self.index.reconcile()
+        self.assertEqual(self.index._files,['a.jpg','b.jpg','c.jpg'])
+
+    def testReconcileUnreadableDirectory(self):
+        self.index.add('a.jpg')
+        index = poolIndex(os.path.join(self.directory,'missing'))
+        self.assertEqual(index.reconcile(),0)
+        shutil.rmtree(self.directory)
+        self.assertEqual(self.index.reconcile(),1)   # (Keeps what it knows.)
+        os.mkdir(self.directory)
+
+    def testGetPoolIndex(self):
+        self.assertIs(getPoolIndex(self.directory),getPoolIndex(os.path.join(self.directory,'.')))
+        self.assertIsNot(getPoolIndex(self.directory),self.index)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+# Checks that the images recorded in a replay log (assembler.superpose.replaylog) are generated again
+# identically by replay(), and that seeded renders (program.seed) are reproducible.
+# Run with: python -m unittest discover tests
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.freeze_imports import Image, ImageFile
+from utils.appconfig import applicationConfig
+from utils.replay import readReplayLog
+import webgobbler
+
+def poolImage(number):
+    ''' Returns the content of a PNG file (different for each number.) '''
+    gradient = Image.linear_gradient('L').rotate(number*37).resize((120+number*10,90+number*5))
+    image = Image.merge('RGB',(gradient,gradient.point(lambda value: (value*number) % 256),Image.radial_gradient('L').resize(gradient.size)))
+    output = io.BytesIO()
+    image.save(output,'PNG')
+    return output.getvalue()
+
+class listPool:
+    ''' A pool which gives the files of a directory in a given order (like imagePool does, without collectors.) '''
+    def __init__(self,directory,filenames):
+        self.directory = directory
+        self.filenames = list(filenames)
+    def start(self): pass
+    def shutdown(self): pass
+    def join(self): pass
+    def addImageListener(self,listener): pass
+    def getPoolSize(self):
+        return len(self.filenames)
+    def getImage(self):
+        if not self.filenames:
+            return None
+        filename = self.filenames.pop(0)
+        with open(os.path.join(self.directory,filename),'rb') as file:
+            data = file.read()
+        parser = ImageFile.Parser()
+        parser.feed(data)
+        image = parser.close()
+        image.load()
+        image.info['webgobbler.filename'] = filename
+        image.info['webgobbler.sha1'] = hashlib.sha1(data).hexdigest()
+        return image
+
+class replayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pooldirectory = os.path.join(self.directory,'pool')
+        os.mkdir(self.pooldirectory)
+        self.filenames = []
+        for number in range(1,9):
+            self.filenames.append('WG%d.png' % number)
+            with open(os.path.join(self.pooldirectory,self.filenames[-1]),'wb') as file:
+                file.write(poolImage(number))
+        self.config = applicationConfig()
+        self.config["assembler.sizex"] = 160
+        self.config["assembler.sizey"] = 120
+        self.config["assembler.superpose.nbimages"] = 4
+        self.config["pool.imagepooldirectory"] = self.pooldirectory
+        self.config["persistencedirectory"] = self.directory
+        self.config["program.seed"] = 1234
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def generate(self,logName,renders=2):
+        ''' Generates images from the pool files, recording them in a replay log.
+            Output: the SHA1 of the generated images (before post-processing.)
+        '''
+        self.config["assembler.superpose.replaylog"] = os.path.join(self.directory,logName)
+        a = webgobbler.assembler_superpose(pool=listPool(self.pooldirectory,self.filenames),config=self.config,ignorePreviousImage=True)
+        a.start()
+        sha1s = []
+        try:
+            for render in range(renders):
+                a.superposeB()
+                sha1s.append(webgobbler.imageSha1(a.currentImage))
+        finally:
+            a.shutdown()
+            a.join()
+        self.config["assembler.superpose.replaylog"] = ""
+        return sha1s
+
+    def replay(self,logName):
+        ''' Runs replay() (in a thread, so that a replay which never ends fails the test.) '''
+        result = []
+        thread = threading.Thread(target=lambda: result.append(webgobbler.replay(os.path.join(self.directory,logName),self.config)),daemon=True)
+        thread.start()
+        thread.join(60)
+        self.assertFalse(thread.is_alive(),"replay() did not end")
+        return result[0]
+
+    def testLogRoundTrip(self):
+        sha1s = self.generate('render.log')
+        renders = readReplayLog(os.path.join(self.directory,'render.log'))
+        self.assertEqual([render['sha1'] for render in renders],sha1s)
+        self.assertEqual([render['start'] for render in renders],['blank',sha1s[0]])
+        self.assertEqual([record['file'] for render in renders for record in render['images']],self.filenames)
+        self.assertEqual(renders[0]['seed'],1234)
+        self.assertEqual(renders[0]['config']["assembler.sizex"],160)
+        self.assertTrue(self.replay('render.log'))
+        self.assertTrue(os.path.isfile(os.path.join(self.directory,'render-2.bmp')))
+
+    def testRenamedFile(self):
+        # Images are found by their content when their file was renamed.
+        self.generate('render.log')
+        os.rename(os.path.join(self.pooldirectory,'WG3.png'),os.path.join(self.pooldirectory,'other.png'))
+        self.assertTrue(self.replay('render.log'))
+
+    def testModifiedFile(self):
+        self.generate('render.log')
+        with open(os.path.join(self.pooldirectory,'WG6.png'),'wb') as file:
+            file.write(poolImage(9))
+        with self.assertRaises(IOError):  # (The image cannot be found.)
+            webgobbler.replay(os.path.join(self.directory,'render.log'),self.config)
+
+    def testMissingImage(self):
+        # A log with an image missing: the render fails (instead of waiting forever for the image.)
+        self.generate('render.log')
+        filename = os.path.join(self.directory,'render.log')
+        with open(filename) as file:
+            lines = file.readlines()
+        del lines[[json.loads(line).get('file') for line in lines].index('WG7.png')]
+        with open(filename,'w') as file:
+            file.writelines(lines)
+        self.assertFalse(self.replay('render.log'))
+        self.assertTrue(os.path.isfile(os.path.join(self.directory,'render-1.bmp')))
+        self.assertFalse(os.path.isfile(os.path.join(self.directory,'render-2.bmp')))
+
+    def testSeededRenders(self):
+        first = self.generate('first.log')
+        second = self.generate('second.log')
+        self.assertEqual(first,second)
+        self.assertEqual(readReplayLog(os.path.join(self.directory,'first.log')),readReplayLog(os.path.join(self.directory,'second.log')))
+        self.config["program.seed"] = 4321
+        self.assertNotEqual(self.generate('third.log'),first)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,326 @@
+#!/usr/bin/python3
+
+# Checks the X11 screensaver frame path (wgx11screensaver) with fake Xlib, Xext and libc libraries:
+# no X server is needed.
+# Run with: python -m unittest discover tests
+
+import ctypes
+import os
+import queue
+import sys
+import threading
+import unittest
+import unittest.mock
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.freeze_imports import Image
+import wgx11screensaver
+from wgx11screensaver import X11_con, Visual, XImage, ximageRawmode, ximageBlitter, transitionRenderer, x11screensaver
+
+class fakeFunction:
+    ''' A function of a fake library: records its calls, and returns result (or result(*args) if it is callable.)
+        (Like the ctypes functions, it accepts a restype attribute.) '''
+    def __init__(self,library,name,result):
+        (self.library,self.name,self.result,self.restype) = (library,name,result,None)
+
+    def __call__(self,*args):
+        self.library.calls.append((self.name,args))
+        return self.result(*args) if callable(self.result) else self.result
+
+class fakeLibrary:
+    ''' A fake ctypes library. The functions which are not given return 0. '''
+    def __init__(self,**functions):
+        self.calls = []   # (name,arguments) of each call
+        for (name,result) in functions.items():
+            setattr(self,name,fakeFunction(self,name,result))
+
+    def __getattr__(self,name):
+        function = fakeFunction(self,name,0)
+        setattr(self,name,function)
+        return function
+
+    def called(self,name):
+        ''' Returns the arguments of the calls of the function name. '''
+        return [args for (called,args) in self.calls if called == name]
+
+def newXImage(width,height,bits_per_pixel,byte_order):
+    ''' Returns a pointer to an XImage, as created by XCreateImage or XShmCreateImage (without pixels.) '''
+    bytes_per_line = (width*bits_per_pixel//8+3)//4*4
+    return ctypes.pointer(XImage(width=width,height=height,format=X11_con.ZPixmap,byte_order=byte_order,
+                                 bitmap_pad=32,depth=24,bytes_per_line=bytes_per_line,bits_per_pixel=bits_per_pixel))
+
+def referenced(reference):
+    ''' Returns the structure given to a fake function with ctypes.byref(). '''
+    return reference._obj
+
+def fakeXlib(bits_per_pixel=32,byte_order=X11_con.LSBFirst,masks=(0xff0000,0x00ff00,0x0000ff)):
+    ''' Returns a fake Xlib. Its XSync() calls the installed error handler if xlib.pendingError is set
+        (as Xlib does when the server reports an error.) '''
+    xlib = fakeLibrary()
+    xlib.visual = Visual(red_mask=masks[0],green_mask=masks[1],blue_mask=masks[2])
+    xlib.pixels = []         # The pixels sent by XPutImage
+    xlib.handler = None      # The installed error handler
+    xlib.pendingError = False
+    def setErrorHandler(handler):
+        (previous,xlib.handler) = (xlib.handler,handler)
+        return previous
+    def sync(display,discard):
+        if xlib.pendingError and xlib.handler:
+            xlib.pendingError = False
+            xlib.handler(None,None)
+    def putImage(display,drawable,gc,ximage,*area):
+        ximage = referenced(ximage)
+        xlib.pixels.append(ctypes.string_at(ximage.data,ximage.bytes_per_line*ximage.height))
+    xlib.XDefaultVisual = fakeFunction(xlib,'XDefaultVisual',lambda display,screen: ctypes.addressof(xlib.visual))
+    xlib.XDefaultDepth = fakeFunction(xlib,'XDefaultDepth',24)
+    xlib.XCreateImage = fakeFunction(xlib,'XCreateImage',lambda display,visual,depth,format,offset,data,width,height,pad,bpl:
+                                     newXImage(width,height,bits_per_pixel,byte_order))
+    xlib.XSetErrorHandler = fakeFunction(xlib,'XSetErrorHandler',setErrorHandler)
+    xlib.XSync = fakeFunction(xlib,'XSync',sync)
+    xlib.XPutImage = fakeFunction(xlib,'XPutImage',putImage)
+    return xlib
+
+def fakeShm(xlib,attachError=False,bits_per_pixel=32,byte_order=X11_con.LSBFirst):
+    ''' Returns a fake Xext (with MIT-SHM) and a fake libc (System V shared memory).
+        If attachError is True, the server reports an error when the segment is attached (remote display.) '''
+    segments = {}   # shmid: buffer
+    libc = fakeLibrary()
+    libc.segments = segments
+    def shmget(key,size,flags):
+        segments[len(segments)+1] = ctypes.create_string_buffer(size)
+        return len(segments)
+    libc.shmget = fakeFunction(libc,'shmget',shmget)
+    libc.shmat = fakeFunction(libc,'shmat',lambda shmid,address,flags: ctypes.addressof(segments[shmid]))
+    xext = fakeLibrary()
+    xext.pixels = []
+    def attach(display,shminfo):
+        xlib.pendingError = attachError
+        return 1
+    def putImage(display,drawable,gc,ximage,*area):
+        ximage = referenced(ximage)
+        xext.pixels.append(ctypes.string_at(ximage.data,ximage.bytes_per_line*ximage.height))
+    xext.XShmQueryExtension = fakeFunction(xext,'XShmQueryExtension',1)
+    xext.XShmCreateImage = fakeFunction(xext,'XShmCreateImage',lambda display,visual,depth,format,data,shminfo,width,height:
+                                        newXImage(width,height,bits_per_pixel,byte_order))
+    xext.XShmAttach = fakeFunction(xext,'XShmAttach',attach)
+    xext.XShmPutImage = fakeFunction(xext,'XShmPutImage',putImage)
+    return (xext,libc)
+
+class fakeClock:
+    ''' A clock which only advances when sleep() is called (or when the test advances it.) '''
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self,delay):
+        self.now += delay
+
+def sampleImage(width,height):
+    return Image.frombytes('RGB',(width,height),bytes(range(256))*(width*height*3//256+1))
+
+class rawmodeTest(unittest.TestCase):
+
+    def testLayouts(self):
+        # Each pixel of image.tobytes('raw',rawmode) must give the color of the image when read
+        # as an integer in the byte order of the XImage, and split with the masks of the visual.
+        image = sampleImage(7,3)
+        for masks in ((0xff0000,0x00ff00,0x0000ff),(0x0000ff,0x00ff00,0xff0000)):
+            for bits_per_pixel in (24,32):
+                for byte_order in (X11_con.LSBFirst,X11_con.MSBFirst):
+                    with self.subTest(masks=masks,bits_per_pixel=bits_per_pixel,byte_order=byte_order):
+                        rawmode = ximageRawmode(bits_per_pixel,byte_order,*masks)
+                        data = image.tobytes('raw',rawmode)
+                        size = bits_per_pixel//8
+                        self.assertEqual(len(data),7*3*size)
+                        order = 'little' if byte_order == X11_con.LSBFirst else 'big'
+                        pixels = image.tobytes()
+                        for index in range(7*3):
+                            color = tuple(pixels[index*3:index*3+3])
+                            value = int.from_bytes(data[index*size:(index+1)*size],order)
+                            shifts = [(mask & -mask).bit_length()-1 for mask in masks]
+                            self.assertEqual(tuple((value & mask) >> shift for (mask,shift) in zip(masks,shifts)),color)
+
+    def testUnsupported(self):
+        self.assertIsNone(ximageRawmode(16,X11_con.LSBFirst,0xf800,0x07e0,0x001f))
+        self.assertIsNone(ximageRawmode(16,X11_con.LSBFirst,0xff0000,0x00ff00,0x0000ff))
+        self.assertIsNone(ximageRawmode(32,X11_con.LSBFirst,0x00ff00,0xff0000,0x0000ff))
+
+class blitterTest(unittest.TestCase):
+
+    def testPutImage(self):
+        xlib = fakeXlib()
+        blitter = ximageBlitter(xlib,None,0,1,None,5,4)
+        self.assertEqual((blitter.rawmode,blitter.bytes_per_line),('BGRX',20))
+        data = sampleImage(5,4).tobytes('raw',blitter.rawmode,blitter.bytes_per_line)
+        blitter.put(data)
+        self.assertEqual(xlib.pixels,[data])   # (A single request for the whole image.)
+        blitter.destroy()
+        self.assertEqual(len(xlib.called('XDestroyImage')),1)
+        self.assertIsNone(referenced(xlib.called('XDestroyImage')[0][0]).data)  # (The pixels are not freed by Xlib.)
+
+    def testShmPutImage(self):
+        xlib = fakeXlib()
+        (xext,libc) = fakeShm(xlib)
+        blitter = ximageBlitter(xlib,None,0,1,None,5,4,xext,libc)
+        self.assertIsNotNone(blitter.shminfo)
+        self.assertEqual(libc.called('shmctl')[0][1],0)   # (IPC_RMID once attached.)
+        data = sampleImage(5,4).tobytes('raw',blitter.rawmode,blitter.bytes_per_line)
+        blitter.put(data)
+        self.assertEqual(xext.pixels,[data])
+        self.assertEqual(xlib.pixels,[])
+        self.assertEqual(xlib.calls[-1][0],'XSync')   # (Do not write in the segment before the server has read it.)
+        blitter.destroy()
+        self.assertEqual(len(xext.called('XShmDetach')),1)
+        self.assertEqual(len(libc.called('shmdt')),1)
+
+    def testShmAttachError(self):
+        # The X server cannot attach the segment (eg. remote display): the XImage is sent with XPutImage.
+        xlib = fakeXlib()
+        (xext,libc) = fakeShm(xlib,attachError=True)
+        blitter = ximageBlitter(xlib,None,0,1,None,5,4,xext,libc)
+        self.assertIsNone(blitter.shminfo)
+        self.assertIsNone(xlib.handler)    # (The previous error handler is restored.)
+        self.assertEqual(len(libc.called('shmdt')),1)
+        self.assertEqual(len(libc.called('shmctl')),1)
+        self.assertEqual(len(xlib.called('XDestroyImage')),1)
+        data = sampleImage(5,4).tobytes('raw',blitter.rawmode,blitter.bytes_per_line)
+        blitter.put(data)
+        self.assertEqual(xlib.pixels,[data])
+        self.assertEqual(xext.pixels,[])
+        blitter.destroy()
+
+    def testUnsupportedLayout(self):
+        xlib = fakeXlib(bits_per_pixel=16,masks=(0xf800,0x07e0,0x001f))
+        with self.assertRaises(OSError):
+            ximageBlitter(xlib,None,0,1,None,5,4)
+        self.assertEqual(len(xlib.called('XDestroyImage')),1)
+
+class transitionTest(unittest.TestCase):
+
+    def crossfade(self,framecost,fps=25,duration=2.0):
+        ''' Runs a transition between a black and a white image with a consumer which takes framecost seconds
+            to display each frame. Returns (renderer,frames,clock,old,new). '''
+        clock = fakeClock()
+        renderer = transitionRenderer('BGRX',8,4,32,fps=fps,duration=duration)
+        (renderer.clock,renderer.sleep) = (clock.time,clock.sleep)
+        (old,new) = (bytes(8*4*4),b'\xff'*(8*4*4))
+        frames = []
+        for frame in renderer.frames(old,new):
+            frames.append(frame)
+            clock.sleep(framecost)
+        return (renderer,frames,clock,old,new)
+
+    def testFastConsumer(self):
+        (renderer,frames,clock,old,new) = self.crossfade(0.0)
+        self.assertEqual(renderer.stats['dropped'],0)
+        self.assertAlmostEqual(renderer.stats['frames'],2.0*25+1,delta=1)
+        self.assertAlmostEqual(renderer.stats['fps'],25,delta=1)
+        self.assertEqual(frames[0],old)
+        self.assertIs(frames[-1],new)
+        levels = [frame[0] for frame in frames]
+        self.assertEqual(levels,sorted(levels))   # (The new image appears progressively.)
+
+    def testSlowConsumer(self):
+        # The consumer takes 60 ms per frame at 25 frames per second: frames are dropped,
+        # and the transition still lasts 2 seconds.
+        (renderer,frames,clock,old,new) = self.crossfade(0.06)
+        stats = renderer.stats
+        self.assertEqual(set(stats),{'frames','dropped','fps','framecost'})
+        self.assertGreater(stats['dropped'],0)
+        self.assertLess(stats['frames'],2.0*25)
+        self.assertAlmostEqual(stats['frames']+stats['dropped'],2.0*25+1,delta=2)
+        self.assertAlmostEqual(stats['framecost'],0.06)
+        self.assertAlmostEqual(stats['fps'],1/0.06,delta=1)
+        self.assertIs(frames[-1],new)
+        self.assertEqual(len(frames),stats['frames'])
+        self.assertLess(clock.now-1000.0,2.0+2*0.06)   # (Start to end of the transition, plus the display of the last frame.)
+
+class screensaverTest(unittest.TestCase):
+    ''' Runs the x11screensaver thread with a fake Xlib: the X connection is a pipe (see sendEvent()). '''
+
+    def setUp(self):
+        xlib = fakeXlib()
+        (self.connection,self.connectionWrite) = os.pipe()
+        xlib.events = []                # Event types to be received on the X connection (see sendEvent())
+        xlib.painted = queue.Queue()    # The images sent by XPutImage
+        xlib.release = threading.Event()  # XPutImage waits for this event if xlib.hold is True
+        xlib.release.set()
+        xlib.idle = threading.Event()   # Set when the thread looks for events (before it sleeps)
+        def putImage(display,drawable,gc,ximage,*area):
+            ximage = referenced(ximage)
+            xlib.painted.put(ctypes.string_at(ximage.data,ximage.bytes_per_line*ximage.height))
+            xlib.release.wait()
+        def pending(display):
+            xlib.idle.set()
+            return len(xlib.events)
+        def nextEvent(display,event):
+            referenced(event).type = xlib.events.pop(0)
+        xlib.XOpenDisplay = fakeFunction(xlib,'XOpenDisplay',1)
+        xlib.XConnectionNumber = fakeFunction(xlib,'XConnectionNumber',self.connection)
+        xlib.XPutImage = fakeFunction(xlib,'XPutImage',putImage)
+        xlib.XPending = fakeFunction(xlib,'XPending',pending)
+        xlib.XNextEvent = fakeFunction(xlib,'XNextEvent',nextEvent)
+        self.xlib = xlib
+        config = {'assembler.sizex':5, 'assembler.sizey':4, 'screensaver.transition.duration':0, 'screensaver.transition.fps':25}
+        libraries = {'libX11.so':xlib, None:fakeLibrary()}   # (No libXext: the images are sent with XPutImage.)
+        with unittest.mock.patch.object(wgx11screensaver,'get_unix_lib',lambda name: name if name == 'libX11.so' else None), \
+             unittest.mock.patch.object(ctypes,'CDLL',lambda path: libraries[path]):
+            self.wsaver = x11screensaver(config)
+        self.assertEqual((self.wsaver.rawmode,self.wsaver.bytes_per_line),('BGRX',20))
+
+    def tearDown(self):
+        if self.wsaver.is_alive():
+            self.xlib.release.set()
+            self.sendEvent(X11_con.KeyPress)
+            self.wsaver.join(5)
+        os.close(self.connection)
+        os.close(self.connectionWrite)
+
+    def sendEvent(self,type):
+        ''' The X server sends an event to the window. '''
+        self.xlib.events.append(type)
+        os.write(self.connectionWrite,b'e')
+
+    def image(self,value):
+        return bytes([value])*(20*4)
+
+    def testSetImageWakesUp(self):
+        self.wsaver.start()
+        self.assertTrue(self.xlib.idle.wait(5))   # (The thread then sleeps in select().)
+        self.wsaver.set_image(self.image(1))
+        self.assertEqual(self.xlib.painted.get(timeout=5),self.image(1))
+        self.wsaver.set_image(self.image(2))
+        self.assertEqual(self.xlib.painted.get(timeout=5),self.image(2))
+        self.assertEqual(self.xlib.called('XCopyArea')[-1][1:3],(self.wsaver.pixmap,self.wsaver.window))
+
+    def testPendingImageReplaced(self):
+        # While the first image is being displayed, two images are given: only the newest one is displayed.
+        self.xlib.release.clear()
+        self.wsaver.start()
+        self.wsaver.set_image(self.image(1))
+        self.assertEqual(self.xlib.painted.get(timeout=5),self.image(1))
+        self.wsaver.set_image(self.image(2))
+        self.wsaver.set_image(self.image(3))
+        self.xlib.release.set()
+        self.assertEqual(self.xlib.painted.get(timeout=5),self.image(3))
+        self.sendEvent(X11_con.KeyPress)
+        self.assertTrue(self.wsaver.stopped.wait(5))
+        self.assertTrue(self.xlib.painted.empty())
+
+    def testStoppedOnExit(self):
+        self.wsaver.start()
+        self.assertTrue(self.xlib.idle.wait(5))
+        self.assertFalse(self.wsaver.stopped.is_set())
+        self.sendEvent(X11_con.ButtonPress)
+        self.assertTrue(self.wsaver.stopped.wait(5))
+        self.wsaver.join(5)
+        self.assertFalse(self.wsaver.is_alive())
+        self.assertEqual(len(self.xlib.called('XCloseDisplay')),1)
+        self.wsaver.set_image(self.image(1))   # (Ignored once the thread has exited.)
+        self.assertTrue(self.xlib.painted.empty())
+
+if __name__ == '__main__':
+    unittest.main()
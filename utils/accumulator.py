@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+# High-precision canvas for assembler_superpose (assembler.superpose.accumulator).
+# This module requires numpy.
+
+import hashlib
+
+import numpy
+
+from utils.freeze_imports import Image
+
+class floatCanvas:
+    ''' An RGB canvas stored as a float32 numpy array, in which images are pasted
+        with a transparency mask (like Image.paste()) without being rounded to 8 bits
+        after each paste.
+        Darkening the whole canvas (darken()) only changes a scale factor: the pixels
+        are not read.
+        toImage() returns the canvas as an 8 bits PIL image.
+
+        Example:
+            canvas = floatCanvas(Image.new('RGB',(1024,768)))
+            canvas.paste(image,(10,20),mask)
+            canvas.darken(0.99)
+            image = canvas.toImage()
+    '''
+    def __init__(self, image):
+        ''' image (PIL Image object) : the initial content of the canvas ('RGB' image). '''
+        self.size = image.size                                # (width,height) of the canvas
+        self.pixels = numpy.asarray(image,dtype=numpy.float32).copy()  # Pixels (height,width,3) divided by self.gain
+        self.gain = 1.0                                       # Factor to apply to self.pixels to get pixel values (0-255)
+
+    @classmethod
+    def load(cls, filename, image):
+        ''' Loads a canvas saved with save().
+            Input:
+                filename (string) : the file to load
+                image (PIL Image object) : the canvas content to use if the file cannot be loaded
+                                           (or does not have the size of the image)
+            Output: a floatCanvas object.
+        '''
+        canvas = cls(image)
+        try:
+            pixels = numpy.load(filename)
+        except (IOError, ValueError):
+            return canvas
+        if pixels.shape == canvas.pixels.shape:
+            canvas.pixels = pixels.astype(numpy.float32)
+        return canvas
+
+    def save(self, filename):
+        ''' Saves the canvas to a file (numpy .npy format). '''
+        self._normalize()
+        with open(filename,'wb') as file:
+            numpy.save(file,self.pixels)
+
+    def digest(self):
+        ''' Returns the SHA1 (in hex) of the content of the canvas (see utils.replay). '''
+        return hashlib.sha1(self.pixels.tobytes()+repr(self.gain).encode()).hexdigest()
+
+    def paste(self, image, coords, mask, factor=1.0):
+        ''' Pastes an image in the canvas.
+            Input:
+                image (PIL Image object) : an 'RGB' image
+                coords (tuple) : (x,y) position of the image in the canvas (may be outside the canvas)
+                mask (PIL Image object) : transparency mask ('L' image of the same size)
+                factor (float) : the pixels of the image are multiplied by this factor
+        '''
+        (x,y) = coords
+        (imagex,imagey) = image.size
+        box = (max(0,x),max(0,y),min(self.size[0],x+imagex),min(self.size[1],y+imagey))
+        if (box[0] >= box[2]) or (box[1] >= box[3]):
+            return  # The image is outside the canvas.
+        source = (box[0]-x,box[1]-y,box[2]-x,box[3]-y)   # Visible part of the image
+        pixels = numpy.asarray(image.crop(source),dtype=numpy.float32)
+        alpha = numpy.asarray(mask.crop(source),dtype=numpy.float32)[:,:,numpy.newaxis]
+        alpha *= 1.0/255
+        region = self.pixels[box[1]:box[3],box[0]:box[2]]
+        pixels *= factor/self.gain
+        pixels -= region
+        pixels *= alpha
+        region += pixels     # region = region*(1-alpha) + pixels*alpha
+
+    def clear(self):
+        ''' Fills the canvas with black. '''
+        self.pixels.fill(0)
+        self.gain = 1.0
+
+    def darken(self, factor):
+        ''' Multiplies all the pixels of the canvas by factor. '''
+        self.gain *= factor
+        if self.gain < 0.001:  # Do not let the stored values grow too much.
+            self._normalize()
+
+    def _normalize(self):
+        if self.gain != 1.0:
+            self.pixels *= self.gain
+            self.gain = 1.0
+
+    def toImage(self):
+        ''' Returns the canvas as a PIL Image object ('RGB', values rounded and clipped to 0-255). '''
+        pixels = self.pixels * self.gain
+        pixels += 0.5
+        numpy.clip(pixels,0,255,out=pixels)
+        return Image.fromarray(pixels.astype(numpy.uint8))
@@ -0,0 +1,348 @@
+#!/usr/bin/python3
+
+import asyncio
+import base64
+import email.parser
+import socket
+import ssl
+import time
+import urllib.parse, urllib.error
+
+from utils.httppool import REDIRECT_CODES
+
+_sslContext = None    # The SSL context shared by the HTTPS requests (see defaultSslContext())
+
+def defaultSslContext():
+    ''' Returns the SSL context used when none is given to urlopen().
+        (Creating a context loads the CA certificates, which takes some time:
+        it is created once, preferably before the event loop runs.)
+    '''
+    global _sslContext
+    if _sslContext is None:
+        _sslContext = ssl.create_default_context()
+    return _sslContext
+
+class asyncResponse:
+    ''' A HTTP response obtained with urlopen().
+        Mimics the interface of the objects returned by urllib.request.urlopen()
+        (info(), geturl(), length, status) but read() is a coroutine.
+        Handles both Content-Length and chunked transfer encodings.
+        If the response was obtained through an asyncConnectionPool and its body
+        was completely read, close() gives the connection back to the pool.
+    '''
+    def __init__(self, reader, writer, status, reason, headers, url, timeout, version='HTTP/1.1', pool=None, key=None):
+        self._reader = reader       # asyncio.StreamReader of the connection
+        self._writer = writer       # asyncio.StreamWriter of the connection
+        self._pool = pool           # The pool which owns the connection (None if the connection is not reused)
+        self._key = key             # Pool key of the connection (see asyncConnectionPool)
+        self.status = status        # HTTP status code (integer)
+        self.reason = reason        # HTTP reason phrase (string)
+        self._headers = headers     # Response headers (an email.message.Message object)
+        self.url = url              # Final URL (after redirections)
+        self._timeout = timeout     # Timeout (in seconds) of each network read
+        self._chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        self._chunkLeft = 0         # Bytes left in the current chunk (chunked encoding)
+        self._eof = False           # True when the whole body has been read
+        self.length = None          # Remaining number of bytes in the body (None if Content-Length was not sent.)
+        if not self._chunked:
+            try:
+                self.length = int(headers.get('Content-Length'))
+                if self.length < 0:
+                    self.length = None
+            except (TypeError, ValueError):
+                self.length = None
+            if self.length == 0:
+                self._eof = True
+        # The server closes the connection after this response if it says so, if it speaks HTTP/1.0,
+        # or if the end of the body is only known when the connection is closed.
+        connection = headers.get('Connection', '').lower()
+        self.will_close = ('close' in connection) or (version == 'HTTP/1.0' and 'keep-alive' not in connection) \
+                          or (not self._chunked and self.length is None)
+
+    def info(self):
+        ''' Returns the HTTP response headers (an email.message.Message object). '''
+        return self._headers
+
+    def geturl(self):
+        return self.url
+
+    async def read(self, amt=65536):
+        ''' Reads at most amt bytes of the response body.
+            Output: bytes (b'' when the whole body has been read.)
+        '''
+        if self._eof or amt <= 0:
+            return b''
+        if self._chunked:
+            return await self._readChunked(amt)
+        if self.length is not None:
+            amt = min(amt, self.length)
+        data = await self._wait(self._reader.read(amt))
+        if self.length is not None:
+            self.length -= len(data)
+            if self.length <= 0:
+                self._eof = True
+            elif not data:
+                raise urllib.error.URLError("connection closed before the end of the response")
+        if not data:
+            self._eof = True
+        return data
+
+    async def _readChunked(self, amt):
+        ''' Reads data from a body sent with chunked transfer encoding. '''
+        if self._chunkLeft == 0:
+            line = await self._wait(self._reader.readline())
+            try:
+                self._chunkLeft = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise urllib.error.URLError("bogus chunked encoding")
+            if self._chunkLeft == 0:  # Last chunk: skip the trailers.
+                while (await self._wait(self._reader.readline())).strip():
+                    pass
+                self._eof = True
+                return b''
+        data = await self._wait(self._reader.read(min(amt, self._chunkLeft)))
+        if not data:
+            raise urllib.error.URLError("connection closed before the end of the response")
+        self._chunkLeft -= len(data)
+        if self._chunkLeft == 0:
+            await self._wait(self._reader.readline())  # CRLF at end of chunk
+        return data
+
+    async def _wait(self, coroutine):
+        return await asyncio.wait_for(coroutine, self._timeout)
+
+    def close(self):
+        ''' Closes the response.
+            The connection goes back to the pool only if the whole body was read
+            and the server did not ask to close the connection.
+        '''
+        if self._writer is None:
+            return
+        (writer, self._writer) = (self._writer, None)
+        if self._pool is not None and self._eof and not self.will_close:
+            self._pool._release(self._key, self._reader, writer)
+        else:
+            writer.close()
+
+class asyncConnectionPool:
+    ''' A pool of keep-alive connections for urlopen(), keyed by (scheme,host,port,tunnel)
+        like utils.httppool.httpConnectionPool. It must only be used by the event loop
+        which opened its connections (no lock is needed.)
+        Used by: collectors.engine.asyncCollectorEngine
+
+        Example:
+            pool = asyncConnectionPool(maxIdlePerHost=4,idleTimeout=30)
+            response = await urlopen("http://www.foo.bar/images/foo.jpg",pool=pool)
+            data = await response.read()
+            response.close()    # The connection goes back to the pool.
+            ...
+            pool.closeAll()
+    '''
+    def __init__(self, maxIdlePerHost=4, idleTimeout=30, sslcontext=None):
+        ''' maxIdlePerHost (integer): maximum number of idle connections kept for each host.
+            idleTimeout (integer): idle connections older than this (in seconds) are closed.
+            sslcontext (ssl.SSLContext): the context of the HTTPS connections (default: defaultSslContext())
+        '''
+        self.maxIdlePerHost = maxIdlePerHost
+        self.idleTimeout = idleTimeout
+        self.sslcontext = sslcontext or defaultSslContext()
+        self._idle = {}     # Idle connections (key=(scheme,host,port,tunnel), value=list of (reader,writer,release time))
+
+    def _acquire(self, key):
+        ''' Returns an idle connection to the host (a tuple (reader,writer)), or None. '''
+        self._evict(time.time())
+        idle = self._idle.get(key)
+        if not idle:
+            return None
+        (reader, writer, releaseTime) = idle.pop()   # Most recently used connection first.
+        if not idle:
+            del self._idle[key]
+        return (reader, writer)
+
+    def _release(self, key, reader, writer):
+        ''' Gives a connection back to the pool. '''
+        if reader.at_eof() or writer.is_closing():  # (The server has closed it.)
+            writer.close()
+            return
+        idle = self._idle.setdefault(key, [])
+        idle.append((reader, writer, time.time()))
+        while len(idle) > self.maxIdlePerHost:  # Keep only the most recent connections.
+            idle.pop(0)[1].close()
+        self._evict(time.time())
+
+    def _evict(self, now):
+        ''' Closes the connections which have been idle for too long. '''
+        for key in list(self._idle.keys()):
+            idle = self._idle[key]
+            while idle and (now - idle[0][2] > self.idleTimeout or now < idle[0][2]):
+                idle.pop(0)[1].close()
+            if not idle:
+                del self._idle[key]
+
+    def closeAll(self):
+        ''' Closes all idle connections. '''
+        for idle in self._idle.values():
+            for (reader, writer, releaseTime) in idle:
+                writer.close()
+        self._idle = {}
+
+async def urlopen(url, headers=None, proxy=None, maxRedirects=5, timeout=None, pool=None, sslcontext=None):
+    ''' Sends a GET request without blocking the event loop and returns an asyncResponse object.
+        Redirections are followed.
+        Input: url (string): the URL to get.
+               headers (dictionnary): additional HTTP request headers.
+               proxy (tuple): (host,port,login,password) of the HTTP proxy to use, or None.
+                      (login and password can be None.)
+                      HTTPS URLs are requested through a CONNECT tunnel in the proxy.
+               maxRedirects (integer): maximum number of HTTP redirections followed.
+               timeout (float): timeout in seconds of each network operation
+                        (default: the socket module default timeout, or 60 seconds.)
+               pool (asyncConnectionPool): keep-alive connections to reuse (None: a new connection
+                     is opened for each request, and closed after it.)
+               sslcontext (ssl.SSLContext): the context of HTTPS connections
+                     (default: the context of the pool, or defaultSslContext())
+        Raises urllib.error.HTTPError if the server returned an error,
+        and urllib.error.URLError if the server could not be contacted
+        (like urllib.request.urlopen() does).
+    '''
+    if timeout is None:
+        timeout = socket.getdefaulttimeout() or 60
+    if sslcontext is None:
+        sslcontext = pool.sslcontext if pool is not None else defaultSslContext()
+    for i in range(maxRedirects+1):
+        response = await _request(url, headers or {}, proxy, timeout, pool, sslcontext)
+        location = response.info().get('Location')
+        if response.status in REDIRECT_CODES and location:
+            await _discard(response)
+            url = urllib.parse.urljoin(url, location)
+            continue
+        if response.status >= 400:
+            await _discard(response)
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.info(), None)
+        return response
+    raise urllib.error.URLError("too many redirections")
+
+async def _discard(response):
+    ''' Reads what remains of a (small) response body so that its connection can be reused. '''
+    try:
+        if response._pool is not None and not response.will_close and (response._chunked or response.length <= 65536):
+            size = 0
+            while size <= 65536:
+                data = await response.read()
+                if not data:
+                    break
+                size += len(data)
+    except (OSError, asyncio.TimeoutError, urllib.error.URLError):
+        pass
+    response.close()
+
+async def _connectTunnel(reader, writer, host, port, headers, timeout):
+    ''' Asks the proxy (connected to reader/writer) to open a tunnel to host:port. '''
+    request = 'CONNECT %s:%d HTTP/1.1\r\nHost: %s:%d\r\n' % (host, port, host, port)
+    request += ''.join('%s: %s\r\n' % (name, value) for (name, value) in headers.items())
+    writer.write((request + '\r\n').encode('latin-1'))
+    await asyncio.wait_for(writer.drain(), timeout)
+    statusline = await asyncio.wait_for(reader.readline(), timeout)
+    while True:  # Skip the headers of the proxy response.
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if not line.strip():
+            break
+    try:
+        status = int(statusline.decode('latin-1').split(' ', 2)[1])
+    except (ValueError, IndexError):
+        raise urllib.error.URLError("bad status line %r" % statusline[:100])
+    if status != 200:
+        raise urllib.error.URLError("Tunnel connection failed: %s" % statusline.decode('latin-1').strip())
+
+async def _request(url, headers, proxy, timeout, pool, sslcontext):
+    ''' Sends a single request on a kept-alive connection of the pool or on a new connection
+        (redirections are not followed).
+    '''
+    parsed = urllib.parse.urlsplit(url)
+    (scheme, netloc, path, query) = (parsed.scheme.lower(), parsed.netloc, parsed.path, parsed.query)
+    if scheme not in ('http', 'https'):
+        raise urllib.error.URLError("unsupported URL scheme %s" % scheme)
+    try:
+        host = parsed.hostname
+        port = parsed.port or (443 if scheme == 'https' else 80)
+    except ValueError as exc:  # Bogus port in URL
+        raise urllib.error.URLError(exc)
+    if not host:
+        raise urllib.error.URLError("no host given")
+
+    headers = dict(headers)
+    headers.setdefault('Host', netloc.rsplit('@', 1)[-1])
+    headers['Connection'] = 'keep-alive' if pool is not None else 'close'
+    headers.setdefault('Accept-Encoding', 'identity')
+    target = urllib.parse.urlunsplit(('', '', path or '/', query, ''))
+    if scheme != 'https':
+        sslcontext = None
+    (connecthost, connectport) = (host, port)
+    key = (scheme, host, port, None)
+    tunnelheaders = None      # Headers of the CONNECT request (HTTPS through a proxy)
+    if proxy:
+        (connecthost, connectport, login, password) = proxy
+        proxyheaders = {}
+        if login:
+            credentials = base64.b64encode(('%s:%s' % (login, password or '')).encode()).decode()
+            proxyheaders['Proxy-Authorization'] = 'Basic ' + credentials
+        if scheme == 'http':
+            # Plain HTTP through a proxy: connect to the proxy and send the full URL.
+            key = ('http', connecthost, connectport, None)
+            target = urllib.parse.urlunsplit((scheme, netloc, path or '/', query, ''))
+            headers.update(proxyheaders)
+        else:
+            # HTTPS through a proxy: tunnel to the host (CONNECT), then start TLS in the tunnel.
+            key = (scheme, host, port, (connecthost, connectport, tuple(sorted(proxyheaders.items()))))
+            tunnelheaders = proxyheaders
+    request = 'GET %s HTTP/1.1\r\n' % target
+    request += ''.join('%s: %s\r\n' % (name, value) for (name, value) in headers.items())
+    request = (request + '\r\n').encode('latin-1')
+
+    # Try a kept-alive connection first. If the server has closed it meanwhile,
+    # try again with a fresh connection.
+    while True:
+        connection = pool._acquire(key) if pool is not None else None
+        (reader, writer) = connection or (None, None)
+        try:
+            if connection is None:
+                if tunnelheaders is not None:
+                    (reader, writer) = await asyncio.wait_for(asyncio.open_connection(connecthost, connectport), timeout)
+                    await _connectTunnel(reader, writer, host, port, tunnelheaders, timeout)
+                    await asyncio.wait_for(writer.start_tls(sslcontext, server_hostname=host), timeout)
+                else:
+                    (reader, writer) = await asyncio.wait_for(
+                        asyncio.open_connection(connecthost, connectport, ssl=sslcontext,
+                                                server_hostname=host if sslcontext else None), timeout)
+            writer.write(request)
+            await asyncio.wait_for(writer.drain(), timeout)
+
+            # Read status line and headers:
+            statusline = await asyncio.wait_for(reader.readline(), timeout)
+            if not statusline and connection is not None:
+                raise ConnectionResetError("kept-alive connection closed by the server")
+            try:
+                (version, status, reason) = (statusline.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+                status = int(status)
+            except ValueError:
+                raise urllib.error.URLError("bad status line %r" % statusline[:100])
+            headerlines = []
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout)
+                if not line.strip():
+                    break
+                headerlines.append(line)
+                if len(headerlines) > 100:
+                    raise urllib.error.URLError("too many headers")
+            headers_received = email.parser.BytesParser().parsebytes(b''.join(headerlines))
+        except urllib.error.URLError:
+            if writer is not None:
+                writer.close()
+            raise
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as exc:
+            if writer is not None:
+                writer.close()
+            if connection is not None and isinstance(exc, (ConnectionError, asyncio.IncompleteReadError)):
+                continue  # The kept-alive connection was stale: open a new one.
+            raise urllib.error.URLError(exc)
+        return asyncResponse(reader, writer, status, reason, headers_received, url, timeout, version, pool, key)
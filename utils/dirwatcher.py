@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import select
+import struct
+import threading
+import logging
+
+CTYPES_AVAILABLE = True
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    CTYPES_AVAILABLE = False
+
+from utils.poolindex import IMAGE_EXTENSIONS
+
+# inotify constants (from linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008   # File opened for writing was closed
+IN_MOVED_FROM  = 0x00000040   # File was moved out of the directory
+IN_MOVED_TO    = 0x00000080   # File was moved into the directory
+IN_DELETE      = 0x00000200   # File was deleted
+IN_DELETE_SELF = 0x00000400   # The watched directory was deleted
+IN_MOVE_SELF   = 0x00000800   # The watched directory was moved
+IN_Q_OVERFLOW  = 0x00004000   # Event queue overflowed (events were lost)
+IN_IGNORED     = 0x00008000   # Watch was removed
+IN_ISDIR       = 0x40000000   # Event occurred on a directory
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_EVENT_HEADER = struct.Struct('iIII')
+
+class directoryWatcher(threading.Thread):
+    ''' Watches an image pool directory with Linux inotify and keeps its poolIndex
+        up to date, so that images added by other programs (or rsync jobs) can be
+        used immediately, without rescanning the directory.
+        Files are registered when they are completely written (IN_CLOSE_WRITE)
+        or moved into the directory (IN_MOVED_TO), and forgotten when deleted or
+        moved away. If the kernel event queue overflows, the index is reconciled
+        with a directory scan.
+        Raises OSError if inotify is not available (non-Linux systems, no ctypes...):
+        callers should then rely on periodic directory scans.
+
+        Example:
+            try:
+                watcher = directoryWatcher(getPoolIndex("imagepool"))
+                watcher.start()
+            except OSError:
+                watcher = None   # We will rescan the directory from time to time.
+            ...
+            watcher.stop()
+    '''
+    def __init__(self, index):
+        ''' index (poolIndex object): the index of the directory to watch. '''
+        threading.Thread.__init__(self)
+        self.name = 'directoryWatcher'
+        self.daemon = True
+        self.index = index
+        self._log = logging.getLogger('directorywatcher')
+        if not sys.platform.startswith('linux') or not CTYPES_AVAILABLE:
+            raise OSError("inotify is not available on this system.")
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available on this system.")
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_init1: " + os.strerror(errno))
+        mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+        if libc.inotify_add_watch(self._fd, os.fsencode(index.directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, "inotify_add_watch: " + os.strerror(errno))
+        (self._wakeupRead, self._wakeupWrite) = os.pipe()   # Used by stop() to wake up the thread.
+
+    def stop(self):
+        ''' Stops watching the directory and waits for the thread to exit. '''
+        try:
+            os.write(self._wakeupWrite, b'x')
+        except OSError:
+            pass
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        try:
+            while True:
+                (readable, writable, errors) = select.select([self._fd, self._wakeupRead], [], [])
+                if self._wakeupRead in readable:
+                    return  # We are asked to stop.
+                try:
+                    data = os.read(self._fd, 65536)
+                except BlockingIOError:
+                    continue
+                if not self._handleEvents(data):
+                    return
+        except Exception as exc:
+            self._log.exception(exc)
+        finally:
+            for fd in (self._fd, self._wakeupRead, self._wakeupWrite):
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+    def _handleEvents(self, data):
+        ''' Updates the index with the events read from inotify.
+            Output: False if the directory cannot be watched anymore.
+        '''
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            (wd, mask, cookie, length) = _EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset+_EVENT_HEADER.size:offset+_EVENT_HEADER.size+length].rstrip(b'\0'))
+            offset += _EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:  # We have lost events: read the whole directory.
+                self._log.debug("inotify queue overflow. Scanning directory.")
+                self.index.reconcile()
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                self._log.warning("%s is not watched anymore." % self.index.directory)
+                return False
+            elif (mask & IN_ISDIR) or os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue  # Not an image.
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.index.add(name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.index.remove(name)
+        return True
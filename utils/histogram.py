@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+# Lookup tables (LUT) computed from image histograms.
+# These are the lookup tables of ImageOps.equalize() and ImageOps.autocontrast(),
+# computed from a histogram the caller already has, so that the image does not
+# have to be read again to compute its histogram (see assembler_superpose).
+# Histograms and lookup tables are lists of 256 values per band (as returned by
+# Image.histogram() and accepted by Image.point()).
+
+def equalizeLut(histogram):
+    ''' Returns the lookup table used by ImageOps.equalize() for an image with this histogram.
+        Input: histogram (list of integers) : the image histogram (Image.histogram())
+        Output: a list of integers (one lookup table per band)
+    '''
+    lut = []
+    for band in range(0,len(histogram),256):
+        histo = [count for count in histogram[band:band+256] if count]
+        step = 0
+        if len(histo) > 1:
+            step = (sum(histo) - histo[-1]) // 255
+        if not step:
+            lut.extend(range(256))
+        else:
+            n = step // 2
+            for i in range(256):
+                lut.append(min(255, n // step))  # (Image.point() clips the values of ImageOps.equalize() to 255.)
+                n = n + histogram[band+i]
+    return lut
+
+def autocontrastLut(histogram):
+    ''' Returns the lookup table used by ImageOps.autocontrast() (without cutoff) for an image with this histogram.
+        Input: histogram (list of integers) : the image histogram (Image.histogram())
+        Output: a list of integers (one lookup table per band)
+    '''
+    lut = []
+    for band in range(0,len(histogram),256):
+        values = [value for value in range(256) if histogram[band+value]]
+        if not values or values[-1] <= values[0]:
+            lut.extend(range(256))  # Nothing to stretch.
+            continue
+        (lo,hi) = (values[0],values[-1])
+        scale = 255.0 / (hi - lo)
+        offset = -lo * scale
+        lut.extend(min(255,max(0,int(value * scale + offset))) for value in range(256))
+    return lut
+
+def composeLut(first,second):
+    ''' Returns the lookup table equivalent to applying first, then second.
+        (Both lookup tables must have the same number of bands.)
+    '''
+    return [second[band+value] for band in range(0,len(first),256) for value in first[band:band+256]]
+
+def mapHistogram(histogram,lut):
+    ''' Returns the histogram of an image after a lookup table is applied to it.
+        Input: histogram (list of integers) : the histogram of the image
+               lut (list of integers) : the lookup table applied to the image
+        Output: a list of integers (the new histogram)
+    '''
+    mapped = [0] * len(histogram)
+    for band in range(0,len(histogram),256):
+        for value in range(256):
+            mapped[band+lut[band+value]] += histogram[band+value]
+    return mapped
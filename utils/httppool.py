@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+
+import base64
+import http.client
+import threading
+import time
+import urllib.request, urllib.parse, urllib.error
+
+# HTTP status codes which redirect to another URL (Location header).
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# Exceptions meaning a kept-alive connection was closed by the server
+# while it was sitting in the pool.  The request can safely be re-sent.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                           ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+
+class pooledResponse:
+    ''' A HTTP response obtained from a httpConnectionPool.
+        Behaves like the object returned by urllib.request.urlopen()
+        (read(), info(), geturl(), length, close()).
+        Once the response body has been completely read, close() gives the
+        connection back to the pool so that next requests to the same host
+        do not have to open a new TCP (and TLS) connection.
+    '''
+    def __init__(self, pool, key, connection, response, url):
+        self._pool = pool               # The pool which owns the connection
+        self._key = key                 # Pool key of the connection (scheme,host,port,tunnel)
+        self._connection = connection   # The http.client connection object
+        self._response = response       # The http.client.HTTPResponse object
+        self.url = url                  # Final URL (after redirections)
+        self.status = response.status
+        self.reason = response.reason
+
+    @property
+    def length(self):
+        ''' Remaining number of bytes in the body (None if Content-Length was not sent.) '''
+        return self._response.length
+
+    def info(self):
+        ''' Returns the HTTP response headers (an email.message.Message object). '''
+        return self._response.msg
+
+    def geturl(self):
+        return self.url
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def readinto(self, buffer):
+        return self._response.readinto(buffer)
+
+    def close(self):
+        ''' Close the response.
+            The connection is kept for reuse only if the whole body was read
+            and the server did not ask to close the connection.
+        '''
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool._release(self._key, connection)
+        else:
+            self._response.close()
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class httpConnectionPool:
+    ''' A thread-safe pool of keep-alive HTTP/HTTPS connections, keyed by (scheme,host,port,tunnel).
+        (tunnel is the proxy used to reach a HTTPS host: HTTPS requests through a proxy
+        are sent in a CONNECT tunnel to the host, so each tunnel only serves one host.)
+        Used by collectors (through openUrl()) so that downloading many images
+        from the same host does not pay the TCP and TLS handshakes every time.
+
+        Example:
+            pool = httpConnectionPool(maxIdlePerHost=4,idleTimeout=30)
+            response = pool.urlopen("http://www.foo.bar/images/foo.jpg",{'User-Agent':'webGobbler'})
+            data = response.read()
+            response.close()    # The connection goes back to the pool.
+    '''
+    def __init__(self, maxIdlePerHost=4, idleTimeout=30, maxRedirects=5):
+        ''' maxIdlePerHost (integer): maximum number of idle connections kept for each host.
+            idleTimeout (integer): idle connections older than this (in seconds) are closed.
+            maxRedirects (integer): maximum number of HTTP redirections followed.
+        '''
+        self.maxIdlePerHost = maxIdlePerHost
+        self.idleTimeout = idleTimeout
+        self.maxRedirects = maxRedirects
+        self._idle = {}                 # Idle connections (key=(scheme,host,port,tunnel), value=list of (connection,release time))
+        self._lock = threading.Lock()   # Lock for concurrent access to self._idle
+
+    def urlopen(self, url, headers=None, proxy=None):
+        ''' Sends a GET request and returns a pooledResponse object.
+            Redirections are followed.
+            Input: url (string): the URL to get.
+                   headers (dictionnary): additional HTTP request headers.
+                   proxy (tuple): (host,port,login,password) of the HTTP proxy to use, or None.
+                          (login and password can be None.)
+                          HTTPS URLs are requested through a CONNECT tunnel in the proxy.
+            Raises urllib.error.HTTPError if the server returned an error,
+            and urllib.error.URLError if the server could not be contacted
+            (like urllib.request.urlopen() does).
+        '''
+        for i in range(self.maxRedirects+1):
+            response = self._request(url, headers or {}, proxy)
+            location = response.info().get('Location')
+            if response.status in REDIRECT_CODES and location:
+                self._discard(response)
+                url = urllib.parse.urljoin(url, location)
+                continue
+            if response.status >= 400:
+                headers_received = response.info()
+                self._discard(response)
+                raise urllib.error.HTTPError(url, response.status, response.reason, headers_received, None)
+            return response
+        raise urllib.error.URLError("too many redirections")
+
+    def _request(self, url, headers, proxy):
+        ''' Sends a single request (redirections are not followed). '''
+        parsed = urllib.parse.urlsplit(url)
+        (scheme, netloc, path, query) = (parsed.scheme.lower(), parsed.netloc, parsed.path, parsed.query)
+        if scheme not in ('http', 'https'):
+            raise urllib.error.URLError("unsupported URL scheme %s" % scheme)
+        try:
+            host = parsed.hostname
+            port = parsed.port or (443 if scheme == 'https' else 80)
+        except ValueError as exc:  # Bogus port in URL
+            raise urllib.error.URLError(exc)
+        if not host:
+            raise urllib.error.URLError("no host given")
+
+        headers = dict(headers)
+        target = urllib.parse.urlunsplit(('', '', path or '/', query, ''))
+        key = (scheme, host, port, None)
+        if proxy:
+            (proxyhost, proxyport, login, password) = proxy
+            proxyheaders = ()
+            if login:
+                credentials = base64.b64encode(('%s:%s' % (login, password or '')).encode()).decode()
+                proxyheaders = (('Proxy-Authorization', 'Basic ' + credentials),)
+            if scheme == 'http':
+                # Plain HTTP through a proxy: connect to the proxy and send the full URL.
+                key = ('http', proxyhost, proxyport, None)
+                target = urllib.parse.urlunsplit((scheme, netloc, path or '/', query, ''))
+                headers.update(proxyheaders)
+            else:
+                # HTTPS through a proxy: tunnel to the host (CONNECT), the proxy headers are sent in the CONNECT request.
+                key = (scheme, host, port, (proxyhost, proxyport, proxyheaders))
+
+        # Try a kept-alive connection first. If the server has closed it meanwhile,
+        # try again with a fresh connection.
+        while True:
+            (connection, reused) = self._acquire(key)
+            try:
+                connection.request('GET', target, headers=headers)
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS as exc:
+                connection.close()
+                if reused:
+                    continue
+                raise urllib.error.URLError(exc)
+            except (OSError, http.client.HTTPException) as exc:
+                connection.close()
+                raise urllib.error.URLError(exc)
+            return pooledResponse(self, key, connection, response, url)
+
+    def _discard(self, response):
+        ''' Reads what remains of a (small) response body so that its connection can be reused. '''
+        try:
+            if response.length is not None and response.length <= 65536:
+                response.read()
+        except (OSError, http.client.HTTPException):
+            pass
+        response.close()
+
+    def _acquire(self, key):
+        ''' Returns a connection to the host: an idle one if available, a new one otherwise.
+            Output: a tuple (connection, reused)
+        '''
+        with self._lock:
+            self._evict(time.time())
+            idle = self._idle.get(key)
+            if idle:
+                (connection, releaseTime) = idle.pop()   # Most recently used connection first.
+                return (connection, True)
+        (scheme, host, port, tunnel) = key
+        if tunnel:
+            (proxyhost, proxyport, proxyheaders) = tunnel
+            connection = http.client.HTTPSConnection(proxyhost, proxyport)
+            connection.set_tunnel(host, port, dict(proxyheaders))
+            return (connection, False)
+        if scheme == 'https':
+            return (http.client.HTTPSConnection(host, port), False)
+        return (http.client.HTTPConnection(host, port), False)
+
+    def _release(self, key, connection):
+        ''' Gives a connection back to the pool. '''
+        tooMany = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            idle.append((connection, time.time()))
+            while len(idle) > self.maxIdlePerHost:  # Keep only the most recent connections.
+                tooMany.append(idle.pop(0)[0])
+            self._evict(time.time())
+        for connection in tooMany:
+            connection.close()
+
+    def _evict(self, now):
+        ''' Closes the connections which have been idle for too long.
+            Must be called with self._lock acquired.
+        '''
+        for key in list(self._idle.keys()):
+            idle = self._idle[key]
+            while idle and (now - idle[0][1] > self.idleTimeout or now < idle[0][1]):
+                idle.pop(0)[0].close()
+            if not idle:
+                del self._idle[key]
+
+    def closeAll(self):
+        ''' Closes all idle connections. '''
+        with self._lock:
+            for idle in self._idle.values():
+                for (connection, releaseTime) in idle:
+                    connection.close()
+            self._idle = {}
+
+_sharedPool = None                  # The pool shared by all collectors
+_sharedPoolLock = threading.Lock()
+
+def getConnectionPool(config):
+    ''' Returns the connection pool shared by all collectors.
+        config (applicationConfig object) : the program configuration
+    '''
+    global _sharedPool
+    with _sharedPoolLock:
+        if _sharedPool is None:
+            _sharedPool = httpConnectionPool()
+        # Configuration may have changed since the pool was created.
+        _sharedPool.maxIdlePerHost = config["network.http.keepalive.maxidle"]
+        _sharedPool.idleTimeout = config["network.http.keepalive.idletimeout"]
+        return _sharedPool
+
+def closeConnectionPool():
+    ''' Closes the idle connections of the pool shared by all collectors
+        (called by imagePool when its collectors have stopped.)
+    '''
+    with _sharedPoolLock:
+        pool = _sharedPool
+    if pool is not None:
+        pool.closeAll()
+
+def getProxy(config, url):
+    ''' Returns the proxy to use for this URL: a tuple (host,port,login,password) or None.
+        (The proxy configured in webGobbler is used for HTTP and HTTPS URLs.)
+    '''
+    if config["network.http.proxy.enabled"]:
+        if config["network.http.proxy.auth.enabled"]:
+            return (config["network.http.proxy.address"], config["network.http.proxy.port"],
+                    config["network.http.proxy.auth.login"], config["network.http.proxy.auth.password"])
+        return (config["network.http.proxy.address"], config["network.http.proxy.port"], None, None)
+    # No proxy configured in webGobbler: honor the system proxy settings (like urllib does).
+    parsed = urllib.parse.urlsplit(url)
+    proxyurl = urllib.request.getproxies().get(parsed.scheme.lower())
+    host = parsed.hostname or ''
+    if proxyurl and not urllib.request.proxy_bypass(host):
+        parsed = urllib.parse.urlsplit(proxyurl if '://' in proxyurl else 'http://'+proxyurl)
+        return (parsed.hostname, parsed.port or 80, parsed.username, parsed.password)
+    return None
+
+def openUrl(url, config):
+    ''' Opens an URL with the webGobbler User-Agent.
+        If keep-alive is enabled in configuration, the shared connection pool is used,
+        otherwise urllib.request.urlopen() is used.
+        Input: url (string): the URL to open
+               config (applicationConfig object) : the program configuration
+        Output: a file-like object (read(), info(), length, close())
+        Raises urllib.error.HTTPError or urllib.error.URLError (like urllib.request.urlopen())
+    '''
+    request_headers = { 'User-Agent': config["network.http.useragent"] }
+    if not config["network.http.keepalive"]:
+        request = urllib.request.Request(url, None, request_headers)  # Build the HTTP request
+        return urllib.request.urlopen(request)
+    return getConnectionPool(config).urlopen(url, request_headers, getProxy(config, url))
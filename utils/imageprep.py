@@ -0,0 +1,387 @@
+#!/usr/bin/python3
+
+# Preparation of the images superposed by assembler_superpose.
+# The functions of this module do not depend on the assembler state, so that
+# they can run in worker processes (see imagePreparer).
+
+import concurrent.futures
+import functools
+import math
+
+from utils.freeze_imports import Image, ImageOps
+from utils.histogram import autocontrastLut
+
+SHARED_MEMORY_AVAILABLE = True
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    SHARED_MEMORY_AVAILABLE = False
+
+# Image modes which can be passed to worker processes as raw pixels in shared memory.
+# (Other images are pickled.)
+SHARED_MEMORY_MODES = ('1','L','P','LA','RGB','RGBA','CMYK','YCbCr','I','F')
+
+class BadImage(Exception):
+    ''' This exception is raised when an image seems broken and can't be processed.
+        This exception is used in the assembler_superpose class internally.
+    '''
+    pass
+
+def preparationParameters(config):
+    ''' Returns the parameters of prepareImage() taken from the program configuration.
+        (The random parameters (rotation, position, invertmask) have to be set by the caller.)
+        Input: config (applicationConfig object) : the program configuration
+        Output: a dictionnary.
+    '''
+    return { 'sizex': config["assembler.sizex"],
+             'sizey': config["assembler.sizey"],
+             'scale': config["assembler.superpose.scale"],
+             'bordersmooth': config["assembler.superpose.bordersmooth"],
+             'bordersampling': config["assembler.superpose.bordersampling"],
+             'visibleonly': config["assembler.superpose.visibleonly"],
+             'rotation': None,
+             'position': (0.5,0.5),
+             'invertmask': False }
+
+def prepareImage(imageToSuperpose, parameters):
+    ''' Prepares an image before it is superposed in the current image:
+        converts it to RGB, scales it down, enhances contrast, inverts "white" images,
+        darkens its borders, rotates it and computes its transparency mask.
+        It also computes the position of the image in the final picture.
+        If parameters['visibleonly'] is True, only the part of the image which will be visible
+        in the final picture is prepared (the other pixels would be pasted outside the picture.)
+        Input:
+            imageToSuperpose (PIL Image object) : the image to prepare (it may be modified.)
+            parameters (dictionnary) : see preparationParameters().
+                'rotation' is the rotation angle in degrees (None = no rotation).
+                'position' (tuple of 2 floats between 0 and 1) : position of the image
+                    (0 = the image ends at the left/top of the picture, 1 = it starts at its right/bottom)
+                'invertmask' (boolean) : invert the transparency mask
+        Output: a tuple (image,mask,paste coordinates) ('RGB' and 'L' PIL Image objects, and a tuple (x,y))
+                (image and mask may be empty (0x0) if the image is not visible.)
+        Raises BadImage if the image cannot be processed.
+    '''
+    # Force the image to RGB mode:
+    if imageToSuperpose.mode != 'RGB':
+        try:
+            imageToSuperpose = imageToSuperpose.convert('RGB')
+        except TypeError:  # "TypeError: unsubscriptable object", what's that ?
+            raise BadImage
+        except IOError:  # IOError: decoder group4 not available ; Yes another PIL exception ?!
+            raise BadImage
+
+    # If the image is bigger than current image, scale it down to 1/2 of final picture dimensions
+    # (while keeping its ratio)
+    (imagex,imagey) = imageToSuperpose.size
+    if (imagex > parameters['sizex']) or (imagey > parameters['sizey']):
+        try:
+            imageToSuperpose.thumbnail((parameters['sizex']/2,parameters['sizey']/2),Image.LANCZOS)
+        except TypeError:  #TypeError: unsubscriptable object  ; Spurious exception in PIL.  :-(
+            raise BadImage
+        (imagex,imagey) = imageToSuperpose.size
+
+    # Scale down/up image if required.
+    scaleValue = parameters['scale']
+    if str(scaleValue) != "1.0":
+        try:
+            imageToSuperpose.thumbnail((int(float(imagex)*scaleValue),int(float(imagey)*scaleValue)),Image.LANCZOS)
+        except TypeError:  #TypeError: unsubscriptable object  ; Spurious exception in PIL.  :-(
+            raise BadImage
+        (imagex,imagey) = imageToSuperpose.size
+
+    # Choose the position of the image in the final picture:
+    (positionx,positiony) = parameters['position']
+    paste_coords = (int(positionx*(parameters['sizex']+imagex+1))-imagex, int(positiony*(parameters['sizey']+imagey+1))-imagey)
+    visible = (0,0,imagex,imagey)
+    if parameters['visibleonly']:
+        visible = (max(0,-paste_coords[0]),max(0,-paste_coords[1]),
+                   min(imagex,parameters['sizex']-paste_coords[0]),min(imagey,parameters['sizey']-paste_coords[1]))
+        if (visible[0] >= visible[2]) or (visible[1] >= visible[3]):
+            return (Image.new('RGB',(0,0)),Image.new('L',(0,0)),paste_coords)  # The image is outside the picture.
+
+    # Compensate for poorly-contrasted images on the web
+    # (The lookup table is computed on the whole image, but only applied to the part we need.)
+    try:
+        lut = autocontrastLut(imageToSuperpose.histogram())
+    except TypeError:  # Aaron tells me that this exception occurs with PNG images.
+        raise BadImage
+
+    # Some image are too white.
+    # For example, the photo of a coin on a white background.
+    # These picture degrad the quality of the final image.
+    # We try to dectect them by summing the value of the pixels
+    # on the borders.
+    # If the image is considered "white", we invert it.
+    step = max(1,parameters['bordersampling'])
+    pixelcount = 1  # 1 to prevent divide by zero error.
+    valuecount = 0
+    for box in ((0,5,imagex,6),(0,imagey-5,imagex,imagey-4),(5,0,6,imagey),(imagex-5,0,imagex-4,imagey)):
+        (values,pixels) = _sampleBorder(imageToSuperpose,box,step,lut)
+        valuecount += values
+        pixelcount += pixels
+
+    # If the average r+g+b of the border pixels exceed this value,
+    # we consider the image is too white, and we invert it.
+    if (100*(valuecount/(255*3))/pixelcount)>60:  # Cut at 60%.  (100% is RGB=(255,255,255))
+        lut = [255-value for value in lut]
+
+    wholeImage = imageToSuperpose
+    imageToSuperpose = _prepareRegion(wholeImage,lut,parameters,visible)
+
+    mask_image = imageToSuperpose.convert('L')
+    if (visible != (0,0,imagex,imagey)) and (mask_image.getextrema() != (0,255)):
+        # The contrast of the mask depends on the darkest and brightest pixels of the whole image:
+        # the whole image has to be prepared to know them. (Most images have black and white pixels
+        # in their visible part: autocontrast() then does nothing, on the whole image too.)
+        mask_image = mask_image.point(autocontrastLut(_prepareRegion(wholeImage,lut,parameters,(0,0,imagex,imagey)).convert('L').histogram()))
+    else:
+        mask_image = ImageOps.autocontrast(mask_image)
+    if parameters['invertmask']:
+        mask_image = ImageOps.invert(mask_image)
+    return (imageToSuperpose,mask_image,(paste_coords[0]+visible[0],paste_coords[1]+visible[1]))
+
+def _prepareRegion(image,lut,parameters,box):
+    ''' Applies the contrast lookup table, darkens the borders and rotates an image (see prepareImage()),
+        only computing the part box of the result.
+        Output: a PIL Image object (the part box of the prepared image).
+    '''
+    size = image.size
+    if parameters['rotation'] is None:
+        prepared = image.crop(box).point(lut)
+        # Darken image borders
+        return darkenImageBorder(prepared,parameters['bordersmooth'],box,size)
+    source = _rotationSource(size,parameters['rotation'],box)
+    if (source[0] >= source[2]) or (source[1] >= source[3]):
+        # box is in a corner of the rotated image, out of the image itself: it is black.
+        return Image.new('RGB',(box[2]-box[0],box[3]-box[1]))
+    prepared = image.crop(source).point(lut)
+    # Darken image borders
+    prepared = darkenImageBorder(prepared,parameters['bordersmooth'],source,size)
+    prepared = _rotateRegion(prepared,source,size,parameters['rotation'],box)
+    # Darken the borders of the rotated image:
+    return darkenImageBorder(prepared,parameters['bordersmooth'],box,size)
+
+def _rotationMatrix(size,angle):
+    ''' Returns the affine matrix used by Image.rotate(angle) for an image of this size
+        (from the rotated image to the source image), or None when Image.rotate() does not use a matrix.
+    '''
+    (sizex,sizey) = size
+    angle = angle % 360.0
+    if (angle in (0,180)) or ((angle in (90,270)) and (sizex == sizey)):
+        return None  # Image.rotate() copies or transposes the image.
+    (centerx,centery) = (sizex/2,sizey/2)
+    angle = -math.radians(angle)
+    (a,b,d,e) = (round(math.cos(angle),15),round(math.sin(angle),15),round(-math.sin(angle),15),round(math.cos(angle),15))
+    return [a,b,a*-centerx+b*-centery+centerx,d,e,d*-centerx+e*-centery+centery]
+
+def _rotationSource(size,angle,box):
+    ''' Returns the part of an image needed to compute the part box of the image rotated by angle.
+        Output: a box (left,upper,right,lower) in the image.
+    '''
+    matrix = _rotationMatrix(size,angle)
+    if matrix is None or box == (0,0)+tuple(size):
+        return (0,0)+tuple(size)
+    (a,b,c,d,e,f) = matrix
+    xs = [a*x+b*y+c for x in (box[0],box[2]) for y in (box[1],box[3])]
+    ys = [d*x+e*y+f for x in (box[0],box[2]) for y in (box[1],box[3])]
+    margin = 3  # (Bicubic interpolation reads 2 pixels around each source pixel.)
+    return (max(0,int(math.floor(min(xs)))-margin),max(0,int(math.floor(min(ys)))-margin),
+            min(size[0],int(math.ceil(max(xs)))+margin),min(size[1],int(math.ceil(max(ys)))+margin))
+
+def _rotateRegion(image,source,size,angle,box):
+    ''' Rotates a part of an image: returns image.rotate(angle,Image.BICUBIC).crop(box)
+        as if image was the full image (its size is size), image being only the part source of it
+        (see _rotationSource()).
+    '''
+    matrix = _rotationMatrix(size,angle)
+    if source == (0,0)+tuple(size) and (matrix is None or box == source):
+        return image.rotate(angle,Image.BICUBIC).crop(box)
+    (a,b,c,d,e,f) = matrix
+    # Move the origin of the rotated image to box, and the origin of the source image to source:
+    matrix = [a,b,c+a*box[0]+b*box[1]-source[0],d,e,f+d*box[0]+e*box[1]-source[1]]
+    return image.transform((box[2]-box[0],box[3]-box[1]),Image.AFFINE,matrix,Image.BICUBIC)
+
+def _sampleBorder(image,box,step,lut=None):
+    ''' Sums the r+g+b values of one pixel every step pixels in a line (or column) of an RGB image.
+        Input:
+            image (PIL Image object) : an 'RGB' image
+            box (tuple) : the line (or column) to sample, 1 pixel high (or wide)
+            step (integer) : sampling step (in pixels)
+            lut (list of integers) : lookup table to apply to the pixels before summing them (None = none)
+        Output: a tuple (sum of r+g+b values, number of pixels sampled)
+    '''
+    line = image.crop(box)
+    if lut is not None:
+        line = line.point(lut)
+    line = line.tobytes()  # r,g,b,r,g,b...
+    stride = 3*step
+    return (sum(line[0::stride])+sum(line[1::stride])+sum(line[2::stride]), len(range(0,len(line),stride)))
+
+def darkenImageBorder(image,borderSize=30,box=None,size=None):
+    '''
+    Uses a gradient to darken the 4 borders of an image.
+
+    Input:
+        image (PIL Image object): the image to process
+          WARNING: the image object is not preserved.
+          (You can pass yourImage.copy() to prevent this.)
+        borderSize (int) : size of the gradient (in pixels)
+        box, size (tuples) : if image is only a part of an image, the position (left,upper,right,lower)
+          of this part and the size (width,height) of the whole image (whose borders are darkened.)
+    Output:
+        a PIL Image object: the image with darkened borders.
+    '''
+    if borderSize <= 0:
+        return image
+    if box is None:
+        box = (0,0)+image.size
+        size = image.size
+    (sizex,sizey) = size
+    (left,upper) = box[:2]
+
+    # Paste black with the gradient masks on the 4 borders (those in the part of the image we have):
+    (black,top,bottom) = _borderGradients(sizex,borderSize,False)
+    if box[1] < borderSize:
+        image.paste(black,(-left,-upper),top)
+    if box[3] > sizey-borderSize:
+        image.paste(black,(-left,sizey-borderSize-upper),bottom)
+    (black,leftMask,rightMask) = _borderGradients(sizey,borderSize,True)
+    if box[0] < borderSize:
+        image.paste(black,(-left,-upper),leftMask)
+    if box[2] > sizex-borderSize:
+        image.paste(black,(sizex-borderSize-left,-upper),rightMask)
+
+    return image
+
+@functools.lru_cache(maxsize=16)
+def _borderGradients(length,borderSize,vertical):
+    ''' Returns the gradient masks used by darkenImageBorder() for two opposite borders of an image
+        (top and bottom, or left and right if vertical is True).
+        (Images are resized to fit the final picture, so one of their dimensions
+         is often the same: the masks are cached.)
+        Input:
+            length (integer) : length of the borders (in pixels)
+            borderSize (integer) : size of the gradient (in pixels)
+            vertical (boolean)
+        Output: a tuple (black 'RGB' image, mask, mask of the opposite border) of PIL Image objects.
+                (Pasting an image is faster than pasting a color.)
+    '''
+    # A single column, from opaque (on the border) to transparent (inside the image), stretched to the border length:
+    ramp = Image.frombytes('L',(1,borderSize),bytes(min(255,256-(256*i//borderSize)) for i in range(borderSize)))
+    mask = ramp.resize((length,borderSize),Image.NEAREST)
+    if vertical:
+        mask = mask.transpose(Image.TRANSPOSE)
+        return (Image.new('RGB',mask.size),mask,ImageOps.mirror(mask))
+    return (Image.new('RGB',mask.size),mask,ImageOps.flip(mask))
+
+# --- Worker processes ---------------------------------------------------------
+
+def _imagesToSharedMemory(images):
+    ''' Copies the pixels of several images in a new shared memory block.
+        Output: a tuple (shared memory block, descriptor)
+                The descriptor (a picklable tuple) can be passed to _imagesFromSharedMemory()
+                in another process.
+    '''
+    pixels = [image.tobytes() for image in images]
+    layout = []
+    size = 0
+    for (image,data) in zip(images,pixels):
+        layout.append((image.mode,image.size,size,len(data),image.getpalette() if image.mode == 'P' else None))
+        size += len(data)
+    block = shared_memory.SharedMemory(create=True,size=max(1,size))
+    for (data,(mode,imagesize,offset,length,palette)) in zip(pixels,layout):
+        block.buf[offset:offset+length] = data
+    return (block,(block.name,layout))
+
+def _imagesFromSharedMemory(descriptor):
+    ''' Reads the images stored in shared memory by _imagesToSharedMemory().
+        The images are copied: the shared memory block can be released afterwards.
+        Output: a tuple (shared memory block, list of PIL Image objects)
+    '''
+    (name,layout) = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    images = []
+    for (mode,size,offset,length,palette) in layout:
+        image = Image.frombytes(mode,size,block.buf[offset:offset+length])
+        if palette is not None:
+            image.putpalette(palette)
+        images.append(image)
+    return (block,images)
+
+def _prepareInWorker(descriptor,parameters):
+    ''' Runs prepareImage() in a worker process.
+        Input: descriptor: the image to prepare (a shared memory descriptor, or a pickled PIL Image object)
+               parameters (dictionnary) : see prepareImage()
+        Output: a tuple (shared memory descriptor of the prepared image and mask, paste coordinates)
+                (The caller must unlink the shared memory block.)
+    '''
+    if isinstance(descriptor,tuple):
+        (block,(image,)) = _imagesFromSharedMemory(descriptor)
+        block.close()
+    else:
+        image = descriptor
+    (image,mask,paste_coords) = prepareImage(image,parameters)
+    (block,descriptor) = _imagesToSharedMemory([image,mask])
+    block.close()  # (The caller will unlink the block.)
+    return (descriptor,paste_coords)
+
+class preparedImage:
+    ''' An image being prepared by an imagePreparer. '''
+    def __init__(self, future, block):
+        self._future = future   # concurrent.futures.Future of _prepareInWorker()
+        self._block = block     # Shared memory block containing the source image (None if it was pickled)
+
+    def result(self):
+        ''' Waits for the image to be prepared.
+            Output: a tuple (image,mask,paste coordinates) (see prepareImage())
+            Raises BadImage if the image cannot be processed.
+        '''
+        try:
+            (descriptor,paste_coords) = self._future.result()
+        finally:
+            if self._block is not None:  # The worker does not need the source image anymore.
+                self._block.close()
+                self._block.unlink()
+                self._block = None
+        (block,(image,mask)) = _imagesFromSharedMemory(descriptor)
+        block.close()
+        block.unlink()
+        return (image,mask,paste_coords)
+
+class imagePreparer:
+    ''' Runs prepareImage() in a pool of worker processes, so that image preparation
+        (which is CPU-bound) does not run under the GIL of the compositing thread.
+        Images are passed to and from the workers through shared memory.
+
+        Example:
+            preparer = imagePreparer(4)
+            job = preparer.submit(image,preparationParameters(config))
+            ...
+            (image,mask,paste_coords) = job.result()
+            preparer.shutdown()
+    '''
+    def __init__(self, workers):
+        ''' workers (integer): number of worker processes. '''
+        self.workers = workers
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, image, parameters):
+        ''' Asks a worker to prepare an image.
+            Output: a preparedImage object (call its result() method to get the image.)
+        '''
+        block = None
+        if SHARED_MEMORY_AVAILABLE and image.mode in SHARED_MEMORY_MODES:
+            (block,descriptor) = _imagesToSharedMemory([image])
+        else:
+            descriptor = image  # Unusual image mode: let pickle do the work.
+        try:
+            future = self._executor.submit(_prepareInWorker,descriptor,parameters)
+        except Exception:
+            if block is not None:
+                block.close()
+                block.unlink()
+            raise
+        return preparedImage(future,block)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True,cancel_futures=True)
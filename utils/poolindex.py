@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+import os
+import random
+import threading
+
+# File extensions of the images kept in the image pool directory.
+IMAGE_EXTENSIONS = ('.jpg','.jpeg','.jpe','.png','.gif','.bmp','.tif','.tiff','.pcx','.ppm','.tga')
+
+class poolIndex:
+    ''' In-memory index of the image files present in an image pool directory.
+        Collectors register the files they save (add()), the pool removes the
+        files it consumes (remove()), so that the pool does not have to list
+        the directory to know its content.
+        reconcile() re-synchronizes the index with the directory content
+        (at startup, and from time to time to see files added or removed by others.)
+        Counting files and picking a random file are O(1).
+        This class is thread-safe. Use getPoolIndex() to get the index of a directory.
+
+        Example:
+            index = getPoolIndex("imagepool")
+            index.reconcile()
+            filename = index.randomFile()   # eg. "WG0123456789abcdef0123456789abcdef01234567.jpg"
+            index.remove(filename)
+    '''
+    def __init__(self, directory):
+        ''' directory (string): the image pool directory. '''
+        self.directory = directory
+        self._lock = threading.Lock()   # Lock for concurrent access to self._files and self._positions
+        self._files = []                # Filenames (without path) of the images in the directory
+        self._positions = {}            # Position of each filename in self._files (key=filename)
+        self._listeners = []            # Functions called when files are added to the index.
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, filename):
+        return filename in self._positions
+
+    def add(self, filename):
+        ''' Registers an image file saved in the directory.
+            Input: filename (string): name of the file (without path).
+        '''
+        with self._lock:
+            if filename in self._positions:
+                return
+            self._positions[filename] = len(self._files)
+            self._files.append(filename)
+        self._notify()
+
+    def remove(self, filename):
+        ''' Forgets an image file (does not delete the file). '''
+        with self._lock:
+            self._remove(filename)
+
+    def _remove(self, filename):
+        ''' Must be called with self._lock acquired. '''
+        position = self._positions.pop(filename, None)
+        if position is None:
+            return
+        last = self._files.pop()
+        if position < len(self._files):  # Move the last filename in the hole.
+            self._files[position] = last
+            self._positions[last] = position
+
+    def randomFile(self, generator=random):
+        ''' Returns the filename (without path) of a random image of the pool, or None if the pool is empty.
+            generator (random.Random object) : the random number generator to use (default: the random module)
+        '''
+        with self._lock:
+            if not self._files:
+                return None
+            return self._files[generator.randrange(len(self._files))]
+
+    def reconcile(self):
+        ''' Lists the directory (a single os.scandir()) and updates the index to match its content.
+            Output: the number of images in the directory.
+        '''
+        filenames = set()
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS and entry.is_file():
+                        filenames.add(entry.name)
+        except OSError:
+            return len(self._files)  # Directory not readable: keep what we know.
+        with self._lock:
+            added = filenames.difference(self._positions)
+            for filename in set(self._positions).difference(filenames):
+                self._remove(filename)
+            for filename in sorted(added):  # (Sorted, so that seeded runs pick the same files.)
+                self._positions[filename] = len(self._files)
+                self._files.append(filename)
+            count = len(self._files)
+        if added:
+            self._notify()
+        return count
+
+    def addListener(self, listener):
+        ''' Registers a function which will be called (without parameters) when images are added.
+            The function may be called from any thread and must return quickly.
+        '''
+        self._listeners.append(listener)
+
+    def removeListener(self, listener):
+        try:
+            self._listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def _notify(self):
+        for listener in list(self._listeners):
+            listener()
+
+_indexes = {}                       # Indexes of each pool directory (key=absolute path)
+_indexesLock = threading.Lock()
+
+def getPoolIndex(directory):
+    ''' Returns the index of an image pool directory (always the same object for a given directory).
+        directory (string): the image pool directory.
+    '''
+    path = os.path.abspath(directory)
+    with _indexesLock:
+        if path not in _indexes:
+            _indexes[path] = poolIndex(path)
+        return _indexes[path]
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+# Replay logs of assembler_superpose (assembler.superpose.replaylog).
+# A replay log records, for each image generated by the assembler, the images taken
+# from the pool (file name and SHA1) and the random decisions made for each of them
+# (rotation, position...), so that the image can be generated again offline, from a
+# copy of the pool directory (see replayPool and assembler_replay in webgobbler.py).
+# The file contains one JSON object per line:
+#   {"render":1, "seed":1234, "start":"blank", "accumulator":null, "config":{...}} # A new image is generated
+#   {"render":1, "file":"WG...jpg", "sha1":"...", "rotation":12, "position":[0.1,0.7], "invertmask":false}
+#   ...                                                                             # (one line per image taken from the pool)
+#   {"render":1, "completed":true, "sha1":"..."}                                   # The image is generated
+
+import hashlib
+import json
+
+# Configuration keys which do not change the generated image (they are not replayed.)
+REPLAY_IGNORED_KEYS = ('assembler.superpose.workers','assembler.superpose.replaylog')
+
+# Configuration keys only read when the assembler starts: when they change in a log,
+# the program was restarted (the replay restarts the assembler too.)
+REPLAY_RESTART_KEYS = ('assembler.sizex','assembler.sizey','assembler.superpose.accumulator')
+
+def imageSha1(image):
+    ''' Returns the SHA1 (in hex) of the pixels of a PIL Image object. '''
+    return hashlib.sha1(image.tobytes()).hexdigest()
+
+class replayLog:
+    ''' Writes a replay log.
+
+        Example:
+            log = replayLog("render.log")
+            log.startRender(currentImage,config,seed,blank=True,accumulator=None)
+            log.image(image,parameters)     # For each image taken from the pool
+            log.completeRender(currentImage)
+            log.close()
+    '''
+    def __init__(self, filename):
+        ''' filename (string) : the log file (new lines are appended to it.) '''
+        self.filename = filename
+        self.file = open(filename,'a')
+        self.render = 0                 # Number of the image being generated (in this log)
+
+    def _write(self, record):
+        record['render'] = self.render
+        self.file.write(json.dumps(record,sort_keys=True)+'\n')
+        self.file.flush()
+
+    def startRender(self, canvas, config, seed, blank=False, accumulator=None):
+        ''' Records the start of a new image.
+            Input:
+                canvas (PIL Image object) : the image the new images are superposed on
+                config (applicationConfig object) : the program configuration
+                seed (integer) : the random seed (None if the render is not seeded)
+                blank (boolean) : True if the canvas will be blanked before images are superposed
+                accumulator (utils.accumulator.floatCanvas object) : the high-precision canvas
+                            (assembler.superpose.accumulator), or None
+        '''
+        self.render += 1
+        assemblerConfig = dict((key,value) for (key,value) in config.items()
+                               if key.startswith('assembler.') and key not in REPLAY_IGNORED_KEYS)
+        self._write({'seed':seed, 'start':'blank' if blank else imageSha1(canvas), 'config':assemblerConfig,
+                     'accumulator':accumulator.digest() if (accumulator is not None and not blank) else None})
+
+    def image(self, image, parameters):
+        ''' Records an image taken from the pool and the parameters used to prepare it (see utils.imageprep.prepareImage()). '''
+        record = { 'file': image.info.get('webgobbler.filename'), 'sha1': image.info.get('webgobbler.sha1') }
+        for key in ('rotation','position','invertmask'):
+            record[key] = parameters[key]
+        self._write(record)
+
+    def completeRender(self, canvas):
+        ''' Records the end of an image (canvas is the generated image, before post-processing.) '''
+        self._write({'completed':True, 'sha1':imageSha1(canvas)})
+
+    def close(self):
+        self.file.close()
+
+def readReplayLog(filename):
+    ''' Reads a replay log.
+        Output: a list of renders (dictionnaries: the first line of the render, plus
+                'images': the list of image records, and 'sha1': the SHA1 of the generated image
+                (None if the render was not completed.))
+    '''
+    renders = []
+    with open(filename,'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'start' in record:
+                record['images'] = []
+                record['sha1'] = None
+                renders.append(record)
+            elif not renders:
+                continue  # (The beginning of the log was truncated.)
+            elif record.get('completed'):
+                renders[-1]['sha1'] = record['sha1']
+            else:
+                renders[-1]['images'].append(record)
+    return renders
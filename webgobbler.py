@@ -12,10 +12,13 @@ import socket
 import urllib.request, urllib.parse, urllib.error
 import time
 import random
-import glob
 import getopt
 import getpass
 import logging
+import concurrent.futures
+import collections
+import hashlib
+import tempfile
 
 # Set default timeout for sockets.
 # urllib2 and all other libraries will use this timeout.
@@ -30,7 +33,17 @@ from assets.images import PLEASE_WAIT_IMAGE, WEBGOBBLER_LOGO, WEBGOBBLER_LOGO_TR
 from settings import VERSION
 import settings
 from utils.appconfig import applicationConfig
-from collectors import get_collectors, commandToken
+from collectors import get_collectors, commandToken, asyncCollectorEngine
+from utils.httppool import closeConnectionPool
+from utils.poolindex import getPoolIndex
+from utils.dirwatcher import directoryWatcher
+from utils.imageprep import BadImage, prepareImage, preparationParameters, imagePreparer
+from utils.histogram import equalizeLut, autocontrastLut, composeLut, mapHistogram
+from utils.replay import replayLog, readReplayLog, imageSha1, REPLAY_IGNORED_KEYS, REPLAY_RESTART_KEYS
+
+# Maximum number of areas of the current image updated separately by assembler_superpose._applyPendingLut()
+# (beyond, the whole image is updated.)
+MAXIMUM_LUT_REGIONS = 32
 
 # == Classes ===================================================================
 
@@ -43,12 +56,21 @@ class imagePool(threading.Thread):
         ''' config (applicationConfig object) : the program configuration '''
         threading.Thread.__init__(self)
         self.inputCommandQueue = queue.Queue()       # Input commands (commandToken objects)
-        self.outputImages = queue.Queue()            # Output images taken from the pool (PIL.Image objects)
+        self.outputImages = queue.Queue()            # Output images taken from the pool (PIL.Image objects), already decoded.
 
-        self.delayBetweenChecks = 5                  # Seconds between image pool directory content check
-        self.availableFiles = []                     # List of currently available images in the directory
-        self.lastCheckTime = 0                       # Datetime of last directory check.
+        self.lastCheckTime = 0                       # Datetime of last directory scan.
+        self.collecting = None                       # True if collectors were asked to collect images (None = not decided yet)
+        self.imageListeners = []                     # Functions called when an image is put in the output queue (see addImageListener())
         self.CONFIG = config
+        self.prefetch = max(1,self.CONFIG["pool.prefetch"])  # Number of decoded images kept ready in the output queue
+        self.decoders = None                         # Thread pool reading and decoding image files (created when the thread starts)
+        self.decodingCount = 0                       # Number of images being decoded
+        self.decodingLock = threading.Lock()         # Lock for self.decodingCount
+        self.logLock = threading.Lock()              # Lock for the image URL log file (written by the decoders)
+        self.random = random.Random(self.CONFIG["program.seed"] or None)  # Random choice of the images (seeded with program.seed)
+        self.decodeOrder = None                      # Decoder futures, in the order the images were picked (only if program.seed is set, see _imageDecoded())
+        if self.CONFIG["program.seed"]:
+            self.decodeOrder = collections.deque()
         self._log = logging.getLogger('imagepool')
         # If directory does not exist, create it.
         if not os.path.isdir(self.CONFIG["pool.imagepooldirectory"]):
@@ -57,92 +79,207 @@ class imagePool(threading.Thread):
             self._log.error("Could not create directory "+ os.path.abspath(self.CONFIG["pool.imagepooldirectory"]))
             raise IOError("Could not create directory "+ os.path.abspath(self.CONFIG["pool.imagepooldirectory"]))
         self._log.debug("Using images in %s" % os.path.abspath(self.CONFIG["pool.imagepooldirectory"]))
+        self.index = getPoolIndex(self.CONFIG["pool.imagepooldirectory"])  # Images available in the directory (updated by collectors)
+        self.index.addListener(self._poolChanged)
+        self.watcher = None                          # Watches the directory for files added/deleted by other programs (None if not available)
         self.collectors = get_collectors(config) # List of collector objects which download images from the internet (collector object descendants)
+        self.collectorEngine = None              # Event loop running all collectors (None if each collector runs in its own thread)
+        if self.CONFIG["collector.engine"] == "asyncio":
+            self.collectorEngine = asyncCollectorEngine(self.collectors,config)
+        elif self.CONFIG["collector.engine"] != "threads":
+            self._log.warning('Unknown collector.engine "%s". Using threads.' % self.CONFIG["collector.engine"])
 
     def run(self):
         # Start all collectors
-        for collector in self.collectors:
-            collector.start()           # Start all collector threads.
-        time.sleep(0.5)   # Give them time to start.
+        if self.collectorEngine:
+            self.collectorEngine.start()    # Start the thread running all collectors.
+        else:
+            for collector in self.collectors:
+                collector.start()           # Start all collector threads.
+        if self.CONFIG["pool.watchdirectory"]:
+            try:
+                self.watcher = directoryWatcher(self.index)
+                self.watcher.start()
+            except OSError as exc:
+                self._log.debug("Cannot watch pool directory (%s). Will rescan it every %d seconds." % (exc,self.CONFIG["pool.rescaninterval"]))
+                self.watcher = None
+        self.decoders = concurrent.futures.ThreadPoolExecutor(max_workers=max(1,self.CONFIG["pool.decodeworkers"]),
+                                                              thread_name_prefix='imagepool-decoder')
+        self._rescan()   # Read the directory content once at startup.
         while True:
+            # Ensure there are always self.prefetch decoded images in the output queue
+            # available to assemblers.
+            self._fillOutputQueue()
+            # Ensure there are always enough images in the directory.
+            # and start/stop the collector is there are not enough/enough pictures in the directory.
+            self._controlCollectors()
             try:
-                commandToken = self.inputCommandQueue.get_nowait()  # Get orders
+                # Wait for orders, or for the next directory scan.
+                delay = None
+                if self._rescanNeeded():
+                    delay = max(0,self.lastCheckTime+self.CONFIG["pool.rescaninterval"]-time.time())
+                commandToken = self.inputCommandQueue.get(True,delay)
                 if commandToken.shutdown:
                     self._log.debug("Shutting down")
+                    self.index.removeListener(self._poolChanged)
+                    if self.watcher:
+                        self.watcher.stop()
+                    self.decoders.shutdown(wait=True,cancel_futures=True)
                     for collector in self.collectors:  # Ask all collectors to stop
                         collector.shutdown()
-                    for collector in self.collectors:  # and wait for them to stop.
-                        collector.join()
+                    if self.collectorEngine:           # and wait for them to stop.
+                        self.collectorEngine.join()
+                    else:
+                        for collector in self.collectors:
+                            collector.join()
+                    closeConnectionPool()  # Close the kept-alive connections of the collectors.
                     return # Exit the tread.
+                elif commandToken.refill:
+                    pass   # An image was taken from the output queue, or a new image arrived: we will put another one.
                 else:
                     self._log.error("Unknown command token")
                     pass  # Unknown command, ignore.
             except queue.Empty:
-                # Ensure there are always enough images in the directory.
-                # and start/stop the collector is there are not enough/enough pictures in the directory.
-                elapsed = time.time()-self.lastCheckTime  # Count time since last check.
-                if (elapsed > self.delayBetweenChecks) or (elapsed<0):
-                    # Check the directory
-                    self.availableFiles = self._getFileList()
-                    if len(self.availableFiles) < self.CONFIG["pool.nbimages"]:  # We do not have enough images
-                        for collector in self.collectors:
-                            collector.collectNonStop()
-                    else:  # we have enough images: stop collecting.
-                        for collector in self.collectors:
-                            collector.stopcollecting()
-                    self.lastCheckTime = time.time()
-                    time.sleep(0.25)
-                # Then ensure there is always one image in the output queue
-                # available to assemblers.
-                if (self.outputImages.qsize()<1) and (len(self.availableFiles)>0):
-                    # Get a random filename from the list of available images.
-                    filename = random.choice(self.availableFiles) # Choose a random file in the list
-                    #(we do not need to remove the file from the self.availableFiles list, because the file will be
-                    # deleted and will diseappear from the list at the next refresh of self.availableFiles)
-                    imagedata = None
-                    try: # Read image file.
-                        file = open(filename,'rb')
-                        imagedata = file.read(self.CONFIG["collector.maximumimagesize"])
-                        file.close()
-                    except IOError:
-                        pass
-                    if imagedata != None:
-                        if not self.CONFIG["pool.keepimages"]:
-                            try:
-                                os.remove(filename)  # Delete the file we've just successfully read.
-                            except OSError:
-                                pass
-                        imageparser = ImageFile.Parser()
-                        image = None
-                        try:  # Try to decode file content.
-                            imageparser.feed(imagedata)
-                            image = imageparser.close()   # Get the Image object.
-                        except: # PIL cannot understand file content.
-                            pass # self._log.info("Bad image. Dropping file.")  # Oops !  Bad image. Ignore it.
-                        imageurl = "<url unknown>"
-                        try: # Extract image URL from file (written at end)
-                            partial_data = imagedata[-1024:]  # Get the 1024 last bytes of file
-                            commentoffset = partial_data.rfind(self.CONFIG["pool.sourcemark"])
-                            if commentoffset < 0:
-                                imageurl = '<url unknown>'
-                            else:
-                                imageurl = partial_data[commentoffset+len(self.CONFIG["pool.sourcemark"]):]
-                        except:
-                            imageurl = "<url unknown>"
-                        # Now, log in HTML format.
-                        localfilename = os.path.split(filename)[1]
-                        self._logImageUrl('<code>%s:&nbsp;<a href="%s">%s</a></code><br>' % (localfilename,imageurl,imageurl))
-                        self.outputImages.put(image,True)  # Put the image in the output queue
-                time.sleep(0.25)
-
-    def _getFileList(self):
-        ''' Returns the list of image files present in the imagepool directory.
+                pass
+            # From time to time, re-read the directory content
+            # (in case images were added or deleted by someone else.)
+            elapsed = time.time()-self.lastCheckTime  # Count time since last scan.
+            if self._rescanNeeded() and ((elapsed >= self.CONFIG["pool.rescaninterval"]) or (elapsed<0)):
+                self._rescan()
+
+    def _rescanNeeded(self):
+        ''' Returns True if the directory content has to be re-read from time to time
+            (ie. rescan is enabled and the directory is not watched.)
+        '''
+        return (self.CONFIG["pool.rescaninterval"] > 0) and (self.watcher is None or not self.watcher.is_alive())
+
+    def _rescan(self):
+        ''' Synchronizes the pool index with the directory content. '''
+        count = self.index.reconcile()
+        self._log.debug("%d images in pool directory." % count)
+        self.lastCheckTime = time.time()
+
+    def _controlCollectors(self):
+        ''' Starts/stops the collectors if there are not enough/enough pictures in the pool. '''
+        collecting = len(self.index) < self.CONFIG["pool.nbimages"]  # Do we have enough images ?
+        if collecting == self.collecting:
+            return   # The collectors are already doing what we want.
+        self.collecting = collecting
+        for collector in self.collectors:
+            if collecting:  # We do not have enough images
+                collector.collectNonStop()
+            else:  # we have enough images: stop collecting.
+                collector.stopcollecting()
+
+    def _poolChanged(self):
+        ''' Called by the pool index (in collector threads) when new images are saved in the pool. '''
+        if (self.outputImages.qsize()<self.prefetch) or self.collecting:
+            self.inputCommandQueue.put(commandToken(refill=1),True)  # Wake up the pool thread.
+
+    def _fillOutputQueue(self):
+        ''' Asks the decoders to read and decode images until the output queue
+            contains self.prefetch images (or will, once the images are decoded.)
+        '''
+        while len(self.index)>0:
+            with self.decodingLock:
+                if self.outputImages.qsize()+self.decodingCount >= self.prefetch:
+                    return  # We have enough images (or will have soon.)
+                self.decodingCount += 1
+            # Get a random filename from the images available in the pool.
+            localfilename = self.index.randomFile(self.random)
+            if localfilename is None:
+                with self.decodingLock:
+                    self.decodingCount -= 1
+                return
+            if not self.CONFIG["pool.keepimages"]:
+                self.index.remove(localfilename)  # (So that no other decoder picks it.)
+            with self.decodingLock:
+                future = self.decoders.submit(self._decodeImage,localfilename)
+                if self.decodeOrder is not None:
+                    self.decodeOrder.append(future)
+            future.add_done_callback(self._imageDecoded)
+
+    def _decodeImage(self,localfilename):
+        ''' Reads an image file and decodes it.
+            This method is run by the decoders thread pool (see _imageDecoded()).
+            Output: a PIL Image object (None if the file cannot be read or decoded.)
         '''
-        filelist = []
-        for extension in ('jpg','jpeg','jpe','png','gif','bmp','tif','tiff','pcx','ppm','tga'):
-            filelist += glob.glob(os.path.join(self.CONFIG["pool.imagepooldirectory"],"*."+extension))
-        #FIXME: Maybe I could do a better job here by using a single listdir() and use fnmatch()
-        return filelist
+        try:
+            return self._readImage(localfilename)
+        except Exception as exc:
+            self._log.exception(exc)
+            return None
+
+    def _imageDecoded(self,future):
+        ''' Puts the images decoded by the decoders in the output queue (called by the decoder thread when an image is decoded.)
+            If program.seed is set, the images are put in the output queue in the order they were picked
+            (the decoders may finish in another order), so that a seeded render uses the same images.
+        '''
+        with self.decodingLock:
+            if self.decodeOrder is None:
+                done = [future]
+            else:  # Take the decoded images at the head of the queue (the next ones wait for the images picked before them.)
+                done = []
+                while self.decodeOrder and self.decodeOrder[0].done():
+                    done.append(self.decodeOrder.popleft())
+            imageAdded = False
+            for decoded in done:
+                image = None if decoded.cancelled() else decoded.result()  # (Decoders are cancelled on shutdown.)
+                if image is not None:
+                    self.outputImages.put(image,True)  # Put the image in the output queue (under decodingLock, to keep the order.)
+                    imageAdded = True
+            self.decodingCount -= len(done)
+        if imageAdded:
+            for listener in self.imageListeners:  # Tell the assemblers.
+                listener()
+        if done:
+            self.inputCommandQueue.put(commandToken(refill=1),True)  # Let the pool thread decode the next image.
+
+    def _readImage(self,localfilename):
+        ''' Reads and decodes an image file of the pool (and deletes it, unless pool.keepimages is set.)
+            Output: a PIL Image object (None if the file cannot be read or decoded.)
+                    image.info['webgobbler.filename'] and image.info['webgobbler.sha1'] are the name
+                    of the file and the SHA1 of its content (see utils.replay).
+        '''
+        filename = os.path.join(self.CONFIG["pool.imagepooldirectory"],localfilename)
+        imagedata = None
+        try: # Read image file.
+            file = open(filename,'rb')
+            imagedata = file.read(self.CONFIG["collector.maximumimagesize"])
+            file.close()
+        except IOError:
+            self.index.remove(localfilename)  # The file has disappeared.
+            return None
+        if not self.CONFIG["pool.keepimages"]:
+            try:
+                os.remove(filename)  # Delete the file we've just successfully read.
+            except OSError:
+                pass
+        imageparser = ImageFile.Parser()
+        image = None
+        try:  # Try to decode file content.
+            imageparser.feed(imagedata)
+            image = imageparser.close()   # Get the Image object.
+            image.load()
+        except: # PIL cannot understand file content.
+            self.index.remove(localfilename)  # (Do not pick it again.)
+            return None # self._log.info("Bad image. Dropping file.")  # Oops !  Bad image. Ignore it.
+        image.info['webgobbler.filename'] = localfilename
+        image.info['webgobbler.sha1'] = hashlib.sha1(imagedata).hexdigest()
+        imageurl = "<url unknown>"
+        try: # Extract image URL from file (written at end)
+            partial_data = imagedata[-1024:]  # Get the 1024 last bytes of file
+            sourcemark = self.CONFIG["pool.sourcemark"].encode()
+            commentoffset = partial_data.rfind(sourcemark)
+            if commentoffset < 0:
+                imageurl = '<url unknown>'
+            else:
+                imageurl = partial_data[commentoffset+len(sourcemark):].decode('utf-8','replace')
+        except:
+            imageurl = "<url unknown>"
+        # Now, log in HTML format.
+        self._logImageUrl('<code>%s:&nbsp;<a href="%s">%s</a></code><br>' % (localfilename,imageurl,imageurl))
+        return image
 
     def shutdown(self):
         ''' Ask this thread to die. '''
@@ -154,10 +291,12 @@ class imagePool(threading.Thread):
             Will return None if no image is available at this time.
             If no image is available, caller should call this method again
             a few time later (It will probably have images available.)
+            (See addImageListener() to be told when an image is available.)
         '''
         image = None
         try:
             image = self.outputImages.get_nowait()
+            self.inputCommandQueue.put(commandToken(refill=1),True)  # Ask the pool thread for another image.
         except queue.Empty:
             pass
         return image
@@ -167,18 +306,20 @@ class imagePool(threading.Thread):
             This is blocking and will block until an image is available.
             (The duration may be several seconds.)
         '''
-        image = None
-        while (image==None):
-            try:
-                image = self.outputImages.get_nowait()
-            except queue.Empty:
-                pass
-            time.sleep(0.25)
+        image = self.outputImages.get()
+        self.inputCommandQueue.put(commandToken(refill=1),True)  # Ask the pool thread for another image.
         return image
 
+    def addImageListener(self,listener):
+        ''' Registers a function which will be called (without parameters, from one of the pool threads)
+            each time an image is made available to getImage().
+            The function must return quickly (eg. put a message in a queue).
+        '''
+        self.imageListeners.append(listener)
+
     def getPoolSize(self):
         ''' Returns the number of images in the pool. '''
-        return len(self.availableFiles)
+        return len(self.index)
 
     def _logImageUrl(self, text):
         ''' Record the URL of the last given image.
@@ -189,6 +330,10 @@ class imagePool(threading.Thread):
             Note that ideally, 'text' should contain only HTML, and a single line of text (no CR/LF)
         '''
         # FIXME: try/except all IO operations here ?
+        with self.logLock:  # (Several decoders may log at the same time.)
+            self._writeImageUrlLog(text)
+
+    def _writeImageUrlLog(self, text):
         filename = os.path.join(self.CONFIG["pool.imagepooldirectory"],"last_used_images.html")
         file = open(filename,"a+")
         file.write(text+"\n")
@@ -199,7 +344,7 @@ class imagePool(threading.Thread):
             data = file.read()
             file.close()
             data = data[-800000:] # Keep the last 800 kilobytes
-            data = "\n".join(data.split("\n")[2:])  # Remove the first lines (which is probably cut)
+            data = b"\n".join(data.split(b"\n")[2:])  # Remove the first lines (which is probably cut)
             file = open(filename,"w+b")
             file.write(data)
             file.close()
@@ -232,20 +377,16 @@ class assembler(threading.Thread):
 
     def run(self):
         while True:
-            try:
-                commandToken = self.inputCommandQueue.get_nowait()  # Get orders
-                if commandToken.shutdown:
-                    self._logInfo("Shutting down")
-                    self.closing = True
-                    self.pool.shutdown()
-                    self.pool.join()
-                    return # Exit the tread.
-                else:
-                    self._logError("Unknown command token")
-                    pass  # Unknown command, ignore.
-            except queue.Empty:
-                #self._log("Nothing in queue")
-                time.sleep(0.5)
+            commandToken = self.inputCommandQueue.get()  # Wait for orders
+            if commandToken.shutdown:
+                self._logInfo("Shutting down")
+                self.closing = True
+                self.pool.shutdown()
+                self.pool.join()
+                return # Exit the tread.
+            else:
+                self._logError("Unknown command token")
+                pass  # Unknown command, ignore.
 
     def shutdown(self):
         ''' Ask this thread to die. '''
@@ -355,12 +496,6 @@ class assembler_mosaic(assembler):
         finalImage.save(destinationFilename)
         self._logInfo("Done.")
 
-class BadImage(Exception):
-    ''' This exception is raised when an image seems broken and can't be processed.
-        This exception is used in the assembler_superpose class internally.
-    '''
-    pass
-
 class assembler_superpose(threading.Thread):
     def __init__(self,pool,config,ignorePreviousImage=False):
         ''' Outputs a superposed mesh of images.
@@ -406,9 +541,33 @@ class assembler_superpose(threading.Thread):
         self.blankImage = False                 # Should the superpose() blank image before starting ?
         self.finalImage = None                  # Final image (self.currentImage after post-processing.)
         self.finalImageCompletionDate = None    # Date/time when last image was generated.
-        self.finalImageLock = threading.RLock() # Lock for concurrent access to self.finalImage
+        self.resizedImages = {}                 # self.finalImage resized to other sizes (key=(width,height), see getImage())
+        self.resizedImagesDate = None           # Value of self.finalImageCompletionDate when self.resizedImages were computed
+        self.imageBuffers = {}                  # Pixels of self.finalImage in raw layouts (key=(rawmode,stride), see getImageBuffer())
+        self.imageBuffersDate = None            # Value of self.finalImageCompletionDate when self.imageBuffers were computed
+        self.finalImageLock = threading.RLock() # Lock for concurrent access to self.finalImage (and self.previewImage)
+        self.previewImage = None                # Last preview of the image being generated (see getPreviewImage())
+        self.previewImageDate = None            # Date/time when the last preview was published.
+        self.imagesSincePreview = 0             # Number of images superposed since the last preview
+        self.previewWanted = False              # True if superposeB() wants to be told when a preview is published.
+        self.histogram = None                   # Histogram of self.currentImage, updated at each paste (None = not computed yet)
+        self.pendingLuts = []                   # Lookup tables not applied yet to self.currentImage: pendingLuts[v] combines the tables added after the v first ones (see _addLut())
+        self.lutRegions = []                    # Areas of self.currentImage already brought up to date (list of (box,v): the v first pendingLuts are applied in box)
+        self.imagesSinceContrast = 0            # Number of images superposed since the last equalize (or autocontrast)
+        self.accumulator = None                 # High-precision canvas (utils.accumulator.floatCanvas object) if assembler.superpose.accumulator is set.
+        self.random = random.Random(self.CONFIG["program.seed"] or None)  # Random decisions (rotations, positions...) seeded with program.seed
+        self.replayLog = None                   # Log of the decisions made for each image (utils.replay.replayLog object) if assembler.superpose.replaylog is set.
+        if self.CONFIG["assembler.superpose.replaylog"]:
+            self.replayLog = replayLog(self.CONFIG["assembler.superpose.replaylog"])
         self._loadPreviousImage(ignorePreviousImage) # Get image from previous run.
+        if self.CONFIG["assembler.superpose.accumulator"]:
+            self._loadAccumulator(ignorePreviousImage)
         self.state = "Waiting"                  # State of the assemble (textual)
+        self.stateListeners = []                # Functions called when the state changes or an image is published (see addStateListener())
+        self.waitingForImage = False            # True when the pool had no image for us (we wait for a imageavailable command.)
+        self.preparer = None                    # Worker processes preparing images (None if images are prepared by this thread)
+        self.preparing = collections.deque()    # Images being prepared by the worker processes (preparedImage objects, in order)
+        self.pool.addImageListener(self._imageAvailable)
 
     # Loggin methods:
     def _logDebug    (self,message): logging.getLogger(self.name).debug    (message)
@@ -420,13 +579,28 @@ class assembler_superpose(threading.Thread):
 
     def run(self):
         ''' The main thread dispatch method. '''
+        try:
+            self._run()
+        finally:
+            self.superposeCompleted.put("stopped",True)  # Do not let superposeB() wait for a dead thread.
+            self._setState("Stopped")
+
+    def _run(self):
         time.sleep(0.5)  # Give time to other threads (usefull to let the GUI start to display)
+        if self.CONFIG["assembler.superpose.workers"] > 0:
+            self.preparer = imagePreparer(self.CONFIG["assembler.superpose.workers"])
         while True:
+            # Sleep until we receive a command, unless we have images to superpose
+            # and the pool has images.
+            block = (self.nbImagesToSuperpose == 0) or self.waitingForImage
             try:
-                commandToken = self.inputCommandQueue.get_nowait()  # Get orders
+                commandToken = self.inputCommandQueue.get(block)  # Get orders
                 if commandToken.shutdown:   # We are aksed to shutdown.
                     self._logInfo("Shutting down")
-                    self.state = "Shutting down"
+                    self._setState("Shutting down")
+                    self._stopPreparer()
+                    if self.replayLog:
+                        self.replayLog.close()
                     self.pool.shutdown()  # Ask the image pool to shutdown.
                     self.pool.join()      # Wait for the thread to die.
                     return                # Exit our tread.
@@ -434,10 +608,19 @@ class assembler_superpose(threading.Thread):
                     if self.nbImagesToSuperpose == 0:  # Ignore the command if we are already assembling images (!=0)
                         self._logInfo("Superposing %d images in current image" % commandToken.superpose)
                         self.nbImagesToSuperpose = commandToken.superpose  # Get the number of images to superpose
+                        self.waitingForImage = False
+                        self.imagesSincePreview = 0
+                        if self.replayLog:
+                            self.replayLog.startRender(self.currentImage,self.CONFIG,self.CONFIG["program.seed"] or None,self.blankImage,self.accumulator)
                         # Blank the image if needed:
                         if self.blankImage:
                             self.currentImage = Image.new('RGB',(self.CONFIG["assembler.sizex"],self.CONFIG["assembler.sizey"]))
+                            self.histogram = None
+                            if self.accumulator is not None:
+                                self.accumulator.clear()
                             self.blankImage = False
+                elif commandToken.imageavailable:  # The pool has a new image.
+                    self.waitingForImage = False
                 else:
                     self._logError("Unknown command token")
                     pass  # Unknown command, ignore.
@@ -445,6 +628,9 @@ class assembler_superpose(threading.Thread):
                 if self.nbImagesToSuperpose > 0:  # Do we have images to assemble ?
                     self._superpose()  # Let's superpose one image. (This method will decrement self.nbImagesToSuperpose if successfull)
                     if self.nbImagesToSuperpose == 0:  # Are we done assembling images ?
+                        self._completeImage()
+                        if self.replayLog:
+                            self.replayLog.completeRender(self.currentImage)
                         # Let's save the current image.
                         self._logInfo("Saving session image and post-processing...")
                         self._saveCurrentImage()
@@ -457,145 +643,318 @@ class assembler_superpose(threading.Thread):
                         self.finalImageLock.release()
                         self._logInfo("Done.")
                         self.superposeCompleted.put("completed",True)
-                        self.state = "Waiting"
-                else:
-                    #self._logInfo("Nothing in queue")
-                    time.sleep(0.5)
+                        self._setState("Waiting")  # (This also tells the listeners a new image is available.)
+
+    def _setState(self,state):
+        ''' Sets the state of the assembler and tells the listeners (see addStateListener()). '''
+        self.state = state
+        self._notifyListeners()
+
+    def _notifyListeners(self):
+        for listener in self.stateListeners:
+            try:
+                listener()
+            except Exception as exc:
+                self._logException(exc)
+
+    def _imageAvailable(self):
+        ''' Called by the pool (in the pool thread) when an image is available. '''
+        self.inputCommandQueue.put(commandToken(imageavailable=1),True)
 
     def _superpose(self):
-        ''' Superpose an image.
+        ''' Superpose a batch of images (assembler.superpose.batchsize images, usually one).
             This method must only be called by the assembler_superpose thread !
         '''
-        (imagex, imagey) = (0,0)
+        batchSize = max(1,min(self.CONFIG["assembler.superpose.batchsize"],self.nbImagesToSuperpose))
+        try:
+            if self.preparer:
+                images = self._prepareInWorkers(batchSize)
+            else:
+                images = self._prepareImages(batchSize)
+            if not images:
+                return  # It's ok, we'll try when the pool tells us it has an image.
+            self._logInfo("Superposing image %d" % self.nbImagesToSuperpose)
+            self._setState("Superposing image %d of %d" % (self.CONFIG["assembler.superpose.nbimages"]-self.nbImagesToSuperpose+1, self.CONFIG["assembler.superpose.nbimages"]))
+
+            # Superpose the images in current image.
+            pasted = self._pasteImages(images)
+            self.nbImagesToSuperpose = self.nbImagesToSuperpose - pasted
+            self.imagesSincePreview += pasted
+            if (self.CONFIG["assembler.superpose.previewevery"] > 0) and (self.imagesSincePreview >= self.CONFIG["assembler.superpose.previewevery"]) \
+               and (self.nbImagesToSuperpose > 0):  # (The final image will follow.)
+                self._publishPreview()
+        except Exception as exc:
+            self._logError("Could not assemble image because %s" % str(exc))
+
+    def _getImageFromPool(self):
+        ''' Gets an image from the pool.
+            Output: a PIL Image object, or None if the pool has no image (or the image is too small).
+        '''
         # Try to get an image from the pool.
         imageToSuperpose = self.pool.getImage()
         if imageToSuperpose == None:  # no image availabe.
             #self._logError("No image from the pool.");
-            time.sleep(0.25)
-            return  # It's ok, we'll try next time.
+            self.waitingForImage = True
+            return None
 
         # If the image is too small, get another image.
         (imagex,imagey) = imageToSuperpose.size
-        if (imagex < 32) or (imagey < 32):
-            return    # Image is too small. We'll take another one.
-
-        self._logInfo("Superposing image %d" % self.nbImagesToSuperpose)
-        self.state = "Superposing image %d of %d" % (self.CONFIG["assembler.superpose.nbimages"]-self.nbImagesToSuperpose+1, self.CONFIG["assembler.superpose.nbimages"])
-
-        # Superpose the image in current image.
-        try:
-            self.currentImage = self._superposeOneImage(self.currentImage,imageToSuperpose)
-            self.nbImagesToSuperpose = self.nbImagesToSuperpose - 1
-        except BadImage:
-            self._logInfo("Broken image ; Ignoring.")
-        except Exception as exc:
-            self._logError("Could not assemble image because %s" % str(exc))
+        if (imagex < settings.MINIMUM_IMAGE_SIZE) or (imagey < settings.MINIMUM_IMAGE_SIZE):
+            return None   # Image is too small. We'll take another one.
+        return imageToSuperpose
 
-    def _superposeOneImage(self, currentImage, imageToSuperpose):
-        ''' Superposes one image in the current image.
-            This method must only be called by the assembler_superpose thread !
-            Intput:
-                currentImage (PIL Image object) : the current image
-                imageToSupepose (PIL Image object) : the image to superpose in current image.
-            Output: a PIL Image object.
+    def _prepareImages(self, count):
+        ''' Takes up to count images from the pool and prepares them (see utils.imageprep.prepareImage()).
+            Output: a list of tuples (image,mask,paste coordinates) (may be empty if the pool has no image.)
         '''
-        # Darken slightly the current image:
-        if self.CONFIG["assembler.superpose.variante"] == 1:
-          currentImage = ImageEnhance.Brightness(currentImage).enhance(0.99)  # Old value (in beta 3): 0.985
-
-        # Force the image to RGB mode:
-        if imageToSuperpose.mode != 'RGB':
+        images = []
+        while len(images) < count:
+            imageToSuperpose = self._getImageFromPool()
+            if imageToSuperpose == None:
+                break
             try:
-                imageToSuperpose = imageToSuperpose.convert('RGB')
-            except TypeError:  # "TypeError: unsubscriptable object", what's that ?
-                raise BadImage
-            except IOError:  # IOError: decoder group4 not available ; Yes another PIL exception ?!
-                raise BadImage
-
-        # If the image is bigger than current image, scale it down to 1/2 of final picture dimensions
-        # (while keeping its ratio)
-        (imagex,imagey) = imageToSuperpose.size
-        if (imagex > self.CONFIG["assembler.sizex"]) or (imagey > self.CONFIG["assembler.sizey"]):
+                images.append(prepareImage(imageToSuperpose,self._preparationParameters(imageToSuperpose)))
+            except BadImage:
+                self._logInfo("Broken image ; Ignoring.")
+        return images
+
+    def _prepareInWorkers(self, count):
+        ''' Gets up to count images prepared by the worker processes.
+            Images are taken from the pool and given to the workers, so that the workers
+            prepare the next images while this thread pastes the current ones.
+            Output: a list of tuples (image,mask) (may be empty if the pool has no image.)
+        '''
+        # Keep the workers busy (but do not prepare more images than we need):
+        while len(self.preparing) < min(max(self.preparer.workers+1,count),self.nbImagesToSuperpose):
+            imageToSuperpose = self._getImageFromPool()
+            if imageToSuperpose == None:
+                if self.waitingForImage and self.preparing:
+                    self.waitingForImage = False  # Do not wait: we have images to paste.
+                break
+            self.preparing.append(self.preparer.submit(imageToSuperpose,self._preparationParameters(imageToSuperpose)))
+
+        images = []
+        while self.preparing and len(images) < count:
             try:
-                imageToSuperpose.thumbnail((self.CONFIG["assembler.sizex"]/2,self.CONFIG["assembler.sizey"]/2),Image.LANCZOS)
-            except TypeError:  #TypeError: unsubscriptable object  ; Spurious exception in PIL.  :-(
-                raise BadImage
-            (imagex,imagey) = imageToSuperpose.size
-
-        # Scale down/up image if required.
-        scaleValue = self.CONFIG["assembler.superpose.scale"]
-        if str(scaleValue) != "1.0":
+                images.append(self.preparing.popleft().result())
+            except BadImage:
+                self._logInfo("Broken image ; Ignoring.")
+        return images
+
+    def _stopPreparer(self):
+        ''' Stops the worker processes (if any). '''
+        if not self.preparer:
+            return
+        self.preparer.shutdown()
+        while self.preparing:  # (Releases the shared memory of the images being prepared.)
             try:
-                imageToSuperpose.thumbnail((int(float(imagex)*scaleValue),int(float(imagey)*scaleValue)),Image.LANCZOS)
-            except TypeError:  #TypeError: unsubscriptable object  ; Spurious exception in PIL.  :-(
-                raise BadImage
-            (imagex,imagey) = imageToSuperpose.size
-
-        # Compensate for poorly-contrasted images on the web
-        try:
-            imageToSuperpose = ImageOps.autocontrast(imageToSuperpose)
-        except TypeError:  # Aaron tells me that this exception occurs with PNG images.
-            raise BadImage
-
-        # Some image are too white.
-        # For example, the photo of a coin on a white background.
-        # These picture degrad the quality of the final image.
-        # We try to dectect them by summing the value of the pixels
-        # on the borders.
-        # If the image is considered "white", we invert it.
-        pixelcount = 1  # 1 to prevent divide by zero error.
-        valuecount = 0
-        try:
-            for x in range(0,imagex,20):
-                (r,g,b) = imageToSuperpose.getpixel((x,5))
-                valuecount += r+g+b
-                (r,g,b) = imageToSuperpose.getpixel((x,imagey-5))
-                valuecount += r+g+b
-                pixelcount += 2
-            for y in range(0,imagey,20):
-                (r,g,b) = imageToSuperpose.getpixel((5,y))
-                valuecount += r+g+b
-                (r,g,b) = imageToSuperpose.getpixel((imagex-5,y))
-                valuecount += r+g+b
-                pixelcount += 2
-        except TypeError:  #unsubscriptable object  Arrggghh... not again !
-            raise BadImage   # Aggrrreeeuuuu...
-
-        # If the average r+g+b of the border pixels exceed this value,
-        # we consider the image is too white, and we invert it.
-        if (100*(valuecount/(255*3))/pixelcount)>60:  # Cut at 60%.  (100% is RGB=(255,255,255))
-            imageToSuperpose = ImageOps.invert(imageToSuperpose)
-
-        paste_coords = (random.randint(-imagex,self.CONFIG["assembler.sizex"]),random.randint(-imagey,self.CONFIG["assembler.sizey"]) )
-
-        # Darken image borders
-        imageToSuperpose = self._darkenImageBorder(imageToSuperpose,borderSize=self.CONFIG["assembler.superpose.bordersmooth"])
+                self.preparing.popleft().result()
+            except Exception:
+                pass
+        self.preparer = None
 
+    def _preparationParameters(self, imageToSuperpose):
+        ''' Returns the parameters of prepareImage() for an image taken from the pool (including random ones.)
+            (They are recorded in the replay log, if any.)
+        '''
+        parameters = preparationParameters(self.CONFIG)
         if self.CONFIG["assembler.superpose.randomrotation"]:
-            imageToSuperpose = imageToSuperpose.rotate(random.randint(0,359), Image.BICUBIC)
-            # Darken the borders of the rotated image:
-            imageToSuperpose = self._darkenImageBorder(imageToSuperpose,borderSize=self.CONFIG["assembler.superpose.bordersmooth"])
-
-        mask_image = ImageOps.autocontrast(imageToSuperpose.convert('L'))
+            parameters['rotation'] = self.random.randint(0,359)
+        parameters['position'] = (self.random.random(),self.random.random())
+        # Invert the transparency of 5% of the images (in variante 1)
+        parameters['invertmask'] = (self.CONFIG["assembler.superpose.variante"]==1) and (self.random.randint(0,100)<5)
+        if self.replayLog:
+            self.replayLog.image(imageToSuperpose,parameters)
+        return parameters
+
+    def _pasteImages(self, images):
+        ''' Pastes prepared images (see utils.imageprep.prepareImage()) in the current image
+            (self.currentImage), then equalizes it (or autocontrasts it in variante 1) every
+            assembler.superpose.equalizeevery images (at most once per batch of images).
+            Intput:
+                images (list of tuples (image,mask,paste coordinates)) : the prepared images, their transparency masks and positions.
+            Output: the number of images pasted.
+        '''
+        if self.accumulator is not None:
+            return self._accumulateImages(images)
 
-        if (self.CONFIG["assembler.superpose.variante"]==1) and (random.randint(0,100)<5):  # Invert the transparency of 5% of the images (Except if we are in variante 1 mode)
-            mask_image = ImageOps.invert(mask_image)
-        try:
-            currentImage.paste(imageToSuperpose,paste_coords,mask_image)
-        except IOError:
-            # Sometimes, we get a IOError: "image file is truncated (0 bytes not processed)"
-            raise BadImage
+        # Darken slightly the current image (once for each image):
+        if self.CONFIG["assembler.superpose.variante"] == 1:
+            darken = self._brightnessLut(0.99)  # Old value (in beta 3): 0.985
+            for prepared in images:
+                self._addLut(darken)
+            # The first images of the batch would have been darkened by the next images:
+            images = self._darkenBatch(images,darken)
+        if self.histogram is None:
+            self._applyPendingLut()
+            self.histogram = self.currentImage.histogram()
+
+        placed = [(imageToSuperpose,paste_coords,mask_image) for (imageToSuperpose,mask_image,paste_coords) in images]
+
+        # The histogram of the current image is updated with the area covered by the pasted images only:
+        (sizex,sizey) = self.currentImage.size
+        box = (sizex,sizey,0,0)
+        for (imageToSuperpose,paste_coords,mask_image) in placed:
+            (imagex,imagey) = imageToSuperpose.size
+            box = (min(box[0],max(0,paste_coords[0])),min(box[1],max(0,paste_coords[1])),
+                   max(box[2],min(sizex,paste_coords[0]+imagex)),max(box[3],min(sizey,paste_coords[1]+imagey)))
+        covered = (box[0] < box[2]) and (box[1] < box[3])
+        if covered:
+            # The pending lookup tables are applied to the covered area only (the images are pasted on up-to-date pixels).
+            self._applyPendingLut(box)
+            before = self.currentImage.crop(box).histogram()
+        pasted = 0
+        for (imageToSuperpose,paste_coords,mask_image) in placed:
+            try:
+                self.currentImage.paste(imageToSuperpose,paste_coords,mask_image)
+                pasted += 1
+            except IOError:
+                # Sometimes, we get a IOError: "image file is truncated (0 bytes not processed)"
+                self._logInfo("Broken image ; Ignoring.")
+        if covered:
+            after = self.currentImage.crop(box).histogram()
+            self.histogram = [count-removed+added for (count,removed,added) in zip(self.histogram,before,after)]
+
+        self.imagesSinceContrast += pasted
+        if (self.CONFIG["assembler.superpose.equalizeevery"] > 0) and (self.imagesSinceContrast >= self.CONFIG["assembler.superpose.equalizeevery"]):
+            self._contrast()
+        return pasted
+
+    def _darkenBatch(self, images, lut):
+        ''' Applies a lookup table n-1 times to the first image of a batch, n-2 times to the second... (variante 1)
+            Output: the list of tuples (image,mask,paste coordinates)
+        '''
+        darkened = []
+        imagesLut = None
+        for (imageToSuperpose,mask_image,paste_coords) in reversed(images):
+            if imagesLut is not None:
+                imageToSuperpose = imageToSuperpose.point(imagesLut)
+            imagesLut = lut if imagesLut is None else composeLut(imagesLut,lut)
+            darkened.append((imageToSuperpose,mask_image,paste_coords))
+        darkened.reverse()
+        return darkened
+
+    def _accumulateImages(self, images):
+        ''' Pastes prepared images in the high-precision canvas (self.accumulator).
+            The image is equalized (or autocontrasted) only when all images are superposed (see _completeImage()).
+            Output: the number of images pasted.
+        '''
+        darken = 1.0
+        if self.CONFIG["assembler.superpose.variante"] == 1:
+            darken = 0.99
+            self.accumulator.darken(darken**len(images))  # (once for each image)
+        for (index,(imageToSuperpose,mask_image,paste_coords)) in enumerate(images):
+            # (The first images of the batch would have been darkened by the next images.)
+            self.accumulator.paste(imageToSuperpose,paste_coords,mask_image,darken**(len(images)-1-index))
+        return len(images)
+
+    def _completeImage(self):
+        ''' Brings self.currentImage up to date once all images are superposed. '''
+        if self.accumulator is not None:
+            # Tone-map the high-precision canvas:
+            if self.CONFIG["assembler.superpose.variante"] == 0:
+                self.currentImage = ImageOps.equalize(self.accumulator.toImage())
+            else:
+                self.currentImage = ImageOps.autocontrast(self.accumulator.toImage())
+            self.histogram = None
+            return
+        if self.imagesSinceContrast > 0:
+            self._contrast()
+        self._applyPendingLut()
+
+    def _contrast(self):
+        ''' Equalizes (or autocontrasts in variante 1) the current image.
+            The lookup table is computed from self.histogram (instead of reading the whole image),
+            and is applied later (see _applyPendingLut()).
+        '''
         if self.CONFIG["assembler.superpose.variante"] == 0:
-            currentImage = ImageOps.equalize(currentImage)
+            self._addLut(equalizeLut(self.histogram))
         else:
-            currentImage = ImageOps.autocontrast(currentImage)
+            self._addLut(autocontrastLut(self.histogram))
+        self.imagesSinceContrast = 0
 
-        return currentImage
+    def _addLut(self, lut):
+        ''' Adds a lookup table to apply to the current image.
+            Lookup tables are combined and applied later, only where needed (see _applyPendingLut()).
+        '''
+        if self.histogram is None:
+            self._applyPendingLut()
+            self.histogram = self.currentImage.histogram()
+        self.histogram = mapHistogram(self.histogram,lut)
+        self.pendingLuts = [composeLut(pendingLut,lut) for pendingLut in self.pendingLuts] + [lut]
+
+    def _applyPendingLut(self, box=None):
+        ''' Applies the pending lookup tables to the current image (see _addLut()), or to the part of the image in box.
+            The pixels of the areas already brought up to date (self.lutRegions) only get the tables added since.
+            (The whole image is updated once per generated image instead of once per pasted image.)
+        '''
+        if not self.pendingLuts:
+            return
+        if (box is not None) and (len(self.lutRegions) >= MAXIMUM_LUT_REGIONS):
+            box = None  # Too many areas to keep track of: update the whole image.
+        version = len(self.pendingLuts)
+        target = box or (0,0)+self.currentImage.size
+        # Keep the pixels of the areas brought up to date before the image (or box) is updated:
+        updated = []
+        for (region,regionVersion) in self.lutRegions:
+            clip = (max(region[0],target[0]),max(region[1],target[1]),min(region[2],target[2]),min(region[3],target[3]))
+            if (clip[0] < clip[2]) and (clip[1] < clip[3]):
+                updated.append((clip,self.currentImage.crop(clip),regionVersion))
+        if box is None:
+            self.currentImage = self.currentImage.point(self.pendingLuts[0])
+        else:
+            self.currentImage.paste(self.currentImage.crop(box).point(self.pendingLuts[0]),box)
+        # (Areas are in the order they were updated: the last area containing a pixel gives its version.)
+        for (clip,pixels,regionVersion) in updated:
+            if regionVersion < version:
+                pixels = pixels.point(self.pendingLuts[regionVersion])
+            self.currentImage.paste(pixels,clip)
+        if box is None:
+            (self.pendingLuts,self.lutRegions) = ([],[])
+        else:
+            # (Forget the areas inside box: box is more recent.)
+            self.lutRegions = [(region,regionVersion) for (region,regionVersion) in self.lutRegions
+                               if not (box[0] <= region[0] and box[1] <= region[1] and region[2] <= box[2] and region[3] <= box[3])]
+            self.lutRegions.append((box,version))
+
+    def _brightnessLut(self, factor):
+        ''' Returns the lookup table of ImageEnhance.Brightness(image).enhance(factor) for RGB images. '''
+        ramp = Image.frombytes('RGB',(256,1),bytes(value for value in range(256) for band in range(3)))
+        return list(ImageEnhance.Brightness(ramp).enhance(factor).tobytes()[0::3]) * 3
+
+    def _publishPreview(self):
+        ''' Publishes a preview of the image being generated (see getPreviewImage()).
+            The preview is assembler.superpose.previewreduce times smaller than the image,
+            so that it is cheap to post-process.
+        '''
+        reduce = max(1,self.CONFIG["assembler.superpose.previewreduce"])
+        if self.accumulator is not None:
+            image = self.accumulator.toImage()
+            if reduce > 1:
+                image = image.reduce(reduce)
+            # (The image is equalized (or autocontrasted) only when it is complete: do it on the preview.)
+            if self.CONFIG["assembler.superpose.variante"] == 0:
+                image = ImageOps.equalize(image)
+            else:
+                image = ImageOps.autocontrast(image)
+        else:
+            self._applyPendingLut()
+            image = self.currentImage.reduce(reduce) if reduce > 1 else self.currentImage
+        previewImage = self._postProcessImage(image,logo=False)
+        self.finalImageLock.acquire()
+        self.previewImage = previewImage
+        self.previewImageDate = time.time()
+        self.finalImageLock.release()
+        self.imagesSincePreview = 0
+        if self.previewWanted:
+            self.superposeCompleted.put("preview",True)
+        self._notifyListeners()
 
-    def _postProcessImage(self,image):
+    def _postProcessImage(self,image,logo=True):
         ''' Post-process the image before outputing it.
             This method must only be called by the thread !
             Input: a PIL Image object.
+                   logo (boolean) : if False, the webGobbler logo is not added (previews.)
             Output: a PIL Image object.
         '''
         finalimage = image.copy()
@@ -629,6 +988,8 @@ class assembler_superpose(threading.Thread):
             finalimage = ImageOps.invert(finalimage)
 
 
+        if not logo:
+            return finalimage
         (imagex,imagey) = finalimage.size
         # Superpose the webGobbler "logo" in the lower right corner
         (logox,logoy) = WEBGOBBLER_LOGO.size
@@ -646,6 +1007,31 @@ class assembler_superpose(threading.Thread):
               self.currentImage.save(savepath)
             except IOError as exc:
               raise IOError("Could not save current image to %s because: %s" % (savepath,exc))
+        if self.accumulator is not None:
+            savepath = os.path.join(self.CONFIG["persistencedirectory"],"assembler_superpose_current.npy")
+            try:
+              self.accumulator.save(savepath)
+            except IOError as exc:
+              raise IOError("Could not save current image to %s because: %s" % (savepath,exc))
+
+    def _loadAccumulator(self,ignorePreviousImage=False):
+        ''' Creates the high-precision canvas (self.accumulator) from the canvas saved by the previous run
+            (or from self.currentImage if the saved canvas is older than the saved image.)
+        '''
+        try:
+            from utils.accumulator import floatCanvas
+        except ImportError as exc:
+            raise ImportError("The numpy module is required for assembler.superpose.accumulator. See https://numpy.org/\nCould not import module because: %s" % exc)
+        savepath = os.path.join(self.CONFIG["persistencedirectory"],"assembler_superpose_current.npy")
+        try:
+            upToDate = os.path.getmtime(savepath) >= os.path.getmtime(os.path.join(self.CONFIG["persistencedirectory"],"assembler_superpose_current.bmp"))
+        except OSError:
+            upToDate = False
+        if upToDate and not ignorePreviousImage and not self.blankImage:
+            self.accumulator = floatCanvas.load(savepath,self.currentImage)
+            self._logDebug("Starting from previous high-precision image.")
+        else:
+            self.accumulator = floatCanvas(self.currentImage)
 
     def _loadPreviousImage(self,ignorePreviousImage=False):
         ''' Try to get persisted image (image from previous run of program)
@@ -692,84 +1078,256 @@ class assembler_superpose(threading.Thread):
             (You may get None is the superpose option has not completed.) '''
         self.inputCommandQueue.put(commandToken(superpose=self.CONFIG["assembler.superpose.nbimages"]),True)
 
-    def superposeB(self):
+    def superposeB(self,previewListener=None):
         ''' Order the thread to superpose n images, and wait for completion. This call is blocking.
-            After the end of this call, you can call getImage() and you will always get an image..'''
-        if not self.isAlive(): return
+            After the end of this call, you can call getImage() and you will always get an image..
+            previewListener (function) : if provided, previewListener(image) is called (in the calling thread)
+                with each preview published while the image is generated (see getPreviewImage(fullSize=True).)
+        '''
+        try:  # Forget completions of previous superpose() calls.
+            while True:
+                self.superposeCompleted.get_nowait()
+        except queue.Empty:
+            pass
+        if not self.is_alive(): return
+        self.previewWanted = previewListener is not None
         # Ask the thread to superpose images.
         self.inputCommandQueue.put(commandToken(superpose=self.CONFIG["assembler.superpose.nbimages"]),True)
-        # Then wait for completion:
-        while True:  # We loop until .get(block=True) does not raise Queue.Empty exception.
-            try:
-                self.superposeCompleted.get(block=True,timeout=1)
-                return
-            except queue.Empty:
-                if not self.isAlive(): return  # Do not wait for an answer if thread is dead !
-                time.sleep(0.25)
+        # Then wait for completion (the thread also signals when it dies.)
+        try:
+            while self.superposeCompleted.get(block=True) == "preview":
+                previewListener(self.getPreviewImage(fullSize=True))
+        finally:
+            self.previewWanted = False
 
-    def getImage(self):
+    def addStateListener(self,listener):
+        ''' Registers a function which will be called (without parameters, from the assembler thread)
+            each time self.state changes, a new image is generated (see finalImageCompletionDate),
+            a preview is published (see previewImageDate) or the thread stops (state "Stopped").
+            The function must return quickly (eg. put a message in a queue).
+        '''
+        self.stateListeners.append(listener)
+
+    def getPreviewImage(self,fullSize=False):
+        ''' Returns a preview of the image being generated, published every assembler.superpose.previewevery
+            superposed images (or the last generated image if there is no newer preview.)
+            This call is non-blocking.
+            Previews are assembler.superpose.previewreduce times smaller than the generated images,
+            unless fullSize is True (they are then resized to the size of the generated images.)
+            Returns a PIL Image object, or None if no image is available.
+            (Compare self.previewImageDate with self.finalImageCompletionDate to know if the image is a preview.)
+        '''
+        self.finalImageLock.acquire()
+        try:
+            if (self.previewImage is None) or (self.previewImageDate is None) or (self.finalImageCompletionDate is None) \
+               or (self.previewImageDate < self.finalImageCompletionDate):
+                return self.getImage()
+            previewImage = self.previewImage
+        finally:
+            self.finalImageLock.release()
+        if fullSize and previewImage.size != (self.CONFIG["assembler.sizex"],self.CONFIG["assembler.sizey"]):
+            return previewImage.resize((self.CONFIG["assembler.sizex"],self.CONFIG["assembler.sizey"]),Image.BILINEAR)
+        return previewImage.copy()
+
+    def getImage(self,size=None):
         ''' Returns an image from the assembler (if available).
             This call is non-blocking.
             Returns a PIL Image object, or None if no image is available.
+            size (tuple) : (width,height) of the image to return (default: the size of the generated image.)
+                The image is resized from the generated image, or from a larger size of
+                assembler.outputsizes, and kept until the next image is generated.
 
             If you call getImage() after superposeB(), you are guaranteed to have an image.
         '''
         finalImage = None
         self.finalImageLock.acquire()
         if self.finalImage != None:
-            finalImage = self.finalImage.copy()
+            if size is None:
+                finalImage = self.finalImage.copy()
+            else:
+                finalImage = self._resizedFinalImage(tuple(size)).copy()
         self.finalImageLock.release()
         return finalImage
 
+    def getImageBuffer(self,rawmode='RGBX',stride=0):
+        ''' Returns the pixels of the last generated image in the layout of a display, so that
+            they can be copied as is in a frame buffer (eg. an X11 XImage.)
+            This call is non-blocking.
+            Input: rawmode (string) : PIL raw mode of the pixels (eg. 'BGRX' for most X11 screens)
+                   stride (integer) : number of bytes of each line of pixels (0 = no padding)
+            Output: a bytes object, or None if no image is available.
+            The buffer is computed once for each generated image (and layout): this is cheaper than
+            getImage() when the image is displayed by several outputs.
+        '''
+        self.finalImageLock.acquire()
+        try:
+            if self.finalImage is None:
+                return None
+            if self.imageBuffersDate != self.finalImageCompletionDate:  # A new image was generated.
+                self.imageBuffers = {}
+                self.imageBuffersDate = self.finalImageCompletionDate
+            if (rawmode,stride) not in self.imageBuffers:
+                self.imageBuffers[(rawmode,stride)] = self.finalImage.tobytes('raw',rawmode,stride)
+            return self.imageBuffers[(rawmode,stride)]
+        finally:
+            self.finalImageLock.release()
+
+    def _resizedFinalImage(self,size):
+        ''' Returns self.finalImage resized (resize pyramid: the image is resized from the smallest
+            image already computed which is larger.)
+            This method must be called with self.finalImageLock acquired.
+        '''
+        if self.resizedImagesDate != self.finalImageCompletionDate:  # A new image was generated.
+            self.resizedImages = {}
+            self.resizedImagesDate = self.finalImageCompletionDate
+        if size == self.finalImage.size:
+            return self.finalImage
+        if size not in self.resizedImages:
+            # First compute the larger sizes which will be asked for:
+            for larger in sorted(parseImageSizes(self.CONFIG["assembler.outputsizes"]),key=lambda s: s[0]*s[1],reverse=True):
+                if (larger != size) and (larger[0] >= size[0]) and (larger[1] >= size[1]) and (larger[0]*larger[1] < self.finalImage.size[0]*self.finalImage.size[1]):
+                    self._resizedFinalImage(larger)
+            images = [self.finalImage]+[image for image in self.resizedImages.values() if (image.size[0] >= size[0]) and (image.size[1] >= size[1])]
+            source = min(images,key=lambda image: image.size[0]*image.size[1])
+            self.resizedImages[size] = source.resize(size,Image.LANCZOS)
+        return self.resizedImages[size]
+
     def shutdown(self):
         ''' Order the thread to shutdown and die. '''
         self.inputCommandQueue.put(commandToken(shutdown=1),True)
 
     def saveImageTo(self,destinationFilename):
         ''' Save last generated image to a file. '''
-        if not self.isAlive(): return
+        if not self.is_alive(): return
         self._logInfo("Saving image to %s" % destinationFilename )
         # Saving image to persistence directory
         self.getImage().save(destinationFilename)  # Save generated image to disk.
         self._logInfo("Done.")
 
-    def _darkenImageBorder(self,image,borderSize=30):
+class replayPool:
+    ''' Gives the images recorded in a replay log (see utils.replay), in the order of the log,
+        read from a copy of the image pool directory (files are found by name, or by SHA1).
+        It is used instead of an imagePool by assembler_replay (no collector is started,
+        no file is deleted.)
+    '''
+    def __init__(self,directory,config):
+        ''' directory (string) : the image pool directory (or a copy of it)
+            config (applicationConfig object) : the program configuration
         '''
-        Uses a gradient to darken the 4 borders of an image.
+        self.directory = directory
+        self.CONFIG = config
+        self.images = collections.deque()   # Images not given yet (PIL Image objects)
+        self.filenames = {}                 # Files of the directory (key=SHA1 of the content, value=filename) (computed when a file is not found by its name)
 
-        Input:
-            image (PIL Image object): the image to process
-              WARNING: the image object is not preserved.
-              (You can pass yourImage.copy() to prevent this.)
-            size (int) : size of the gradient (in pixels)
-        Output:
-            a PIL Image object: the image with darkened borders.
+    def start(self): pass
+    def shutdown(self): pass
+    def join(self): pass
+    def addImageListener(self,listener): pass
+
+    def getPoolSize(self):
+        return len(self.images)
+
+    def addRecords(self,records):
+        ''' Reads and decodes the images of records of a replay log, to give them in this order.
+            image.info['webgobbler.replay'] is the record of each image.
+            Raises IOError if an image cannot be found (or decoded.)
         '''
-        if borderSize <= 0:
-            return image
-
-        # Step 1 : create an image and a mask of the right width
-        horImage = Image.new('RGB', (image.size[0],borderSize))
-        horMask = Image.new('L',horImage.size)
-        verImage = Image.new('RGB', (borderSize,image.size[1]))
-        verMask = Image.new('L',verImage.size)
-
-        # Step 2 : Draw a gray gradient in the mask:
-        drawH = ImageDraw.Draw(horMask)
-        drawV = ImageDraw.Draw(verMask)
-        for i in range(borderSize):
-            drawH.line( (0, i, horMask.size[0], i) ,fill=256-(256*i//borderSize))
-            drawV.line( (i,0, i, verMask.size[1]) ,fill=256-(256*i//borderSize))
-        del drawH
-        del drawV
-
-        # Step 3 : Paste the black image with the gradient mask on the original image:
-        image.paste(horImage,(0,0),horMask)  # Paste at image top.
-        image.paste(horImage,(0,image.size[1]-borderSize),ImageOps.flip(horMask))  # Paste at image bottom
-        image.paste(verImage,(0,0),verMask)  # Paste at image top.
-        image.paste(verImage,(image.size[0]-borderSize,0),ImageOps.mirror(verMask))  # Paste at image bottom
+        for record in records:
+            imageparser = ImageFile.Parser()
+            imageparser.feed(self._read(self._find(record)))
+            image = imageparser.close()
+            image.load()
+            image.info['webgobbler.replay'] = record
+            self.images.append(image)
+
+    def _read(self,filename):
+        ''' Reads a file like imagePool does (at most collector.maximumimagesize bytes). '''
+        with open(filename,'rb') as file:
+            return file.read(self.CONFIG["collector.maximumimagesize"])
+
+    def _find(self,record):
+        ''' Returns the path of the file of an image record. '''
+        if record['file']:
+            filename = os.path.join(self.directory,record['file'])
+            try:
+                if hashlib.sha1(self._read(filename)).hexdigest() == record['sha1']:
+                    return filename
+            except IOError:
+                pass
+        if not self.filenames:  # The file was renamed or modified: look for its content.
+            for localfilename in os.listdir(self.directory):
+                filename = os.path.join(self.directory,localfilename)
+                if os.path.isfile(filename):
+                    self.filenames[hashlib.sha1(self._read(filename)).hexdigest()] = filename
+        if record['sha1'] not in self.filenames:
+            raise IOError("Image %s (SHA1 %s) not found in %s" % (record['file'],record['sha1'],self.directory))
+        return self.filenames[record['sha1']]
 
-        return image
+    def getImage(self):
+        ''' Returns the next image (None if all images were given: the pool never gets
+            more images by itself, see assembler_replay._superpose().) '''
+        if not self.images:
+            return None
+        return self.images.popleft()
+
+    def getImageB(self):
+        return self.getImage()
+
+class assembler_replay(assembler_superpose):
+    ''' An assembler_superpose which takes the images and the random decisions from a replay log
+        instead of the pool and the random generator (see replay()).
+        pool must be a replayPool object.
+        If the log has not enough images for an image, the image is completed with the images
+        superposed so far and self.renderFailed is set (see replay()).
+    '''
+    def __init__(self,pool,config,ignorePreviousImage=False):
+        assembler_superpose.__init__(self,pool,config,ignorePreviousImage)
+        self.renderFailed = False    # True if the replay log had not enough images for the last image.
+
+    def _getImageFromPool(self):
+        imageToSuperpose = assembler_superpose._getImageFromPool(self)
+        self.waitingForImage = False  # (Never wait for the pool: it will not get more images.)
+        return imageToSuperpose
+
+    def _superpose(self):
+        ''' Superposes the next images of the log. If the log has no more images (the pool is
+            empty and no image is being prepared), the image is completed as it is:
+            superposeB() would wait forever for the missing images.
+        '''
+        if self.pool.getPoolSize() or self.preparing:
+            assembler_superpose._superpose(self)
+            return
+        self._logError("The replay log has not enough images for this image (%d missing)." % self.nbImagesToSuperpose)
+        self.renderFailed = True
+        self.nbImagesToSuperpose = 0
+
+    def _preparationParameters(self, imageToSuperpose):
+        record = imageToSuperpose.info['webgobbler.replay']
+        parameters = preparationParameters(self.CONFIG)
+        parameters['rotation'] = record['rotation']
+        parameters['position'] = tuple(record['position'])
+        parameters['invertmask'] = record['invertmask']
+        return parameters
+
+def parseImageSizes(text):
+    ''' Parses a list of image sizes (eg. "320x240,160x120", see assembler.outputsizes).
+        Output: a list of tuples (width,height) (invalid sizes are ignored.)
+    '''
+    sizes = []
+    for item in text.replace(' ',',').split(','):
+        try:
+            (x,y) = item.lower().split('x')
+            size = (int(x),int(y))
+        except ValueError:
+            continue
+        if (size[0] > 0) and (size[1] > 0):
+            sizes.append(size)
+    return sizes
+
+def sizedFilename(filename,size):
+    ''' Returns the name of the file of another size of an image (eg. "image.png" --> "image-320x240.png"). '''
+    (base,extension) = os.path.splitext(filename)
+    return "%s-%dx%d%s" % (base,size[0],size[1],extension)
 
 def get_unix_lib(lib_name):
     '''Find an Unix / Linux shared library path to use it with ctypes'''
@@ -959,6 +1517,8 @@ def image_saver(config, imageName='webgobbler.bmp',generateSingleImage=False):
             log.info("Generating a new image to %s" % imageName)
             a.superposeB()  # Evolve current image
             a.saveImageTo(imageName)
+            for size in parseImageSizes(config["assembler.outputsizes"]):  # Other sizes of the image
+                a.getImage(size).save(sizedFilename(imageName,size))
             if generateSingleImage: break;
             log.info("Will generate a new image in %d seconds." % config["program.every"])
             time.sleep(config["program.every"])
@@ -966,6 +1526,79 @@ def image_saver(config, imageName='webgobbler.bmp',generateSingleImage=False):
         a.shutdown()
         a.join()
 
+def replay(logFilename, config):
+    ''' Generates again the images recorded in a replay log (assembler.superpose.replaylog),
+        with the images of the pool directory (pool.imagepooldirectory: a copy of the pool directory
+        made when the images were generated, or the pool itself if pool.keepimages was set.)
+        Each image is saved next to the log (eg. render.log --> render-1.bmp, render-2.bmp...)
+        and compared with the recorded image.
+        The assembler settings are taken from the log, except assembler.superpose.workers
+        (which does not change the images), so that the same images can be generated with
+        another number of worker processes.
+        When settings only read at startup (REPLAY_RESTART_KEYS: image size, accumulator) change
+        in the log, the assembler is restarted and starts from the image saved by the previous one
+        (like the program did.) A warning is logged for each image which does not start from
+        the recorded image (and high-precision canvas): it will be different.
+        config (an applicationConfig object) : the program configuration
+        Output: True if all images are identical to the recorded images.
+    '''
+    log = logging.getLogger('replay')
+    renders = [render for render in readReplayLog(logFilename) if render['sha1'] is not None]  # (Incomplete renders cannot be replayed.)
+    if not renders:
+        log.error("No image to replay in %s" % logFilename)
+        return False
+    replayConfig = applicationConfig()
+    replayConfig.update(config)
+    replayConfig.update(renders[0]['config'])
+    replayConfig["assembler.superpose.replaylog"] = ""
+    pool = replayPool(config["pool.imagepooldirectory"],replayConfig)
+    identical = True
+    with tempfile.TemporaryDirectory() as persistenceDirectory:
+        replayConfig["persistencedirectory"] = persistenceDirectory  # (Do not overwrite the current image of the program.)
+        a = assembler_replay(pool=pool,config=replayConfig,ignorePreviousImage=True)
+        a.start()
+        try:
+            for (number,render) in enumerate(renders,1):
+                restart = [key for key in REPLAY_RESTART_KEYS if render['config'].get(key,replayConfig[key]) != replayConfig[key]]
+                replayConfig.update(render['config'])
+                for key in REPLAY_IGNORED_KEYS:
+                    replayConfig[key] = config[key]
+                replayConfig["assembler.superpose.replaylog"] = ""
+                if restart:
+                    log.info("Image %d was generated with other %s settings: restarting the assembler." % (number,", ".join(restart)))
+                    a.shutdown()
+                    a.join()
+                    a = assembler_replay(pool=pool,config=replayConfig)  # (Starts from the image saved by the previous assembler.)
+                    a.start()
+                pool.addRecords(render['images'])  # (Images are read and decoded before the image is timed.)
+                accumulator = a.accumulator.digest() if a.accumulator is not None else None
+                if render['start'] == 'blank':
+                    a.blankImage = True
+                elif (number == 1) or (imageSha1(a.currentImage) != render['start']) \
+                     or (render.get('accumulator',accumulator) != accumulator):
+                    log.warning("Image %d was not generated from the previous image of the log: it will be different." % number)
+                    a.blankImage = True
+                a.renderFailed = False
+                startTime = time.time()
+                a.superposeB()
+                elapsed = time.time()-startTime
+                if not a.is_alive():
+                    return False
+                if a.renderFailed:
+                    log.error("Image %d could not be generated: the log has not enough images for it." % number)
+                    identical = False
+                    continue
+                same = (imageSha1(a.currentImage) == render['sha1'])
+                identical = identical and same
+                filename = "%s-%d.bmp" % (os.path.splitext(logFilename)[0],number)
+                a.saveImageTo(filename)
+                log.info("Image %d (%s) generated in %.2f seconds: %s" % (number,filename,elapsed,
+                         "identical to the recorded image." if same else "DIFFERENT from the recorded image."))
+        finally:
+            a.shutdown()
+            a.join()
+    return identical
+
 def windowsScreensaver(startmode,config):
     ''' Start as Windows Screensaver
         startmode (string): Start option
@@ -1077,6 +1710,8 @@ def htmlPageGenerator(htmlFilename,config):
                config (an applicationConfig object) : the program configuration
         The name of the JPEG file will always be webgobbler.jpg
         (progressive JPEG file).
+        The sizes of assembler.outputsizes are saved as webgobbler-<width>x<height>.jpg,
+        and proposed to the browser (srcset) for smaller screens.
     '''
     log = logging.getLogger('htmlPageGenerator')
     a = assembler_superpose(pool=imagePool(config=config),config=config)
@@ -1096,7 +1731,11 @@ def htmlPageGenerator(htmlFilename,config):
             else:
                 imagepath = 'webgobbler.jpg'
             i.save(imagepath,option={'progression':True,'quality':70,'optimize':True})
-            file = open(htmlFilename,'w+b')  # Overwrite any existing html page with this name.
+            srcset = ["webgobbler.jpg %dw" % i.size[0]]
+            for size in parseImageSizes(config["assembler.outputsizes"]):
+                a.getImage(size).save(sizedFilename(imagepath,size),option={'progression':True,'quality':70,'optimize':True})
+                srcset.append("%s %dw" % (sizedFilename('webgobbler.jpg',size),size[0]))
+            file = open(htmlFilename,'w')  # Overwrite any existing html page with this name.
             file.write('''<html>
   <head>
     <meta http-equiv="refresh" content="%d; url=%s">
@@ -1104,10 +1743,12 @@ def htmlPageGenerator(htmlFilename,config):
     <!-- This page was automatically generated by webGobbler on %s-->
   </head>
   <body bgcolor="#000000" style="margin: 0px;">
-    <img src="webgobbler.jpg" width="%d" height="%d" alt="webGobbler generated image">
+    <img src="webgobbler.jpg" srcset="%s" sizes="(max-width: %dpx) 100vw, %dpx" width="%d" height="%d"
+         style="width: 100%%; max-width: %dpx; height: auto;" alt="webGobbler generated image">
   </body>
 </html>
-''' % (config["program.every"],htmlfilename,time.asctime(time.localtime()),i.size[0],i.size[1]))
+''' % (config["program.every"],htmlfilename,time.asctime(time.localtime()),", ".join(srcset),
+       i.size[0],i.size[0],i.size[0],i.size[1],i.size[0]))
             file.close()
             log.info("Will generate a new image and HTML page in %d seconds." % config["program.every"])
             time.sleep(config["program.every"])
@@ -1233,7 +1874,8 @@ def main():
                                                     'bordersmooth=', 'tognomewallpaper','tokdewallpaper',
                                                     'towindowswallpaper','norotation','resuperpose','guiconfig',
                                                     'saveconfreg','loadconfreg','saveconffile','loadconffile',
-                                                    'xscreensaver','scale=','keywords='])
+                                                    'xscreensaver','scale=','keywords=','seed=','replaylog=',
+                                                    'replay='])
     except getopt.GetoptError as ex:
         print(("Error in command-line: %s" % ex))
         #usage(sys.argv[0])  # print help information and exit:
@@ -1281,6 +1923,10 @@ def main():
             CONFIG["assembler.superpose.scale"] = float(arg)    # FIXME: try/except conversion to float
         elif opt == '--norotation':
             CONFIG["assembler.superpose.randomrotation"] = False
+        elif opt == '--seed':
+            CONFIG["program.seed"] = int(arg)   # FIXME: try/except conversion to int
+        elif opt == '--replaylog':
+            CONFIG["assembler.superpose.replaylog"] = str(arg)
         elif opt == '--proxy':
             proxyaddress, proxyport = str(arg).split(":")
             CONFIG["network.http.proxy.address"] = proxyaddress
@@ -1314,6 +1960,9 @@ def main():
         elif opt in ('--tohtml'):  # Generate a HTML page and JPEG image continuously
             p_action = opt
             p_action_parameter = arg
+        elif opt in ('--replay'):  # Generate again the images of a replay log and exit.
+            p_action = opt
+            p_action_parameter = arg
         elif opt == '--guiconfig':   # Display configuration screen
             p_action = opt
         elif opt == '--saveconffile':  # Save configuration to file
@@ -1408,6 +2057,9 @@ def main():
     elif p_action == "--xscreensaver":
         log.info("Starting X11 Window Screensaver...")
         x11Screensaver(config=CONFIG)
+    elif p_action == "--replay":
+        log.info("Replaying %s..." % p_action_parameter)
+        replay(p_action_parameter,config=CONFIG)
     elif p_action == "--saveconfreg":
         CONFIG.saveToRegistryCurrentUser()
         log.info("Configuration saved to Windows registry.")
@@ -7,6 +7,8 @@ except ImportError as exc:
 
 import sys,os,os.path
 
+import queue
+import threading
 import time
 import tkinter
 import tkinter.filedialog
@@ -63,22 +65,111 @@ class wg_application:
         self._parent = parent
         self.imageLabel = None          # The widget which displays the image.
         self.config = config            # The main webGobbler configuration
+        self.notifications = queue.Queue()  # Notifications from the collectors and the assembler threads (see _notify())
+        self.notifyPending = False      # True if a <<webGobblerNotify>> event was sent and not processed yet.
+        self.notifyLock = threading.Lock()  # Lock for self.notifyPending
+        self.poolIndex = None           # The pool index watched for the pool size (see _watchAssembler())
+        self._parent.bind("<<webGobblerNotify>>", self._processNotifications)
         self.assembler = webgobbler.assembler_superpose(pool=webgobbler.imagePool(config=config),config=config) # The assembler (which creates images)
+        self._watchAssembler()
         self.assembler.start()  # Start the assembler. (The assembler and collectors will work in background.)
         self._parent.protocol("WM_DELETE_WINDOW", self.handlerExit)  # Catch the "close window" event sent by the window manager.
         self.lastImageDate = None       # Date when last image was generated.
+        self.lastPreviewDate = None     # Date when the last displayed preview was published (see assembler_superpose.getPreviewImage())
         self.lastImage = None           # Last generated image (PIL Image object.)
         self.closing = False            # If True, the application is currently closing (probably waiting for network connections to close.)
         self.currentlyAssembling = False # Is the assemble currently assembling ?
+        self.timerSuperpose = None      # Timer which will superpose the next image (see _scheduleSuperpose())
         self._widgets= {}               # List of stateful widgets
 
 
         self._initializeGUI()  # Create the GUI
         self.setStatus("webGobbler running.")
-        self.timerCollectorsStatus = self._parent.after(250, self._updateCollectorStatus)
-
-        self._updateImage()   # Regularly update the image from the assembler.
+        self._updateCollectorStatus()
+        self._updateImage()
         self.handlerGenerateNow()  # Generate a new image right now.
+        # (Notifications received before the main loop started:)
+        self._parent.after_idle(self._processNotifications)
+
+    def _watchAssembler(self):
+        ''' Registers the notification listeners on the assembler, its collectors and its pool. '''
+        assembler = self.assembler
+        assembler.addStateListener(lambda: self._notify('assembler',assembler))
+        for collector in assembler.pool.collectors:
+            collector.addStatusListener(lambda collector: self._notify('collector',collector))
+        if self.poolIndex is not None:
+            self.poolIndex.removeListener(self._poolChanged)
+        self.poolIndex = assembler.pool.index
+        self.poolIndex.addListener(self._poolChanged)
+
+    def _poolChanged(self):
+        self._notify('pool',None)
+
+    def _notify(self,kind,source):
+        ''' Posts a notification to the GUI. This method can be called from any thread.
+            kind (string) : 'assembler' (source is the assembler), 'collector' (source is the collector)
+                            or 'pool' (images were added to the pool.)
+            The notifications are processed by the Tkinter main loop (see _processNotifications()):
+            a single <<webGobblerNotify>> event is sent for all the notifications received in the meantime.
+            (This method must not touch the widgets: only the main loop does.)
+        '''
+        self.notifications.put((kind,source))
+        with self.notifyLock:
+            if self.notifyPending:
+                return
+            self.notifyPending = True
+        try:
+            self._parent.event_generate("<<webGobblerNotify>>", when="tail")
+        except (RuntimeError, tkinter.TclError):
+            # The main loop is not running (not started yet, or the window was destroyed).
+            # (Notifications received before the main loop started are processed when it starts.)
+            with self.notifyLock:
+                self.notifyPending = False
+
+    def _processNotifications(self,event=None):
+        ''' Updates the widgets from the notifications received (called by the Tkinter main loop).
+            (The widgets are only updated when something has changed.)
+        '''
+        with self.notifyLock:
+            self.notifyPending = False
+        collectors = {}         # Collectors whose status changed
+        assemblerChanged = False
+        poolChanged = False
+        try:
+            while True:
+                (kind,source) = self.notifications.get_nowait()
+                if kind == 'collector':
+                    if source in self.assembler.pool.collectors:  # (Ignore collectors of old assemblers.)
+                        collectors[source.name] = source
+                elif kind == 'assembler':
+                    if source is self.assembler:  # (Ignore old assemblers still shutting down.)
+                        assemblerChanged = True
+                else:
+                    poolChanged = True
+        except queue.Empty:
+            pass
+        for collector in collectors.values():
+            (status,information) = collector.getCurrentStatus()   # .getCurrentStatus() is thread safe.
+            self._setCollectorStatus(collector.name,status,information)
+        if assemblerChanged:
+            self._updateImage()
+        if assemblerChanged or poolChanged or collectors:
+            self._updatePoolSize()
+
+        # If the application is closing and the assembler tells us it has stopped, we can destroy the window.
+        if assemblerChanged and self.closing and self.assembler.state == "Stopped":
+            self._destroyWhenStopped()
+
+    def _destroyWhenStopped(self):
+        ''' Destroys the window once the assembler thread (which has sent its "Stopped" notification) has ended.
+            (The assembler thread is not joined: it would block the main loop.)
+        '''
+        if self.assembler.is_alive():
+            # The thread is returning from run() right after the notification: check again shortly.
+            self._parent.after(50, self._destroyWhenStopped)
+            return
+        self.poolIndex.removeListener(self._poolChanged)
+        self._parent.destroy()
 
     def _setCollectorStatus(self,collectorName,status,information):
         ''' Sets the collector status and info.
@@ -97,11 +188,9 @@ class wg_application:
             widgets[1].configure(text=information)
 
     def _updateCollectorStatus(self):
-        ''' Update the collectors status on screen.
-            This method is called every 0.5 seconds.
+        ''' Update the status of all collectors on screen.
+            (Then the status of each collector is updated when it changes: see _processNotifications())
         '''
-        # We poll each collector status every second.
-
         # The known collectors:
         visitedCollectors = {collector.name:False for collector in ALL_COLLECTORS}
 
@@ -121,26 +210,31 @@ class wg_application:
             if not visited:
                 self._setCollectorStatus(collectorName,'Off','')
 
+        self._updatePoolSize()
+
+    def _updatePoolSize(self):
         self.poolSize.configure(text = "%d on %d" % ( self.assembler.pool.getPoolSize(),self.config['pool.nbimages']))
 
-        # Superpose a new image if delay is elapsed:
-        if time.time() > (self.lastImageDate + self.config["program.every"]) and not self.currentlyAssembling:
-            self._superpose()
-        # Update also the state of the assembler:
+    def _updateAssemblerState(self):
+        ''' Displays the state of the assembler (and when the next image will be generated.) '''
         assemblerText = self.assembler.state
-        if not self.currentlyAssembling and not self.closing:
-             assemblerText += "  (Next image in %d seconds)" % (int(self.lastImageDate + self.config["program.every"]- time.time()+1) )
+        if not self.currentlyAssembling and not self.closing and self.lastImageDate is not None:
+             assemblerText += "  (Next image at %s)" % time.strftime("%H:%M:%S",time.localtime(self.lastImageDate + self.config["program.every"]))
         self.assemblerState.configure(text=assemblerText)
 
-        self.timerCollectorsStatus = self._parent.after(250, self._updateCollectorStatus)  # 0.25 seconds
+    def _scheduleSuperpose(self):
+        ''' Arms the timer which will superpose the next image program.every seconds after the last one. '''
+        if self.timerSuperpose is not None:
+            self._parent.after_cancel(self.timerSuperpose)
+        delay = max(0,self.lastImageDate + self.config["program.every"] - time.time())
+        self.timerSuperpose = self._parent.after(int(delay*1000), self._superpose)
 
     def _updateImage(self):
         ''' Update the image in window from the assembler.
-            This method will be automatically call every second by the Tkinter main loop timer.
+            This method is called by the Tkinter main loop when the assembler tells us
+            its state has changed (see _processNotifications()).
         '''
-        # We pool the assembler every second to see if it has generated a new
-        # image.
-        # If it has, we try to get the image and display it.
+        # If the assembler has generated a new image, we get the image and display it.
         if self.lastImageDate != self.assembler.finalImageCompletionDate and not self.closing:
             # Get the new image:
             image = self.assembler.getImage()
@@ -153,6 +247,7 @@ class wg_application:
                 self.lastImageDate = self.assembler.finalImageCompletionDate
                 self._setWallpaper()
                 self.currentlyAssembling = False
+                self._scheduleSuperpose()
                 self._widgets['updateimage.button'].configure(state='normal')  # Enable the "Update image" button
 
                 # If the "Auto-save" checkbox is checked, save the image.
@@ -161,13 +256,16 @@ class wg_application:
                    self.setStatus("Saving image as %s..." % filename)
                    self.lastImage.save(filename)
                 self.setStatus("webGobbler running.")
+        elif self.currentlyAssembling and self.lastPreviewDate != self.assembler.previewImageDate and not self.closing:
+            # Display the preview of the image being generated:
+            self.lastPreviewDate = self.assembler.previewImageDate
+            image = self.assembler.getPreviewImage(fullSize=True)
+            if image != None:
+                photo = ImageTk.PhotoImage(image)
+                self.imageLabel.configure(image=photo)
+                self.imageLabel.photo = photo
 
-        # If the application is closing and the assembler has died, we can destroy the window.
-        if self.closing and not self.assembler.is_alive():
-            self.assembler.join()
-            self._parent.destroy()
-
-        self.timerUpdateimage = self._parent.after(1000, self._updateImage)  # Re-arm the timer.
+        self._updateAssemblerState()
 
     # FIXME: display errors ?  (network errors, etc. ?)
     # FIXME: redirect webGobbler stdout/stderr to a text widget ?
@@ -185,14 +283,16 @@ class wg_application:
 
     def _superpose(self):
         ''' Ask the assembler to superpose new images regularly.
-            This method will be automatically call by the Tkinter main loop timer.
+            This method will be automatically call by the Tkinter main loop timer (see _scheduleSuperpose()).
         '''
+        self.timerSuperpose = None
         if self.closing: return
         if self.currentlyAssembling: return
         self.currentlyAssembling = True
         self._widgets['updateimage.button'].configure(state='disabled')  # Disable the "Update image" button
         self.setStatus('Updating current image (%d x %d).' % (self.config['assembler.sizex'],self.config['assembler.sizey']))
         self.assembler.superpose()  # (This is a non-blocking call.)
+        self._updateAssemblerState()
 
     def loadConfig(self,appConfig=None):
         ''' Read webGobbler configuration from registry or .INI file.
@@ -359,6 +459,10 @@ class wg_application:
             self.setStatus("Finishing current downloads - Please wait...")
         self.assembler.shutdown()
         self.closing = True
+        self._updateAssemblerState()
+        if self.assembler.state == "Stopped":  # (The assembler had already stopped: no notification will come.)
+            self._destroyWhenStopped()
+        # (Otherwise the window is destroyed when the assembler tells us it has stopped, see _processNotifications().)
 
     def handlerAbout(self):
         import webgobbler_config
@@ -386,7 +490,10 @@ class wg_application:
 
             # Start a new assembler with this new configuration:
             self.assembler = webgobbler.assembler_superpose(pool=webgobbler.imagePool(config=self.config),config=self.config)
+            self._watchAssembler()
             self.assembler.start()
+            self._updateCollectorStatus()
+            self._updateImage()
 
     def handlerGenerateNow(self):
         if self.currentlyAssembling: return
@@ -394,6 +501,7 @@ class wg_application:
         self._widgets['updateimage.button'].configure(state='disabled') # Disable the "Update image" button
         self.setStatus('Updating current image (%d x %d).' % (self.config['assembler.sizex'],self.config['assembler.sizey']))
         self.assembler.superpose()  # (This is a non-blocking call.)
+        self._updateAssemblerState()
 
     def handlerSaveAs(self):
         # Praise tkFileDialog !   This couldn't be easier.   :-)
@@ -422,7 +530,10 @@ class wg_application:
             #self.assembler.join()
             # Start a new assembler with this new configuration:
             self.assembler = webgobbler.assembler_superpose(pool=webgobbler.imagePool(config=self.config),config=self.config,ignorePreviousImage=True)
+            self._watchAssembler()
             self.assembler.start()
+            self._updateCollectorStatus()
+            self._updateImage()
             self.handlerGenerateNow()  # Generate a new image right now.
 
 
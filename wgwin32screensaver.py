@@ -231,7 +231,10 @@ def generateNewImage(assembler_sup,config,wsaver):
     log = logging.getLogger('windowsScreensaver')    
     log.info("Generating a new image now with %d new images" % config["assembler.superpose.nbimages"])
     log.info("windowsScreensaver: (Next image in %d seconds.)" % config["program.every"])
-    assembler_sup.superposeB()   # Generate new image
+    previewListener = None
+    if config["assembler.superpose.previewevery"] > 0:  # Display the previews of the image being generated.
+        previewListener = lambda preview: wsaver.setImage(ImageWin.Dib(preview))
+    assembler_sup.superposeB(previewListener)   # Generate new image
     image = assembler_sup.getImage()
     if image != None:
         wsaver.setImage(ImageWin.Dib(image))  # Display the image.
@@ -270,7 +273,7 @@ def messageLoop(assembler_sup, config):
     generateImageThread.start()
     start_time = time.time()
 
-    while wsaver.isAlive():  # While the display thread has not died, dispatch him the windows messsages
+    while wsaver.is_alive():  # While the display thread has not died, dispatch him the windows messsages
     
         # Are there Windows messages waiting ?
         if ctypes.windll.user32.PeekMessageA( pMsg, NULL, 0, 0, win32con.PM_NOREMOVE) !=0:
@@ -283,7 +286,7 @@ def messageLoop(assembler_sup, config):
         # Is delay elapsed ?  If yes, generate a new image.
         if (time.time()-start_time > config["program.every"]) or (time.time()<start_time):
             # Has the image generation thread completed ?
-            if (generateImageThread==None or (not generateImageThread.isAlive())):  # If we have no thread or the thread has completed:
+            if (generateImageThread==None or (not generateImageThread.is_alive())):  # If we have no thread or the thread has completed:
                 # We start image generation in a new thread so that the screensaver windows
                 # is more responsive and close as soon as mouse is moved.
                 # (Even if the image generation and collector threads are still running.)
@@ -296,7 +299,7 @@ def messageLoop(assembler_sup, config):
     
     assembler_sup.shutdown()
     # Make sure generateImageThread is dead.
-    if generateImageThread.isAlive():
+    if generateImageThread.is_alive():
         generateImageThread.join()
     wsaver.join()
 
@@ -14,7 +14,8 @@
 # _ Minor corrections.
 # _ Hide the cursor when the screensaver is running
 
-import time, threading, os, logging
+import time, threading, os, logging, select
+from utils.freeze_imports import Image
 try:
     import ctypes
 except ImportError:
@@ -66,15 +67,73 @@ class XGCValues(ctypes.Structure):
             ("dash_offset",ctypes.c_int),
             ("dashes",ctypes.c_byte)]
 
-# XEvent Structure defined in X11/Xlib.h. It contains the datas about an Event queued in a Window.
+# XMotionEvent Structure defined in X11/Xlib.h. It is the XEvent of the mouse moves.
+class XMotionEvent(ctypes.Structure):
+    _fields_ = [("type",ctypes.c_int),
+        ("serial",ctypes.c_ulong),
+        ("send_event",ctypes.c_int),#Bool type
+        ("display",ctypes.c_void_p),
+        ("window",ctypes.c_ulong),
+        ("root",ctypes.c_ulong),
+        ("subwindow",ctypes.c_ulong),
+        ("time",ctypes.c_ulong),
+        ("x",ctypes.c_int),
+        ("y",ctypes.c_int),
+        ("x_root",ctypes.c_int),
+        ("y_root",ctypes.c_int),
+        ("state",ctypes.c_uint),
+        ("is_hint",ctypes.c_char),
+        ("same_screen",ctypes.c_int)]#Bool type
+
+# XEvent Union defined in X11/Xlib.h. It contains the datas about an Event queued in a Window.
 # It's like a MSG in Microsoft Windows API
-class XEvent(ctypes.Structure):
-    # We only need the "type" field.
-    # The whole Structure is 96 bytes long (given by sizeof C operator, sum of all fields is lesser). "type" is 4 octets. 
-    # We don't need to describe other fields which are complex Structure types.
-    # It would be too hard to define them. We only need to define their size so we summarize them in a tab of 92 bytes
+class XEvent(ctypes.Union):
+    # We only need the "type" field and the mouse moves. The other event types are not described:
+    # "pad" gives the union its real size (24 longs: 96 bytes on 32 bits systems, 192 bytes on 64 bits systems.)
     _fields_ =[("type",ctypes.c_int),
-        ("all_other",ctypes.c_byte * 92)] 
+        ("xmotion",XMotionEvent),
+        ("pad",ctypes.c_long * 24)]
+
+# Visual Structure defined in X11/Xlib.h. We need the color masks to know the layout of the pixels of the screen.
+class Visual(ctypes.Structure):
+    _fields_ = [("ext_data",ctypes.c_void_p),
+        ("visualid",ctypes.c_ulong),
+        ("c_class",ctypes.c_int),
+        ("red_mask",ctypes.c_ulong),
+        ("green_mask",ctypes.c_ulong),
+        ("blue_mask",ctypes.c_ulong),
+        ("bits_per_rgb",ctypes.c_int),
+        ("map_entries",ctypes.c_int)]
+
+# XImage Structure defined in X11/Xlib.h. It describes an image in the client memory (sent to the server with XPutImage)
+class XImage(ctypes.Structure):
+    _fields_ = [("width",ctypes.c_int),
+        ("height",ctypes.c_int),
+        ("xoffset",ctypes.c_int),
+        ("format",ctypes.c_int),
+        ("data",ctypes.c_void_p),
+        ("byte_order",ctypes.c_int),
+        ("bitmap_unit",ctypes.c_int),
+        ("bitmap_bit_order",ctypes.c_int),
+        ("bitmap_pad",ctypes.c_int),
+        ("depth",ctypes.c_int),
+        ("bytes_per_line",ctypes.c_int),
+        ("bits_per_pixel",ctypes.c_int),
+        ("red_mask",ctypes.c_ulong),
+        ("green_mask",ctypes.c_ulong),
+        ("blue_mask",ctypes.c_ulong),
+        ("obdata",ctypes.c_void_p),
+        ("funcs",ctypes.c_void_p * 6)] # (The image manipulation routines: we do not use them.)
+
+# XShmSegmentInfo Structure defined in X11/extensions/XShm.h. It describes a shared memory segment of the MIT-SHM extension.
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [("shmseg",ctypes.c_ulong),
+        ("shmid",ctypes.c_int),
+        ("shmaddr",ctypes.c_void_p),
+        ("readOnly",ctypes.c_int)]
+
+# Type of the X error handlers (see XSetErrorHandler)
+XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
 
 # XColor Structure defined in X11/Xlib.h. It contains a color's properties
 class XColor(ctypes.Structure):
@@ -89,16 +148,202 @@ class X11_con:
     CWOverrideRedirect=1<<9
     CWCursor=1<<14
     KeyPressMask=1<<0
+    ButtonPressMask=1<<2
+    PointerMotionMask=1<<6
     RevertToParent=2
     CurrentTime=0
     KeyPress= 2
-    
+    ButtonPress=4
+    MotionNotify=6
+    ZPixmap=2
+    LSBFirst=0
+    MSBFirst=1
+
+# System V shared memory constants (sys/ipc.h, sys/shm.h)
+IPC_PRIVATE=0
+IPC_CREAT=0o1000
+IPC_RMID=0
+
+def ximageRawmode(bits_per_pixel, byte_order, red_mask, green_mask, blue_mask):
+    ''' Returns the PIL raw mode of the pixels of an XImage ('BGRX', 'RGB'...), so that
+        image.tobytes('raw',rawmode,bytes_per_line) gives the XImage data of an 'RGB' image,
+        or None if the layout is not supported (eg. 16 bits per pixel.)
+    '''
+    if (red_mask,green_mask,blue_mask) == (0xff0000,0x00ff00,0x0000ff):
+        layouts = {(32,X11_con.LSBFirst):'BGRX', (32,X11_con.MSBFirst):'XRGB', (24,X11_con.LSBFirst):'BGR', (24,X11_con.MSBFirst):'RGB'}
+    elif (red_mask,green_mask,blue_mask) == (0x0000ff,0x00ff00,0xff0000):
+        layouts = {(32,X11_con.LSBFirst):'RGBX', (32,X11_con.MSBFirst):'XBGR', (24,X11_con.LSBFirst):'RGB', (24,X11_con.MSBFirst):'BGR'}
+    else:
+        return None
+    return layouts.get((bits_per_pixel,byte_order))
+
+class ximageBlitter:
+    '''Sends whole images to a drawable (window or pixmap) of the X server with a single XPutImage request,
+    or with XShmPutImage if the MIT-SHM extension is available (the pixels are then written in a shared memory
+    segment instead of being sent through the X connection.)
+    The pixels must be given in the layout of the screen: image.tobytes('raw',blitter.rawmode,blitter.bytes_per_line).
+    xlib, xext and libc are the ctypes libraries (or objects with the same functions, for testing.)
+    Raises OSError if the screen layout is not supported (see ximageRawmode()).
+
+    Example:
+        blitter=ximageBlitter(xlib,display,screen,pixmap,gc,1024,768,xext,libc)
+        blitter.put(image.tobytes('raw',blitter.rawmode,blitter.bytes_per_line))
+        blitter.destroy()'''
+
+    def __init__(self, xlib, display, screen, drawable, gc, width, height, xext=None, libc=None):
+        self.xlib=xlib
+        self.xext=xext
+        self.libc=libc
+        self.display=display
+        self.drawable=drawable
+        self.gc=gc
+        self.width=width
+        self.height=height
+        self.ximage=None    # The XImage (XImage structure)
+        self.shminfo=None   # The shared memory segment of the XImage (None if MIT-SHM is not used)
+        self.buffer=None    # The pixels of the XImage (if MIT-SHM is not used)
+        self.xlib.XDefaultVisual.restype=ctypes.c_void_p
+        self.xlib.XCreateImage.restype=ctypes.POINTER(XImage)
+        visual=ctypes.c_void_p(self.xlib.XDefaultVisual(display,screen))
+        depth=self.xlib.XDefaultDepth(display,screen)
+        if not (xext and libc and self.xext.XShmQueryExtension(display) and self._createShmImage(visual,depth)):
+            ximage=self.xlib.XCreateImage(display,visual,depth,X11_con.ZPixmap,0,None,width,height,32,0)
+            if not ximage:
+                raise OSError("Could not create XImage.")
+            self.ximage=ximage.contents
+            self.buffer=ctypes.create_string_buffer(self.ximage.bytes_per_line*height)
+            self.ximage.data=ctypes.addressof(self.buffer)
+        self.bytes_per_line=self.ximage.bytes_per_line
+        visualinfo=ctypes.cast(visual,ctypes.POINTER(Visual)).contents
+        self.rawmode=ximageRawmode(self.ximage.bits_per_pixel,self.ximage.byte_order,visualinfo.red_mask,visualinfo.green_mask,visualinfo.blue_mask)
+        if self.rawmode is None:
+            bits_per_pixel=self.ximage.bits_per_pixel
+            self.destroy()
+            raise OSError("Unsupported screen layout (%d bits per pixel)." % bits_per_pixel)
+
+    def _createShmImage(self, visual, depth):
+        '''Creates the XImage in a shared memory segment. Returns False if MIT-SHM cannot be used (eg. remote display.)'''
+        self.xext.XShmCreateImage.restype=ctypes.POINTER(XImage)
+        self.libc.shmat.restype=ctypes.c_void_p
+        shminfo=XShmSegmentInfo()
+        ximage=self.xext.XShmCreateImage(self.display,visual,depth,X11_con.ZPixmap,None,ctypes.byref(shminfo),self.width,self.height)
+        if not ximage:
+            return False
+        ximage=ximage.contents
+        shminfo.shmid=self.libc.shmget(IPC_PRIVATE,ximage.bytes_per_line*self.height,IPC_CREAT|0o600)
+        if shminfo.shmid<0:
+            self._destroyXImage(ximage)
+            return False
+        shminfo.shmaddr=self.libc.shmat(shminfo.shmid,None,0)
+        if shminfo.shmaddr in (None,ctypes.c_void_p(-1).value):
+            self.libc.shmctl(shminfo.shmid,IPC_RMID,None)
+            self._destroyXImage(ximage)
+            return False
+        ximage.data=shminfo.shmaddr
+        shminfo.readOnly=0
+        # The server cannot attach the segment if it is on another computer: catch the X error
+        # (the default error handler would exit the program.)
+        errors=[]
+        handler=XErrorHandler(lambda display,event: errors.append(event) or 0)
+        self.xlib.XSetErrorHandler.restype=XErrorHandler
+        previous=self.xlib.XSetErrorHandler(handler)
+        attached=self.xext.XShmAttach(self.display,ctypes.byref(shminfo))
+        self.xlib.XSync(self.display,0)
+        self.xlib.XSetErrorHandler(previous)
+        self.libc.shmctl(shminfo.shmid,IPC_RMID,None)  # (The segment is destroyed when both processes have detached it.)
+        if not attached or errors:
+            self._destroyXImage(ximage)
+            self.libc.shmdt(ctypes.c_void_p(shminfo.shmaddr))
+            return False
+        self.ximage=ximage
+        self.shminfo=shminfo
+        return True
+
+    def _destroyXImage(self, ximage):
+        ximage.data=None  # (The pixels are not allocated by Xlib: do not let XDestroyImage free them.)
+        self.xlib.XDestroyImage(ctypes.byref(ximage))
+
+    def put(self, data):
+        '''Sends an image to the drawable. data (bytes) : the pixels, in the layout of the screen.'''
+        ctypes.memmove(self.ximage.data,data,min(len(data),self.bytes_per_line*self.height))
+        if self.shminfo:
+            self.xext.XShmPutImage(self.display,self.drawable,self.gc,ctypes.byref(self.ximage),0,0,0,0,self.width,self.height,0)
+            self.xlib.XSync(self.display,0)  # (Do not write in the segment before the server has read it.)
+        else:
+            self.xlib.XPutImage(self.display,self.drawable,self.gc,ctypes.byref(self.ximage),0,0,0,0,self.width,self.height)
+
+    def destroy(self):
+        if self.ximage is None:
+            return
+        if self.shminfo:
+            self.xext.XShmDetach(self.display,ctypes.byref(self.shminfo))
+            self.libc.shmdt(ctypes.c_void_p(self.shminfo.shmaddr))
+            self.shminfo=None
+        self._destroyXImage(self.ximage)
+        self.ximage=None
+
+
+class transitionRenderer:
+    '''Renders a crossfade between two images (pixel buffers in the same layout) at a target frame rate.
+    The blending coefficient of each frame depends on the time elapsed since the start of the transition:
+    when a frame takes too long to render and display, the next frames are dropped and the transition
+    still lasts the same duration.
+
+    Example:
+        transition=transitionRenderer('BGRX',1024,768,4096,fps=25,duration=2.0)
+        for frame in transition.frames(oldpixels,newpixels):
+            blitter.put(frame)  # (the last frame is newpixels)
+        print transition.stats  # achieved frame rate, cost of the frames...'''
+
+    def __init__(self, rawmode, width, height, bytes_per_line=0, fps=25, duration=2.0):
+        self.rawmode=rawmode
+        self.mode='RGB' if len(rawmode)==3 else 'RGBA'  # (The blending is the same for all bands: the band order does not matter.)
+        self.size=(width,height)
+        self.bytes_per_line=bytes_per_line
+        self.fps=max(1,fps)
+        self.duration=duration
+        self.stats=None  # Statistics of the last transition (dictionnary: frames, dropped, fps, framecost (seconds per frame))
+        self.clock=time.time  # Clock of the transitions (can be replaced for testing, with the matching sleep function)
+        self.sleep=time.sleep
+
+    def frames(self, old, new):
+        '''Yields the frames (bytes) of the transition from the pixels old to the pixels new.
+        The generator waits for the time of the next frame before computing it.'''
+        # Wrap the buffers in PIL images (without copying them) so that the blending is done by PIL:
+        oldimage=Image.frombuffer(self.mode,self.size,old,'raw',self.mode,self.bytes_per_line,1)
+        newimage=Image.frombuffer(self.mode,self.size,new,'raw',self.mode,self.bytes_per_line,1)
+        period=1.0/self.fps
+        start=self.clock()
+        (frames,dropped,cost)=(0,0,0.0)
+        frame=1  # Number of the next frame
+        while True:
+            now=self.clock()
+            elapsed=now-start
+            if elapsed>=self.duration:
+                break
+            yield Image.blend(oldimage,newimage,elapsed/self.duration).tobytes('raw',self.mode,self.bytes_per_line)
+            frames+=1
+            cost+=self.clock()-now  # (Including the time the caller took to display the frame)
+            # Wait for the next frame, or drop the frames we are late for:
+            late=int((self.clock()-start)/period)-frame
+            if late>0:
+                dropped+=late
+                frame+=late
+            self.sleep(max(0,start+frame*period-self.clock()))
+            frame+=1
+        yield new
+        elapsed=self.clock()-start
+        self.stats={'frames':frames+1, 'dropped':dropped, 'fps':(frames+1)/elapsed if elapsed>0 else 0.0, 'framecost':cost/frames if frames else 0.0}
+        logging.getLogger('XWindowScreensaver').debug("Transition: %(frames)d frames (%(dropped)d dropped), %(fps).1f frames per second, %(framecost).4f seconds per frame." % self.stats)
+
 
 class x11screensaver(threading.Thread):
     '''The ScreenSaver Class which deals with X11 API. It works in a single Thread.
     Operations related to X11 have to be in the same thread unless you want to get X11 request errors.
     Unlike Microsoft Windows's WNDPROC Callback function, the window events can be processed outside the main Thread, 
-    but have to be in the same thread than other x11 operations'''
+    but have to be in the same thread than other x11 operations.
+    The thread sleeps until an X event is received (on the X connection socket) or an image is given by set_image()
+    (which wakes it up through a pipe.) self.stopped is set when the thread exits.'''
 
     def __init__(self, config):
         threading.Thread.__init__(self)
@@ -110,12 +355,24 @@ class x11screensaver(threading.Thread):
         self.width=config['assembler.sizex']
         self.height=config['assembler.sizey']
         self.quit=False # When True => this thread has to stop itself
-        self.img=None   # The image pixels given by the assembler and PIL
+        self.img=None   # The pixels of the image given by the assembler (bytes, in the layout self.rawmode,self.bytes_per_line)
+        self.blitter=None # Sends the images to the X server (ximageBlitter object) (None if the screen layout is not supported.)
+        self.rawmode='RGB' # Layout of the pixels expected by set_image() (PIL raw mode)
+        self.bytes_per_line=0 # Size of each line of pixels expected by set_image() (0 = no padding)
+        self.current=None # The pixels of the image displayed
+        self.lock=threading.Lock() # Lock for self.img (given by other threads)
+        self.stopped=threading.Event() # Set when this thread exits (a key was pressed or the mouse moved)
+        (self.wakeup_read,self.wakeup_write)=os.pipe() # set_image() writes in this pipe to wake up the thread
+        os.set_blocking(self.wakeup_write,False)
+        self.transition=None # Renders the transitions between images (transitionRenderer object) (None = no transition)
         
         # Connection to the X-server
-        self.display=self.xlib.XOpenDisplay(0)
-        if self.display == 0:
+        self.xlib.XOpenDisplay.restype=ctypes.c_void_p  # (Pointers do not fit in the default int return type.)
+        self.xlib.XCreateGC.restype=ctypes.c_void_p
+        display=self.xlib.XOpenDisplay(None)
+        if not display:
             raise OSError("I can't connect to your X server. Did you launch it?")
+        self.display=ctypes.c_void_p(display)
         # Default Screen
         self.screen=self.xlib.XDefaultScreen(self.display)
         # The window parent
@@ -143,11 +400,24 @@ class x11screensaver(threading.Thread):
         # Get a Graphical Context on our Pixmap with a default black colored foreground "pencil"
         self.gc_values=XGCValues()
         self.gc_values.foreground=0x000000
-        self.gc=self.xlib.XCreateGC(self.display, self.pixmap, X11_con.GCForeground, ctypes.byref(self.gc_values) )
+        self.gc=ctypes.c_void_p(self.xlib.XCreateGC(self.display, self.pixmap, X11_con.GCForeground, ctypes.byref(self.gc_values) ))
+        # The images are sent to the pixmap in a single request (through shared memory if possible)
+        xext_path=get_unix_lib('libXext.so')
+        try:
+            self.blitter=ximageBlitter(self.xlib, self.display, self.screen, self.pixmap, self.gc, self.width, self.height,
+                                       ctypes.CDLL(xext_path) if xext_path else None, ctypes.CDLL(None))
+            (self.rawmode,self.bytes_per_line)=(self.blitter.rawmode,self.blitter.bytes_per_line)
+            if config['screensaver.transition.duration']>0:
+                self.transition=transitionRenderer(self.rawmode,self.width,self.height,self.bytes_per_line,
+                                                   config['screensaver.transition.fps'],config['screensaver.transition.duration'])
+        except OSError as exc:
+            logging.getLogger('XWindowScreensaver').warning("%s Images will be drawn pixel by pixel (slow)." % exc)
         # Display this window
         self.xlib.XMapWindow(self.display, self.window) 
-        # We only want to receive the "KeyPress" Events (but we will process the mouse-move events too)
-        self.xlib.XSelectInput(self.display, self.window, X11_con.KeyPressMask)
+        # We only want to receive the "KeyPress", mouse button and mouse-move Events
+        self.xlib.XSelectInput(self.display, self.window, X11_con.KeyPressMask | X11_con.ButtonPressMask | X11_con.PointerMotionMask)
+        # The socket of the X connection: the thread waits for events on it.
+        self.connection=self.xlib.XConnectionNumber(self.display)
         # Focus on our Window
         self.xlib.XSetInputFocus(self.display,self.window, X11_con.RevertToParent, X11_con.CurrentTime) 
         self.xlib.XFlush(self.display)
@@ -158,52 +428,91 @@ class x11screensaver(threading.Thread):
         self.mouse_y=mouse_pos[1]
 
     def set_image(self,img):
-        '''Let the assembler send us an Image. Only a list of Pixel 
-        values is accepted. Each Pixel should be a tuple of three (R/G/B) values'''
-        # Wait if the previous image is still processing
-        while self.img:
-            if self.quit: return # If this thread is leaving, we don't need to wait with this new image
-            time.sleep(0.05)
-        self.img=img
-    
-    def paint_image(self):
-        '''Paint the image stored in self.img to the screen.
+        '''Let the assembler send us an Image: its pixels (bytes) in the layout of the screen
+        (see assembler_superpose.getImageBuffer(self.rawmode,self.bytes_per_line))
+        This call is non-blocking: if the previous image is not displayed yet, it is replaced by this one.'''
+        with self.lock:
+            if self.quit: return # If this thread is leaving, we don't need this new image
+            self.img=img
+            try:
+                os.write(self.wakeup_write,b'i') # Wake up the thread
+            except BlockingIOError:
+                pass # (The thread has not read the previous wake-ups yet: it will see the image anyway.)
+
+    def paint_image(self,img):
+        '''Paint an image (its pixels) to the screen.
+        The pixels are sent in a single XPutImage (or XShmPutImage) request to a Pixmap buffer.'''
+        if self.transition and self.current:
+            # Crossfade from the displayed image to the new one:
+            for frame in self.transition.frames(self.current,img):
+                self.blitter.put(frame)
+                self.show_pixmap()
+                self.msgproc() # (Events are processed between the frames.)
+                if self.quit:return
+        elif self.blitter:
+            self.blitter.put(img)
+            self.show_pixmap()
+        else:
+            self.draw_points(img)
+            if self.quit:return
+            self.show_pixmap()
+        self.current=img
+
+    def show_pixmap(self):
+        '''Copy the Pixmap buffer in our window'''
+        self.xlib.XCopyArea(self.display, self.pixmap, self.window, self.gc, 0, 0, self.width, self.height, 0, 0)
+        self.xlib.XFlush(self.display)
+
+    def draw_points(self,pixels):
+        '''Draw the pixels ('RGB' bytes) one by one on the Pixmap buffer (when the screen layout is not supported by ximageBlitter).
         FIXME: This method is really slow (almost 12 sec on an Athlon XP 2000) because all pixels have to be merged and set one by one
         on a Pixmap buffer. And the GC foreground s'color have to be changed for each pixel'''
-
-        if not self.img: # No image queued at this time
-            time.sleep(0.05) # CPU....
-            return
-        k=0 # the current pixel in our image
+        k=0 # offset of the current pixel in pixels
         # Set all the pixels
         for i in range(self.height):
             if i%3: self.msgproc() # All three lines of pixels processed, we launch the Event Process to check KeyPress and Mouse Moves.
             if self.quit:return
             for j in range(self.width):
                 # Merge the (R/G/B) values of this pixel
-                self.gc_values.foreground=(self.img[k][0] << 16) | (self.img[k][1] << 8) | self.img[k][2]
-                k+=1
+                self.gc_values.foreground=(pixels[k] << 16) | (pixels[k+1] << 8) | pixels[k+2]
+                k+=3
                 # Draw this point in pixmap buffer
                 self.xlib.XChangeGC(self.display, self.gc, X11_con.GCForeground, ctypes.byref(self.gc_values) )
                 self.xlib.XDrawPoint(self.display, self.pixmap, self.gc, j, i)
-        # Copy this Pixmap in our window
-        self.xlib.XCopyArea(self.display, self.pixmap, self.window, self.gc, 0, 0, self.width, self.height, 0, 0)
-        self.xlib.XFlush(self.display)
-        self.img=None # Erase this old image
 
     def shutdown(self):
-        '''Launch it everywhere to stop this thread'''
+        '''Stop this thread (must be called by this thread: see msgproc())'''
+        if self.blitter:
+            self.blitter.destroy()
+            self.blitter=None
         # Close this window
         self.xlib.XDestroyWindow(self.display, self.window)
         self.xlib.XCloseDisplay(self.display)
         self.msgproc=lambda:None # Do not check events from a no more existent display to avoid segmentation fault
-        self.quit=True
+        with self.lock:
+            self.quit=True
 
     def run(self):
-        '''Main Loop of this thread'''
-        while not self.quit:
-            self.paint_image()
-            self.msgproc() # We just processed an image or we have no one. So we process the Window Events
+        '''Main Loop of this thread: processes the Window Events and paints the images given by set_image()'''
+        try:
+            while not self.quit:
+                self.msgproc() # Process the Window Events already received
+                if self.quit: break
+                with self.lock:
+                    (img,self.img)=(self.img,None)
+                if img:
+                    self.paint_image(img)
+                    continue
+                # Sleep until an event arrives on the X connection or set_image() wakes us up:
+                (readable,writable,exceptional)=select.select([self.connection,self.wakeup_read],[],[])
+                if self.wakeup_read in readable:
+                    os.read(self.wakeup_read,4096)
+        finally:
+            with self.lock:
+                self.quit=True
+            os.close(self.wakeup_read)
+            os.close(self.wakeup_write)
+            self.stopped.set()
 
     def get_mouse_pos(self):
         '''Get the mouse position on our window'''
@@ -218,24 +527,20 @@ class x11screensaver(threading.Thread):
         return tuple( (current_x.value, current_y.value) )
         
     def msgproc(self):
-        '''Window Event processing. It not a traditionnal one because we don't check the mouse movements toward the Window Events'''
-        mouse_pos=self.get_mouse_pos()
-        current_x=mouse_pos[0]
-        current_y=mouse_pos[1]
-        # FIXME: It compare mouse position with the initial one. Can I do this with the events?
-        if abs(self.mouse_x - current_x)>=10  or abs(self.mouse_y - current_y)>=10: #If mouse moved in 10 pixel: shutdown
-            self.shutdown()
-            return
-
-        # Check the events
+        '''Window Event processing (non-blocking: only the events already received are processed.)'''
         event=XEvent()
-        num_events=self.xlib.XPending(self.display)
+        num_events=self.xlib.XPending(self.display) # (Reads the events available on the X connection.)
         while(num_events):
             self.xlib.XNextEvent(self.display, ctypes.byref(event) )
-            # If you pressed any key. I will close this window
-            if event.type == X11_con.KeyPress:
+            # If you pressed any key or mouse button. I will close this window
+            if event.type in (X11_con.KeyPress, X11_con.ButtonPress):
                 self.shutdown()
                 return
+            # It compares mouse position with the initial one.
+            if event.type == X11_con.MotionNotify:
+                if abs(self.mouse_x - event.xmotion.x)>=10  or abs(self.mouse_y - event.xmotion.y)>=10: #If mouse moved in 10 pixel: shutdown
+                    self.shutdown()
+                    return
             num_events-=1
 
 def no_xlib():
@@ -265,9 +570,11 @@ def getScreenResolution():
         no_xlib()
     xlib=ctypes.CDLL(xlib_path)
     # Connect to the x server...
-    display=xlib.XOpenDisplay(0)    
-    if display == 0:
+    xlib.XOpenDisplay.restype=ctypes.c_void_p
+    display=xlib.XOpenDisplay(None)
+    if not display:
         raise OSError("I can't connect to your X server. Did you launch it?")
+    display=ctypes.c_void_p(display)
     screen=xlib.XDefaultScreen(display)
     # Get the height and width and return it in a tuple: (x, y)
     height=xlib.XDisplayHeight(display, screen)
@@ -282,11 +589,23 @@ def generateNewImage(assembler_sup,config,wsaver):
     log = logging.getLogger('XWindowScreensaver')    
     log.info("Generating a new image now with %d new images" % config["assembler.superpose.nbimages"])
     log.info("XWindowScreensaver: (Next image in %d seconds.)" % config["program.every"])
-    assembler_sup.superposeB()   # Generate new image
-    image = assembler_sup.getImage()
-    if image != None:
-        wsaver.set_image(image.getdata())  # Send the image to the screensaver.
+    previewListener = None
+    if config["assembler.superpose.previewevery"] > 0:  # Display the previews of the image being generated.
+        previewListener = lambda preview: wsaver.set_image(preview.tobytes('raw',wsaver.rawmode,wsaver.bytes_per_line))
+    assembler_sup.superposeB(previewListener)   # Generate new image
+    pixels = assembler_sup.getImageBuffer(wsaver.rawmode,wsaver.bytes_per_line)
+    if pixels != None:
+        wsaver.set_image(pixels)  # Send the image to the screensaver.
+
+
 
+def generateImages(assembler_sup,config,wsaver):
+    ''' Generate a new image every program.every seconds, until the screensaver window is closed. '''
+    while not wsaver.stopped.is_set():
+        start_time = time.time()
+        generateNewImage(assembler_sup,config,wsaver)
+        # Wait for the delay (or for the window to be closed):
+        wsaver.stopped.wait(max(0,start_time+config["program.every"]-time.time()))
 
 
 def Loop(assembler_sup, config):
@@ -295,32 +614,23 @@ def Loop(assembler_sup, config):
     # Launch x11screensaver thread
     wsaver = x11screensaver(config)
     wsaver.start()
-    wsaver.set_image(assembler_sup.getImage().getdata() )
+    wsaver.set_image(assembler_sup.getImageBuffer(wsaver.rawmode,wsaver.bytes_per_line))
     
     log = logging.getLogger('XWindowScreensaver')
     log.info("Next image in %d seconds." % config["program.every"])
 
-    # Start to generate a new images right now.    
-    generateImageThread = threading.Thread(target=generateNewImage, args=(assembler_sup,config,wsaver))
+    # Start to generate new images right now.
+    # We generate images in another thread so that the screensaver window
+    # is responsive and closes as soon as mouse is moved.
+    # (Even if the image generation and collector threads are still running.)
+    generateImageThread = threading.Thread(target=generateImages, args=(assembler_sup,config,wsaver))
     generateImageThread.start()
-    start_time = time.time()
-
-    while wsaver.isAlive():  # While the display thread has not died, send him images
-        # Is delay elapsed ?  If yes, generate a new image.
-        if (time.time()-start_time > config["program.every"]) or (time.time()<start_time):
-            if (generateImageThread==None or (not generateImageThread.isAlive())):  # If we have no thread or the thread has completed:
-                    # We start image generation in a new thread so that the screensaver windows
-                    # is more responsive and close as soon as mouse is moved.
-                    # (Even if the image generation and collector threads are still running.)
-                    generateImageThread = threading.Thread(target=generateNewImage, args=(assembler_sup,config,wsaver))
-                    generateImageThread.start()
-                    start_time = time.time()
-            
-        time.sleep(0.05)  # Ben gentle on CPU usage.
+
+    wsaver.stopped.wait()  # Wait until the display thread has exited.
 
     # Close threads
     assembler_sup.shutdown()
-    if generateImageThread.isAlive():
+    if generateImageThread.is_alive():
         generateImageThread.join()
 
 